@@ -0,0 +1,138 @@
+"""
+latency budget and admission control of the recommendation pages
+- a deadline starts when a request arrives: the sections of the page computed after the deadline are served from
+  precomputed results (precomputed recommendations or popularity rankings) and the page is marked as degraded
+- at most max_concurrent pages are computed at once, the next requests wait in a bounded queue and are shed when
+  the queue is full or when they waited too long
+"""
+from metrics import count_degraded, count_admission, in_flight
+import threading
+import time
+
+
+class Deadline:
+    """
+    latency budget of a request and sections served from precomputed results
+    """
+
+    def __init__(self, budget: float = 0):
+        """
+        :param budget: float: seconds before the deadline (0: no deadline)
+        """
+        self.end = time.perf_counter() + budget if budget > 0 else None
+        self.degraded = []
+
+    def expired(self) -> bool:
+        """
+        check if the budget of the request is exhausted
+        :return: bool: True if the deadline is passed
+        """
+        return self.end is not None and time.perf_counter() > self.end
+
+    def degrade(self, section: str):
+        """
+        record a section served from precomputed results
+        :param section: str: name of the section
+        """
+        self.degraded.append(section)
+        count_degraded(section)
+
+
+class Ticket:
+    """
+    slot of an admitted request, released once (end of the page or end of the response)
+    """
+
+    def __init__(self, admission: 'Admission'):
+        self.admission = admission
+        self.released = False
+
+    def release(self):
+        with self.admission.lock:
+            if self.released:
+                return
+            self.released = True
+        self.admission.release()
+
+    def hold(self, parts):
+        """
+        release the slot when a streamed page ends (or fails)
+        :param parts: generator: parts of the page
+        :return: generator: same parts
+        """
+        try:
+            yield from parts
+        finally:
+            self.release()
+
+
+class Admission:
+    """
+    bounded number of requests computed at once with a bounded queue of waiting requests
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int, timeout: float):
+        """
+        :param max_concurrent: int: number of requests computed at once (0: no limit)
+        :param max_queued: int: number of requests waiting for a slot, the next requests are shed
+        :param timeout: float: seconds a request waits for a slot before it is shed
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.slots = threading.Semaphore(max_concurrent) if max_concurrent > 0 else None
+        self.lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.counts = {'admitted': 0, 'queued': 0, 'shed': 0}
+
+    def count(self, outcome: str):
+        with self.lock:
+            self.counts[outcome] += 1
+            if outcome != 'shed':
+                self.running += 1
+            running = self.running
+        count_admission(outcome)
+        in_flight(running)
+
+    def acquire(self) -> Ticket:
+        """
+        admit a request: a free slot is taken at once, else the request waits in the queue
+        :return: Ticket: slot of the request (None if the request is shed)
+        """
+        if self.slots is None or self.slots.acquire(blocking=False):
+            self.count('admitted')
+            return Ticket(self)
+        with self.lock:
+            waiting = self.queued < self.max_queued
+            if waiting:
+                self.queued += 1
+        admitted = False
+        if waiting:
+            try:
+                admitted = self.slots.acquire(timeout=self.timeout)
+            finally:
+                with self.lock:
+                    self.queued -= 1
+        self.count('queued' if admitted else 'shed')
+        return Ticket(self) if admitted else None
+
+    def release(self):
+        """
+        release the slot of a request
+        """
+        with self.lock:
+            self.running -= 1
+            running = self.running
+        if self.slots is not None:
+            self.slots.release()
+        in_flight(running)
+
+    def stats(self) -> dict:
+        """
+        get the counters of the admission
+        :return: dict: limits, requests computed and waiting at the moment, admitted, queued and shed requests
+        """
+        with self.lock:
+            return {'max_concurrent': self.max_concurrent, 'max_queued': self.max_queued, 'running': self.running,
+                    'waiting': self.queued, **self.counts}
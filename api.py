@@ -1,10 +1,46 @@
-from fastapi import FastAPI, Request, Form
+from fastapi import FastAPI, Request, Form, HTTPException, Depends
+from pydantic import BaseModel
+from typing import List
 from fastapi.templating import Jinja2Templates
 from functions import *
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, JSONResponse
+from starlette.background import BackgroundTask
+from metrics import start_profile, server_timing, export
+from admission import Admission, Deadline
+from config import PROFILING_ENABLED, REQUEST_BUDGET, MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS, ADMISSION_TIMEOUT
+import threading
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates/")
+# recommendation pages computed at once, waiting requests are shed when the queue is full or after a timeout
+admission = Admission(MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS, ADMISSION_TIMEOUT)
+
+
+@app.on_event('startup')
+def start_warm_up():
+    # the api listens at once, the datasets are loaded and the code paths warmed up in the background
+    threading.Thread(target=warm_up, daemon=True).start()
+
+
+def require_ready():
+    # requests needing the datasets wait for the end of the warm-up
+    if not ready.is_set():
+        raise HTTPException(status_code=503, detail=f"warm-up in progress ({startup['status']})",
+                            headers={'Retry-After': '1'})
+    # a reload received by another worker reaches this one on its next request
+    follow_reloads()
+
+
+@app.get('/health/live')
+def liveness():
+    return {'status': 'alive'}
+
+
+@app.get('/health/ready')
+def readiness():
+    if not ready.is_set():
+        return JSONResponse(startup, status_code=503)
+    return startup
 
 
 @app.get("/recommandation")
@@ -13,10 +49,92 @@ def form_post(request: Request):
     return templates.TemplateResponse('recommandation.html', context={'request': request, 'result': result})
 
 
-@app.post('/recommandation', response_class=HTMLResponse)
+@app.post('/recommandation', response_class=HTMLResponse, dependencies=[Depends(require_ready), Depends(sync_ratings)])
 def form_post(request: Request, user_id: int = Form(None), category: str = Form(None), checkboxcategory: bool = Form(False)):
-    if get_html(user_id, category, checkboxcategory) == str(user_id):
+    if user_id is not None and user_id not in current().user_ratings:
         result = f'User id {user_id} not in database'
         return templates.TemplateResponse('recommandation.html', context={'request': request, 'result': result})
-    html = get_html(user_id, category, checkboxcategory)
-    return html
+    # the budget includes the time spent waiting for a slot
+    deadline = Deadline(REQUEST_BUDGET)
+    ticket = admission.acquire()
+    if ticket is None:
+        raise HTTPException(status_code=503, detail='too many requests, retry later', headers={'Retry-After': '1'})
+    if PROFILING_ENABLED and 'X-Profile' in request.headers:
+        # profiled pages are not streamed: the duration of the stages is known before the response is sent
+        stages = start_profile()
+        try:
+            html = get_html(user_id, category, checkboxcategory, deadline)
+        finally:
+            ticket.release()
+        headers = {'Server-Timing': server_timing(stages)}
+        if deadline.degraded:
+            headers['X-Degraded'] = ', '.join(deadline.degraded)
+        return HTMLResponse(html, headers=headers)
+    # the header of the page is sent before the recommendations are computed, the slot is released at the end of the
+    # page (or of the response if the page is not sent)
+    return StreamingResponse(ticket.hold(stream_html(user_id, category, checkboxcategory, deadline)),
+                             media_type='text/html', background=BackgroundTask(ticket.release))
+
+
+class BatchRequest(BaseModel):
+    user_ids: List[int]
+    n_books: int = 5
+    category: str = None
+    all_categories: bool = False
+
+
+@app.post('/recommandation/batch', dependencies=[Depends(require_ready), Depends(sync_ratings)])
+def batch_post(batch: BatchRequest):
+    return get_recommendations(batch.user_ids, batch.n_books, batch.category, batch.all_categories)
+
+
+class Rating(BaseModel):
+    user_id: int
+    book_id: int
+    rating: int
+
+
+class RatingsRequest(BaseModel):
+    ratings: List[Rating]
+
+
+@app.post('/ratings', dependencies=[Depends(require_ready)])
+def ratings_post(batch: RatingsRequest):
+    try:
+        return ingest_ratings([(rating.user_id, rating.book_id, rating.rating) for rating in batch.ratings])
+    except ValueError as error:
+        raise HTTPException(status_code=422, detail=str(error))
+
+
+@app.get('/ratings/stats', dependencies=[Depends(require_ready), Depends(sync_ratings)])
+def ratings_statistics():
+    return current().ratings_store.stats()
+
+
+@app.get('/cache/stats', dependencies=[Depends(require_ready)])
+def cache_statistics():
+    return cache_stats()
+
+
+@app.post('/reload', status_code=202, dependencies=[Depends(require_ready)])
+def reload_post():
+    # the next snapshot of the datasets is built in the background, the current one serves the requests meanwhile
+    if not start_reload():
+        raise HTTPException(status_code=409, detail='reload in progress')
+    return reload_stats()
+
+
+@app.get('/reload/stats', dependencies=[Depends(require_ready)])
+def reload_statistics():
+    return reload_stats()
+
+
+@app.get('/admission/stats')
+def admission_statistics():
+    return admission.stats()
+
+
+@app.get('/metrics')
+def metrics():
+    content, content_type = export()
+    return Response(content, media_type=content_type)
@@ -0,0 +1,66 @@
+"""
+throughput (users/second) of the batched recommendations compared to one user at a time
+- nearest users: get_n_nearest_users + get_top_n_books_nearest_users for each user, or get_n_nearest_users_batch
+- all sections: get_recommendations called for each user, or once for all users
+caches and precomputed recommendations are not used
+usage (from the main folder): python -m benchmarks.batch_throughput [--users 500]
+"""
+import numpy as np
+import functions
+import argparse
+import time
+
+
+def throughput(function, user_ids: list) -> float:
+    """
+    get the number of users computed per second
+    :param function: function computing the recommendations of a list of users
+    :param user_ids: list: ids of users
+    :return: float: users per second
+    """
+    start = time.perf_counter()
+    function(user_ids)
+    return len(user_ids) / (time.perf_counter() - start)
+
+
+def nearest_per_user(user_ids: list):
+    for user_id in user_ids:
+        nearest_users = functions.get_n_nearest_users.__wrapped__(user_id, 5)
+        functions.get_top_n_books_nearest_users(nearest_users, 5)
+
+
+def nearest_batch(user_ids: list):
+    for nearest_users in functions.get_n_nearest_users_batch(user_ids, 5):
+        functions.get_top_n_books_nearest_users(nearest_users, 5)
+
+
+def all_per_user(user_ids: list):
+    for user_id in user_ids:
+        functions.get_recommendations([user_id], use_precomputed=False)
+
+
+def all_batch(user_ids: list):
+    functions.get_recommendations(user_ids, use_precomputed=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=500, help='number of users')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    users = np.array(sorted(functions.current().user_ratings.user_ids))
+    user_ids = np.random.RandomState(0).choice(users, size=min(args.users, len(users)), replace=False).tolist()
+
+    print(f"{'section':>14} {'per user u/s':>13} {'batch u/s':>10} {'speedup':>8}")
+    for section, per_user, batch in (('nearest users', nearest_per_user, nearest_batch),
+                                     ('all sections', all_per_user, all_batch)):
+        per_user_throughput = throughput(per_user, user_ids)
+        batch_throughput = throughput(batch, user_ids)
+        print(f"{section:>14} {per_user_throughput:>13.0f} {batch_throughput:>10.0f} "
+              f"{batch_throughput / per_user_throughput:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
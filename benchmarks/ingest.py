@@ -0,0 +1,92 @@
+"""
+incremental ingestion of ratings
+- throughput of the ingestion (ratings/second) by batches of ratings of random (known and new) users
+- latency of the nearest users queries as ratings build up in the delta buffers, then after a compaction
+caches are not used, automatic compactions and the ratings log are disabled during the benchmark
+usage (from the main folder): python -m benchmarks.ingest [--batch-size 100] [--steps 1000,5000,10000,20000]
+"""
+import numpy as np
+import functions
+import argparse
+import time
+
+
+def random_ratings(random: np.random.RandomState, n_ratings: int, new_user_rate: float = 0.1) -> list:
+    """
+    draw random ratings of known users and of new users
+    :param random: np.random.RandomState: random generator
+    :param n_ratings: int: number of ratings
+    :param new_user_rate: float: share of the ratings given by new users
+    :return: list: (user id, book id, rating) tuples
+    """
+    n_users = max(functions.current().user_ratings.user_ids)
+    next_user_id = functions.current().ratings_store.state.next_user_id
+    new_users = random.rand(n_ratings) < new_user_rate
+    user_ids = random.randint(1, n_users + 1, n_ratings)
+    # new users get the next free ids in the order of their first rating
+    new_user_ids = random.randint(0, max(1, n_ratings // 20), int(new_users.sum()))
+    _, first, inverse = np.unique(new_user_ids, return_index=True, return_inverse=True)
+    user_ids[new_users] = next_user_id + np.argsort(np.argsort(first))[inverse]
+    book_ids = random.choice(functions.current().books['book_id'].values, n_ratings)
+    ratings = random.randint(1, 6, n_ratings)
+    return list(zip(user_ids.tolist(), book_ids.tolist(), ratings.tolist()))
+
+
+def query_latency(user_ids: list) -> tuple:
+    """
+    get the latency of the nearest users queries
+    :param user_ids: list: ids of users
+    :return: tuple: (p50, p95) in milliseconds
+    """
+    latencies = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        nearest_users = functions.get_n_nearest_users.__wrapped__(user_id, 5)
+        functions.get_top_n_books_nearest_users(nearest_users, 5)
+        latencies.append(time.perf_counter() - start)
+    return tuple(np.percentile(latencies, [50, 95]) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--batch-size', type=int, default=100, help='number of ratings per ingestion')
+    parser.add_argument('--steps', default='1000,5000,10000,20000',
+                        help='numbers of ingested ratings at which the queries are measured')
+    parser.add_argument('--queries', type=int, default=200, help='number of queries per measure')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    store = functions.current().ratings_store
+    store.compaction_threshold = float('inf')
+    store.compaction_interval = 0
+    # the ratings of the benchmark are not written to the ratings log of the datasets
+    store.log = None
+    random = np.random.RandomState(0)
+    users = sorted(functions.current().user_ratings.user_ids)
+    query_users = random.choice(users, size=min(args.queries, len(users)), replace=False).tolist()
+
+    p50, p95 = query_latency(query_users)
+    print(f"{'ingested':>9} {'delta users':>12} {'ingest r/s':>11} {'query p50 ms':>13} {'query p95 ms':>13}")
+    print(f"{0:>9} {0:>12} {'':>11} {p50:>13.2f} {p95:>13.2f}")
+    ingested = 0
+    for step in [int(step) for step in args.steps.split(',')]:
+        ratings = random_ratings(random, step - ingested)
+        start = time.perf_counter()
+        for batch_start in range(0, len(ratings), args.batch_size):
+            functions.ingest_ratings(ratings[batch_start:batch_start + args.batch_size])
+        throughput = len(ratings) / (time.perf_counter() - start)
+        ingested = step
+        p50, p95 = query_latency(query_users)
+        print(f"{ingested:>9} {store.stats()['delta_users']:>12} {throughput:>11.0f} {p50:>13.2f} {p95:>13.2f}")
+
+    start = time.perf_counter()
+    store.compact()
+    compaction = time.perf_counter() - start
+    p50, p95 = query_latency(query_users)
+    print(f"{'compacted':>9} {0:>12} {'':>11} {p50:>13.2f} {p95:>13.2f}")
+    print(f'compaction of {ingested} ratings: {compaction:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
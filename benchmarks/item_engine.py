@@ -0,0 +1,68 @@
+"""
+item-item engine compared with the user-user engine (nearest users)
+- time to compute the similar books of every book, with one process and with one process per core
+- latency of the collaborative section of a user with each engine, and overlap of the recommended books
+caches are not used
+usage (from the main folder): python -m benchmarks.item_engine [--users 500] [--k 50]
+"""
+from item_neighbors import ItemNeighbors
+import numpy as np
+import functions
+import argparse
+import time
+import os
+
+
+def latencies(function, user_ids: list) -> tuple:
+    """
+    get the latency of a function for each user and its results
+    :param function: function of a user id
+    :param user_ids: list: ids of users
+    :return: tuple: (latencies in milliseconds, results)
+    """
+    times, results = [], []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        results.append(function(user_id))
+        times.append((time.perf_counter() - start) * 1000)
+    return np.array(times), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=500, help='number of users')
+    parser.add_argument('--k', type=int, default=50, help='number of similar books per book')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    for n_jobs in sorted({1, os.cpu_count()}):
+        start = time.perf_counter()
+        item_neighbors = ItemNeighbors.build(functions.current().book_matrix, args.k, n_jobs=n_jobs)
+        print(f'build of the similar books with {n_jobs} process(es): {time.perf_counter() - start:.1f}s')
+    size = item_neighbors.neighbors.nbytes + item_neighbors.similarities.nbytes
+    print(f'similar books: {size / 2 ** 20:.1f} MiB')
+
+    users = np.array(sorted(functions.current().user_ratings.user_ids))
+    user_ids = np.random.RandomState(0).choice(users, size=min(args.users, len(users)), replace=False).tolist()
+
+    def user_engine(user_id: int) -> list:
+        nearest_users = functions.get_n_nearest_users.__wrapped__(user_id, 5)
+        return functions.get_top_n_books_nearest_users(nearest_users, 5)
+
+    def item_engine(user_id: int) -> list:
+        user_rating = functions.current().user_ratings.user_ratings(user_id)
+        return item_neighbors.recommend(user_rating['book_id'].values, user_rating['rating'].values, 5)
+
+    print(f"{'engine':>7} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    results = {}
+    for name, function in (('user', user_engine), ('item', item_engine)):
+        times, results[name] = latencies(function, user_ids)
+        print(f'{name:>7} {np.percentile(times, 50):>8.2f} {np.percentile(times, 95):>8.2f} {times.mean():>8.2f}')
+    overlap = np.mean([len(set(user_books) & set(item_books)) / max(len(user_books), 1)
+                       for user_books, item_books in zip(results['user'], results['item'])])
+    print(f'books recommended by both engines: {overlap:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+latency (p50, p95, p99) and peak memory of each public function and of the /recommandation POST
+caches and precomputed recommendations are not used (unless --cache), so every call computes its result
+results can be saved as a baseline and compared with a later run (exit code 1 if a latency regressed)
+synthetic datasets at the scale of goodreads can be generated with: python generate.py --output data/synthetic
+usage (from the main folder): [DATA_DIR=data/synthetic] python -m benchmarks.latency [--users 200]
+                              [--save benchmarks/baseline.json] [--baseline benchmarks/baseline.json]
+"""
+from fastapi.testclient import TestClient
+import numpy as np
+import functions
+import api
+import tracemalloc
+import argparse
+import resource
+import json
+import time
+import sys
+
+
+def build_cases(user_ids: list) -> dict:
+    """
+    build the measured calls, arguments depending on a user are computed before the measures
+    :param user_ids: list: ids of users
+    :return: dict: name -> function of a user id
+    """
+    nearest_users = {user_id: functions.get_n_nearest_users.__wrapped__(user_id, 5) for user_id in user_ids}
+    authors = {user_id: functions.get_top_author.__wrapped__(user_id) for user_id in user_ids}
+    books = {user_id: list(functions.current().user_ratings.books(user_id)[:5]) for user_id in user_ids}
+    client = TestClient(api.app)
+    return {
+        'get_n_nearest_users': lambda user_id: functions.get_n_nearest_users(user_id, 5),
+        'get_top_n_books_nearest_users':
+            lambda user_id: functions.get_top_n_books_nearest_users(nearest_users[user_id], 5),
+        'get_top_author': lambda user_id: functions.get_top_author(user_id),
+        'get_top_n_books_by_category': lambda user_id: functions.get_top_n_books_by_category('fantasy', 5, user_id),
+        'get_top_n_books': lambda user_id: functions.get_top_n_books(5, user_id),
+        'get_top_n_books_by_author':
+            lambda user_id: functions.get_top_n_books_by_author(authors[user_id], user_id, 5),
+        'get_book_name': lambda user_id: functions.get_book_name(books[user_id]),
+        'get_html': lambda user_id: functions.get_html(user_id, None, False),
+        'get_html (all categories)': lambda user_id: functions.get_html(user_id, None, True),
+        'get_recommendations': lambda user_id: functions.get_recommendations([user_id], use_precomputed=False),
+        'POST /recommandation': lambda user_id: client.post('/recommandation', data={'user_id': user_id}).text,
+    }
+
+
+def measure(function, user_ids: list, n_memory: int) -> dict:
+    """
+    measure the latency of a function for each user, then its peak memory on a few users
+    :param function: function of a user id
+    :param user_ids: list: ids of users
+    :param n_memory: int: number of users of the memory measure (slowed down by tracemalloc)
+    :return: dict: p50, p95 and p99 in milliseconds, peak of the allocations in KiB
+    """
+    latencies = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        function(user_id)
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    for user_id in user_ids[:n_memory]:
+        function(user_id)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'peak_kib': peak / 1024}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    compare the results with a baseline
+    :param results: dict: name -> measures of the current run
+    :param baseline: dict: name -> measures of the baseline
+    :param tolerance: float: accepted relative increase of p50 and p95 (0.25: 25% slower)
+    :return: list: names of the regressed measures
+    """
+    regressions = []
+    print(f"\n{'function':>30} {'p50 ratio':>10} {'p95 ratio':>10} {'peak ratio':>11}")
+    for name, measures in results.items():
+        if name not in baseline:
+            continue
+        ratios = {key: measures[key] / baseline[name][key] if baseline[name][key] else 1.0
+                  for key in ('p50', 'p95', 'peak_kib')}
+        regressed = ratios['p50'] > 1 + tolerance or ratios['p95'] > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:>30} {ratios['p50']:>9.2f}x {ratios['p95']:>9.2f}x {ratios['peak_kib']:>10.2f}x"
+              f"{'  regression' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=200, help='number of users measured per function')
+    parser.add_argument('--memory-users', type=int, default=10, help='number of users of the memory measures')
+    parser.add_argument('--cache', action='store_true', help='keep the caches (measures cached calls)')
+    parser.add_argument('--save', help='save the results as a baseline in this json file')
+    parser.add_argument('--baseline', help='compare the results with the baseline of this json file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='accepted relative latency increase')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    if not args.cache:
+        functions.results_cache.maxsize = 0
+        functions.page_cache.maxsize = 0
+        functions.results_cache.clear()
+    users = np.array(sorted(functions.current().user_ratings.user_ids))
+    user_ids = np.random.RandomState(0).choice(users, size=min(args.users, len(users)), replace=False).tolist()
+
+    results = {}
+    print(f"{'function':>30} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KiB':>10}")
+    for name, function in build_cases(user_ids).items():
+        # first call out of the measures (lazy initializations)
+        function(user_ids[0])
+        results[name] = measure(function, user_ids, args.memory_users)
+        measures = results[name]
+        print(f"{name:>30} {measures['p50']:>9.2f} {measures['p95']:>9.2f} {measures['p99']:>9.2f} "
+              f"{measures['peak_kib']:>10.0f}")
+    # peak resident memory of the process (datasets, indexes and every measured call)
+    print(f'peak resident memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB')
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'data_version': functions.current().data_version, 'users': len(user_ids), 'results': results},
+                      file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['data_version'] != functions.current().data_version:
+            print('warning: the baseline was measured on other datasets')
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
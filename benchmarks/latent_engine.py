@@ -0,0 +1,121 @@
+"""
+offline evaluation of the collaborative engines: user-user (nearest users), item-item and latent factors
+one rating (4 or 5 if possible) of each evaluated user is hidden, the engines are built without the hidden ratings
+- hit rate: share of users whose hidden book is in their top n recommendations
+- latency of one recommendation (p50, p95) and throughput of the batched latent factors
+usage (from the main folder): python -m benchmarks.latent_engine [--users 1000] [--n-books 10] [--components 64]
+"""
+from neighbors import CosineNeighborIndex
+from item_neighbors import ItemNeighbors
+from latent_factors import LatentFactors
+from rankings import weighted_rating, get_top_n_indexes
+from scipy.sparse import csr_matrix
+import numpy as np
+import functions
+import argparse
+import time
+
+
+def hide_ratings(matrix: csr_matrix, n_users: int, random: np.random.RandomState) -> tuple:
+    """
+    hide one rating of random users having at least 5 ratings
+    :param matrix: csr_matrix: matrix of ratings of users
+    :param n_users: int: number of evaluated users
+    :param random: np.random.RandomState: random generator
+    :return: tuple: (matrix without the hidden ratings, rows of the users, hidden book indexes)
+    """
+    matrix = csr_matrix(matrix, copy=True)
+    lengths = np.diff(matrix.indptr)
+    rows = random.choice(np.flatnonzero(lengths >= 5), size=min(n_users, int((lengths >= 5).sum())), replace=False)
+    hidden = []
+    for row in rows.tolist():
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        liked = np.flatnonzero(matrix.data[start:end] >= 4)
+        position = start + random.choice(liked if len(liked) else np.arange(end - start))
+        hidden.append(matrix.indices[position])
+        matrix.data[position] = 0
+    matrix.eliminate_zeros()
+    return matrix, rows, np.array(hidden)
+
+
+def user_engine(index: CosineNeighborIndex, matrix: csr_matrix, row: int, n_books: int) -> np.ndarray:
+    """
+    books of the nearest users of a user, scored like get_top_n_books_nearest_users
+    :return: np.ndarray: book indexes
+    """
+    nearest = [user for user in index.kneighbors(row, 5).tolist() if user != row][:4]
+    ratings = matrix[nearest]
+    book_count = np.bincount(ratings.indices, minlength=matrix.shape[1])
+    rating_sum = np.bincount(ratings.indices, weights=ratings.data, minlength=matrix.shape[1])
+    candidates = np.setdiff1d(np.flatnonzero(book_count), matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]])
+    if not len(candidates):
+        return candidates
+    scores = weighted_rating(book_count[candidates], rating_sum[candidates] / book_count[candidates],
+                             ratings.data.mean())
+    return candidates[get_top_n_indexes(scores, n_books)]
+
+
+def evaluate(recommend, rows: np.ndarray, hidden: np.ndarray) -> tuple:
+    """
+    get the hit rate and the latencies of an engine
+    :param recommend: function of a row returning recommended book indexes
+    :param rows: np.ndarray: rows of the evaluated users
+    :param hidden: np.ndarray: hidden book index of each user
+    :return: tuple: (hit rate, latencies in milliseconds)
+    """
+    hits, latencies = 0, []
+    for row, book in zip(rows.tolist(), hidden.tolist()):
+        start = time.perf_counter()
+        books = recommend(row)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += book in set(np.asarray(books).tolist())
+    return hits / len(rows), np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000, help='number of evaluated users')
+    parser.add_argument('--n-books', type=int, default=10, help='number of recommended books')
+    parser.add_argument('--components', type=int, default=64, help='number of latent factors')
+    parser.add_argument('--k', type=int, default=50, help='number of similar books per book (item engine)')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    matrix, rows, hidden = hide_ratings(functions.current().book_matrix, args.users, np.random.RandomState(0))
+    n_books = args.n_books
+
+    def read(row: int) -> tuple:
+        return (matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]] + 1,
+                matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]])
+
+    start = time.perf_counter()
+    index = CosineNeighborIndex(matrix)
+    print(f'user engine built in {time.perf_counter() - start:.1f}s')
+    start = time.perf_counter()
+    item_neighbors = ItemNeighbors.build(matrix, args.k)
+    print(f'item engine built in {time.perf_counter() - start:.1f}s')
+    start = time.perf_counter()
+    latent_factors = LatentFactors.build(matrix, args.components)
+    print(f'latent engine built in {time.perf_counter() - start:.1f}s')
+
+    def item_engine(row: int) -> np.ndarray:
+        return item_neighbors.recommend(*read(row), n_books) - 1
+
+    def latent_engine(row: int) -> np.ndarray:
+        return latent_factors.recommend(latent_factors.user_factors[row], read(row)[0], n_books) - 1
+
+    engines = {'user': lambda row: user_engine(index, matrix, row, n_books), 'item': item_engine,
+               'latent': latent_engine}
+    print(f"{'engine':>7} {'hit rate@' + str(n_books):>12} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, recommend in engines.items():
+        hit_rate, latencies = evaluate(recommend, rows, hidden)
+        print(f'{name:>7} {hit_rate:>12.1%} {np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 95):>8.3f}')
+
+    start = time.perf_counter()
+    latent_factors.recommend_batch(latent_factors.user_factors[rows], [read(row)[0] for row in rows.tolist()], n_books)
+    print(f'latent engine batch: {len(rows) / (time.perf_counter() - start):.0f} users/s')
+
+
+if __name__ == '__main__':
+    main()
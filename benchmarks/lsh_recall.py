@@ -0,0 +1,58 @@
+"""
+recall@k and latency of the lsh nearest users engine compared to the exact search
+usage (from the main folder): python -m benchmarks.lsh_recall [--queries 200] [--k 5]
+"""
+from scipy.sparse import csr_matrix
+from neighbors import CosineNeighborIndex, LSHNeighborIndex, recall_at_k
+import numpy as np
+import argparse
+import time
+
+
+def mean_latency(index: CosineNeighborIndex, row_indexes: list, k: int) -> float:
+    """
+    get the mean latency of a query
+    :param index: CosineNeighborIndex: index to query
+    :param row_indexes: list: rows used as queries
+    :param k: int: number of neighbors
+    :return: float: mean latency in milliseconds
+    """
+    start = time.perf_counter()
+    for row_index in row_indexes:
+        index.kneighbors(row_index, k)
+    return (time.perf_counter() - start) / len(row_indexes) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--matrix', default='data/csr_matrix.npz', help='path of the ratings matrix')
+    parser.add_argument('--queries', type=int, default=200, help='number of users used as queries')
+    parser.add_argument('--k', type=int, default=5, help='number of nearest users')
+    parser.add_argument('--tables', type=int, nargs='+', default=[4, 8, 16], help='numbers of hash tables to test')
+    parser.add_argument('--bits', type=int, nargs='+', default=[8, 12, 16], help='numbers of bits per hash to test')
+    args = parser.parse_args()
+
+    loader = np.load(args.matrix)
+    book_matrix = csr_matrix((loader['data'], loader['indices'], loader['indptr']), shape=loader['shape'])
+    row_indexes = np.random.RandomState(0).choice(book_matrix.shape[0], size=args.queries, replace=False)
+
+    exact = CosineNeighborIndex(book_matrix)
+    print(f"exact: {mean_latency(exact, row_indexes, args.k):.2f} ms/query")
+    # queries with fewer candidates than k fall back to the exact search (reported as 'fallback')
+    print(f"{'tables':>6} {'bits':>4} {'recall@' + str(args.k):>9} {'ms/query':>9} {'build s':>8} "
+          f"{'candidates':>10} {'fallback':>8}")
+    for n_tables in args.tables:
+        for n_bits in args.bits:
+            start = time.perf_counter()
+            lsh = LSHNeighborIndex(book_matrix, n_tables=n_tables, n_bits=n_bits)
+            build = time.perf_counter() - start
+            recall = recall_at_k(exact, lsh, row_indexes, args.k)
+            latency = mean_latency(lsh, row_indexes, args.k)
+            candidates = np.array([len(lsh.candidates(lsh.query_vector(row_index))) for row_index in row_indexes])
+            fallback = np.mean(candidates < args.k)
+            print(f"{n_tables:>6} {n_bits:>4} {recall:>9.3f} {latency:>9.2f} {build:>8.2f} "
+                  f"{candidates.mean():>10.0f} {fallback:>8.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+memory of each in-process structure: before (csv files loaded with the default pandas and numpy types, python
+strings) and after (compact representation of the api: float32 ratings matrix, narrow integers, categorical authors
+and categories, string arenas for titles and image urls)
+the ratings grouped by user and the ratings matrix are also measured after a compaction of ingested ratings
+exit code 1 if a compact structure is larger than its default representation, or if it grew compared with a saved
+baseline (more than --tolerance), so memory regressions are caught
+usage (from the main folder): python -m benchmarks.memory [--save benchmarks/memory.json]
+                              [--baseline benchmarks/memory.json]
+"""
+from data_access import UserRatingsIndex
+from config import DATA_DIR
+from scipy.sparse import csr_matrix
+import pandas as pd
+import numpy as np
+import functions
+import argparse
+import json
+import sys
+import os
+
+
+def nbytes(value) -> int:
+    """
+    get the memory of a structure (python strings included)
+    :param value: array, sparse matrix, dataframe, categorical, string arena or list of them
+    :return: int: number of bytes
+    """
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    if isinstance(value, csr_matrix):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Categorical) or (isinstance(value, np.ndarray) and value.dtype == object):
+        return int(pd.Series(value).memory_usage(deep=True, index=False))
+    if isinstance(value, UserRatingsIndex):
+        return nbytes([value.users, value.offsets, value.rows, value.book_ids, value.ratings, value.slots])
+    return int(value.nbytes)
+
+
+def default_structures(data_dir: str) -> dict:
+    """
+    load the csv datasets with the default types (representation before the compact types)
+    :param data_dir: str: folder of the csv files
+    :return: dict: structure -> memory in bytes
+    """
+    loader = np.load(os.path.join(data_dir, 'csr_matrix.npz'))
+    book_matrix = csr_matrix((loader['data'], loader['indices'], loader['indptr']), shape=loader['shape'])
+    ratings = pd.read_csv(os.path.join(data_dir, 'ratings.csv'))
+    user_ratings = UserRatingsIndex.from_ratings(ratings['user_id'].values, ratings['book_id'].values,
+                                                 ratings['rating'].values)
+    user_ratings.slots = user_ratings.slots.astype(np.int64)
+    books = pd.read_csv(os.path.join(data_dir, 'books_with_cat.csv'))
+    position = np.empty(books['book_id'].max() + 1, dtype=np.int64)
+    return {'book_matrix': nbytes(book_matrix), 'user_ratings': nbytes(user_ratings),
+            'books': nbytes(books.drop(columns=['title', 'image_url'])),
+            'book_lookup': nbytes([position, books['title'].values, books['image_url'].values,
+                                   books['authors'].values]),
+            'compacted_matrix': nbytes(book_matrix), 'compacted_ratings': nbytes(user_ratings)}
+
+
+def compact_structures() -> dict:
+    """
+    get the memory of the structures of the api
+    :return: dict: structure -> memory in bytes
+    """
+    data = functions.current()
+    book_lookup = data.book_lookup
+    state = data.ratings_store.state
+    # datasets after a compaction of one ingested rating (the nearest users index is not rebuilt)
+    user_id = int(state.user_ratings.users[0])
+    rating = (user_id, int(state.user_ratings.books(user_id)[0]), 5)
+    compacted_ratings, compacted_matrix, _ = state.apply([rating]).compacted(lambda matrix: None)
+    return {'book_matrix': nbytes(data.book_matrix),
+            'user_ratings': nbytes(state.user_ratings),
+            'books': nbytes(data.books),
+            'book_lookup': nbytes([book_lookup.position, book_lookup.titles, book_lookup.image_urls,
+                                   book_lookup.authors]),
+            'compacted_matrix': nbytes(compacted_matrix), 'compacted_ratings': nbytes(compacted_ratings)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--save', help='save the memory of each structure as a baseline in this json file')
+    parser.add_argument('--baseline', help='compare with the baseline of this json file')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='accepted relative memory increase')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    before = default_structures(DATA_DIR)
+    after = compact_structures()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['data_version'] != functions.current().data_version:
+            print('warning: the baseline was measured on other datasets')
+
+    regressions = []
+    print(f"{'structure':>17} {'before MiB':>11} {'after MiB':>10} {'ratio':>7}")
+    for name in after:
+        regressed = after[name] > before[name]
+        if baseline is not None and name in baseline['structures']:
+            regressed |= after[name] > baseline['structures'][name] * (1 + args.tolerance)
+        if regressed:
+            regressions.append(name)
+        print(f'{name:>17} {before[name] / 2 ** 20:>11.1f} {after[name] / 2 ** 20:>10.1f} '
+              f"{after[name] / before[name]:>7.2f}{'  regression' if regressed else ''}")
+    # total of the structures loaded at startup (the compacted structures replace them)
+    total_before = sum(value for name, value in before.items() if not name.startswith('compacted_'))
+    total_after = sum(value for name, value in after.items() if not name.startswith('compacted_'))
+    print(f"{'total':>17} {total_before / 2 ** 20:>11.1f} {total_after / 2 ** 20:>10.1f} "
+          f'{total_after / total_before:>7.2f}')
+    # structures built from the compact datasets (no default representation to compare with)
+    data = functions.current()
+    for name, value in (('author_affinity', [data.author_affinity.counts, data.author_affinity.sums]),
+                        ('neighbor_index', data.neighbor_index.normalized)):
+        print(f"{name:>17} {'':>11} {nbytes(value) / 2 ** 20:>10.1f}")
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'data_version': functions.current().data_version, 'structures': after}, file, indent=2)
+    if regressions:
+        print(f"regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+behaviour of the /recommandation POST under load: concurrent clients send requests without pause
+- latency (p50, p95, p99) of the answered requests
+- share of degraded pages (sections served from precomputed results after the latency budget) and of shed requests
+the budget and the admission limits are read from the environment (REQUEST_BUDGET, MAX_CONCURRENT_REQUESTS,
+MAX_QUEUED_REQUESTS, ADMISSION_TIMEOUT), caches are not used
+usage (from the main folder): [REQUEST_BUDGET=0.2] python -m benchmarks.overload [--clients 32] [--requests 20]
+"""
+from fastapi.testclient import TestClient
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import functions
+import api
+import argparse
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=32, help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='number of requests per client')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    functions.results_cache.maxsize = 0
+    functions.page_cache.maxsize = 0
+    functions.results_cache.clear()
+    client = TestClient(api.app)
+    users = np.array(sorted(functions.current().user_ratings.user_ids))
+    user_ids = np.random.RandomState(0).choice(users, size=args.clients * args.requests).tolist()
+
+    def post(user_id: int) -> tuple:
+        start = time.perf_counter()
+        response = client.post('/recommandation', data={'user_id': user_id})
+        return response.status_code, 'degraded:' in response.text, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as executor:
+        results = list(executor.map(post, user_ids))
+    seconds = time.perf_counter() - start
+
+    answered = np.array([latency for status, _, latency in results if status == 200]) * 1000
+    degraded = sum(is_degraded for status, is_degraded, _ in results if status == 200)
+    shed = sum(status == 503 for status, _, _ in results)
+    print(f'{len(results)} requests from {args.clients} clients in {seconds:.1f}s '
+          f'({len(answered) / seconds:.0f} pages/s)')
+    if len(answered):
+        p50, p95, p99 = np.percentile(answered, [50, 95, 99])
+        print(f'answered: {len(answered)}, p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms')
+    print(f'degraded pages: {degraded / max(len(answered), 1):.1%}, shed requests: {shed / len(results):.1%}')
+    print(api.admission.stats())
+
+
+if __name__ == '__main__':
+    main()
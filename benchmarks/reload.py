@@ -0,0 +1,135 @@
+"""
+reload of the datasets while the api serves requests (next snapshot built in the background, then swapped)
+- latency (p50, p95, p99) of the /recommandation POST without reload and during the reload
+- rss before the reload, peak rss during the reload (old and new snapshots in memory) and rss after the swap
+exit code 1 if a request failed during the reload or if the old snapshot is still in memory once the requests ended
+caches are not used
+usage (from the main folder): python -m benchmarks.reload [--clients 4] [--seconds 5]
+"""
+from fastapi.testclient import TestClient
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import functions
+import api
+import argparse
+import threading
+import weakref
+import time
+import gc
+import sys
+
+
+def rss() -> float:
+    """
+    get the resident memory of the process
+    :return: float: rss in MB
+    """
+    with open('/proc/self/status') as file:
+        return [int(line.split()[1]) for line in file if line.startswith('VmRSS')][0] / 1024
+
+
+def run_clients(client: TestClient, user_ids: list, n_clients: int, stop: threading.Event) -> list:
+    """
+    send requests without pause from several clients until stop is set
+    :param client: TestClient: client of the api
+    :param user_ids: list: users of the requests (drawn in turn)
+    :param n_clients: int: number of concurrent clients
+    :param stop: threading.Event: end of the requests
+    :return: list: (start time, status code, latency in milliseconds) of each request
+    """
+    def send(offset: int) -> list:
+        results = []
+        while not stop.is_set():
+            user_id = user_ids[(offset + len(results) * n_clients) % len(user_ids)]
+            start = time.perf_counter()
+            response = client.post('/recommandation', data={'user_id': user_id})
+            results.append((start, response.status_code, (time.perf_counter() - start) * 1000))
+        return results
+
+    with ThreadPoolExecutor(n_clients) as executor:
+        return [result for results in executor.map(send, range(n_clients)) for result in results]
+
+
+def percentiles(results: list) -> str:
+    """
+    summarize the latency of requests
+    :param results: list: (start time, status code, latency in milliseconds) of each request
+    :return: str: number of requests and latency percentiles
+    """
+    latencies = [latency for _, _, latency in results]
+    if not latencies:
+        return 'no request'
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return f'{len(latencies)} requests, p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=4, help='number of concurrent clients')
+    parser.add_argument('--seconds', type=float, default=5, help='duration of the measure without reload')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    functions.results_cache.maxsize = 0
+    functions.page_cache.maxsize = 0
+    functions.results_cache.clear()
+    functions.page_cache.clear()
+    client = TestClient(api.app)
+    users = np.array(sorted(functions.current().user_ratings.user_ids))
+    user_ids = np.random.RandomState(0).choice(users, size=min(1000, len(users)), replace=False).tolist()
+
+    # requests without reload
+    stop = threading.Event()
+    timer = threading.Timer(args.seconds, stop.set)
+    timer.start()
+    baseline = run_clients(client, user_ids, args.clients, stop)
+
+    # requests during the reload, the memory is sampled every 10 ms
+    old = weakref.ref(functions.current())
+    gc.collect()
+    rss_before = rss()
+    samples = [rss_before]
+    stop = threading.Event()
+    reloaded = threading.Event()
+    bounds = []
+
+    def sample():
+        while not reloaded.is_set():
+            samples.append(rss())
+            time.sleep(0.01)
+
+    def reload():
+        # requests are running before the reload starts
+        time.sleep(0.2)
+        bounds.append(time.perf_counter())
+        functions.reload()
+        bounds.append(time.perf_counter())
+        reloaded.set()
+        time.sleep(0.2)
+        stop.set()
+
+    threads = [threading.Thread(target=sample), threading.Thread(target=reload)]
+    for thread in threads:
+        thread.start()
+    results = run_clients(client, user_ids, args.clients, stop)
+    for thread in threads:
+        thread.join()
+    during = [result for result in results if bounds[0] <= result[0] <= bounds[1]]
+    failed = sum(status != 200 for _, status, _ in results)
+    gc.collect()
+
+    print(f'reload: {bounds[1] - bounds[0]:.2f}s, snapshot {functions.reload_stats()["snapshot"]}')
+    print(f'without reload: {percentiles(baseline)}')
+    print(f'during reload:  {percentiles(during)}')
+    print(f'rss before: {rss_before:.0f} MB, peak during the reload: {max(samples):.0f} MB, after: {rss():.0f} MB')
+    if failed:
+        print(f'{failed} requests failed during the reload')
+    if old() is not None:
+        print('the old snapshot is still in memory')
+    if failed or old() is not None:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
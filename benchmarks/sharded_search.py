@@ -0,0 +1,76 @@
+"""
+scaling of the sharded nearest users search with the number of shards (one thread per shard)
+- latency (p50, p95) of one query and throughput of batched queries for 1 to --max-shards shards
+- speedup compared with one shard and with the exact engine (one core)
+results of every number of shards are checked against one shard (exit code 1 if they differ)
+usage (from the main folder): [DATA_DIR=data/synthetic] python -m benchmarks.sharded_search [--max-shards 8]
+                              [--queries 200] [--k 5]
+"""
+from neighbors import CosineNeighborIndex, ShardedNeighborIndex
+import numpy as np
+import functions
+import argparse
+import time
+import sys
+import os
+
+
+def measure(index: CosineNeighborIndex, row_indexes: list, k: int) -> tuple:
+    """
+    measure single and batched queries
+    :param index: CosineNeighborIndex: nearest users index
+    :param row_indexes: list: rows used as queries
+    :param k: int: number of neighbors
+    :return: tuple: (latencies of single queries in milliseconds, queries per second in batch, batch results)
+    """
+    latencies = []
+    for row_index in row_indexes:
+        start = time.perf_counter()
+        index.kneighbors(row_index, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    results = index.kneighbors_batch(row_indexes, k)
+    return np.array(latencies), len(row_indexes) / (time.perf_counter() - start), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--max-shards', type=int, default=os.cpu_count(), help='largest number of shards')
+    parser.add_argument('--queries', type=int, default=200, help='number of queried users')
+    parser.add_argument('--k', type=int, default=5, help='number of neighbors')
+    args = parser.parse_args()
+    # datasets and derived structures are loaded by the warm-up
+    functions.warm_up()
+
+    matrix = functions.current().book_matrix
+    exact = CosineNeighborIndex(matrix, functions.current().normalized_matrix)
+    row_indexes = np.random.RandomState(0).choice(matrix.shape[0], min(args.queries, matrix.shape[0]),
+                                                  replace=False).tolist()
+    print(f'{matrix.shape[0]} users, {matrix.nnz} ratings, {os.cpu_count()} cores')
+    latencies, throughput, _ = measure(exact, row_indexes, args.k)
+    exact_p50 = np.percentile(latencies, 50)
+    print(f"{'shards':>7} {'p50 ms':>8} {'p95 ms':>8} {'batch q/s':>10} {'speedup':>8} {'vs exact':>9}")
+    print(f"{'exact':>7} {exact_p50:>8.2f} {np.percentile(latencies, 95):>8.2f} {throughput:>10.0f}")
+
+    reference, single_p50, mismatches = None, None, []
+    for n_shards in range(1, args.max_shards + 1):
+        index = ShardedNeighborIndex(matrix, n_shards, exact.normalized)
+        # first query out of the measures (threads start)
+        index.kneighbors(row_indexes[0], args.k)
+        latencies, throughput, results = measure(index, row_indexes, args.k)
+        index.executor.shutdown()
+        p50 = np.percentile(latencies, 50)
+        single_p50 = single_p50 or p50
+        if reference is None:
+            reference = results
+        elif any(not np.array_equal(result, expected) for result, expected in zip(results, reference)):
+            mismatches.append(n_shards)
+        print(f'{n_shards:>7} {p50:>8.2f} {np.percentile(latencies, 95):>8.2f} {throughput:>10.0f} '
+              f'{single_p50 / p50:>7.2f}x {exact_p50 / p50:>8.2f}x')
+    if mismatches:
+        print(f"results differ from one shard with {', '.join(map(str, mismatches))} shards")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+memory of several worker processes loading the datasets, and check of the shared memory mode
+every worker imports functions.py like a uvicorn worker, runs a few recommendations and reports its memory:
+- pss: proportional set size (shared pages are divided between the processes using them)
+- private: private dirty memory (memory which can not be shared), minus the private memory of a process which
+  only imports the libraries
+in the 'shared' format the check fails (exit code 1) if the workers do not see the same data or if the private
+memory of a worker is above --max-private-mb, or if a worker fails
+usage (from the main folder): python -m benchmarks.shared_workers [--workers 4] [--formats shared columnar csv]
+"""
+import multiprocessing
+import traceback
+import argparse
+import hashlib
+import queue as queues
+import time
+import sys
+import os
+
+LIBRARIES = ['numpy', 'pandas', 'scipy.sparse', 'sklearn.preprocessing']
+# seconds a worker waits for the other workers
+BARRIER_TIMEOUT = 600
+
+
+def memory() -> dict:
+    """
+    get the memory of the current process
+    :return: dict: pss and private dirty memory (MB)
+    """
+    values = {}
+    with open('/proc/self/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if parts[0] in ('Pss:', 'Private_Dirty:'):
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return {'pss': values['Pss'], 'private': values['Private_Dirty']}
+
+
+def baseline_worker(queue: multiprocessing.Queue):
+    for library in LIBRARIES:
+        __import__(library)
+    queue.put(memory())
+
+
+def worker(queue: multiprocessing.Queue, barrier: multiprocessing.Barrier):
+    try:
+        import functions
+        functions.warm_up()
+
+        data = functions.current()
+        # touch the data like requests do
+        for user_id in list(data.user_ratings.users[:20]):
+            functions.get_html(int(user_id), None, True)
+        functions.get_html(None, None, True)
+
+        # fingerprint of the data seen by the worker
+        checksum = hashlib.sha1()
+        user_ratings = data.ratings_store.state.user_ratings
+        for array in (data.book_matrix.data, data.book_matrix.indices, data.book_matrix.indptr,
+                      data.neighbor_index.normalized.data, user_ratings.book_ids, user_ratings.ratings,
+                      user_ratings.offsets):
+            checksum.update(memoryview(array.tobytes()))
+        checksum.update(data.books.to_csv(index=False).encode('utf-8'))
+
+        # measure when every worker has loaded the data
+        barrier.wait(BARRIER_TIMEOUT)
+        queue.put(dict(memory(), checksum=checksum.hexdigest()))
+        barrier.wait(BARRIER_TIMEOUT)
+    except Exception:
+        # the other workers stop waiting and the error is reported by run
+        barrier.abort()
+        queue.put({'error': traceback.format_exc()})
+
+
+def collect(queue: multiprocessing.Queue, processes: list, n_results: int, timeout: float) -> list:
+    """
+    get the results of worker processes, without waiting forever for a dead worker
+    :param queue: multiprocessing.Queue: queue of the results
+    :param processes: list: worker processes
+    :param n_results: int: number of results
+    :param timeout: float: seconds given to the workers
+    :return: list: results
+    """
+    results = []
+    deadline = time.monotonic() + timeout
+    while len(results) < n_results:
+        try:
+            results.append(queue.get(timeout=1))
+        except queues.Empty:
+            exitcodes = [process.exitcode for process in processes]
+            # a worker exiting without result was killed (out of memory, signal) or crashed in native code
+            if any(exitcode not in (None, 0) for exitcode in exitcodes) or time.monotonic() > deadline:
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError(f'{n_results - len(results)} worker(s) without result (exit codes {exitcodes})')
+    errors = sorted((result['error'] for result in results if 'error' in result),
+                    key=lambda error: 'BrokenBarrierError' in error)
+    if errors:
+        for process in processes:
+            process.terminate()
+        raise RuntimeError(f'worker failed:\n{errors[0]}')
+    return results
+
+
+def run(data_format: str, n_workers: int, timeout: float = 2 * BARRIER_TIMEOUT) -> list:
+    """
+    start workers loading the datasets in the required format
+    :param data_format: str: dataset format
+    :param n_workers: int: number of workers
+    :param timeout: float: seconds given to the workers
+    :return: list: memory and data checksum of each worker
+    """
+    os.environ['DATASET_FORMAT'] = data_format
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    barrier = context.Barrier(n_workers)
+    processes = [context.Process(target=worker, args=(queue, barrier)) for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    results = collect(queue, processes, n_workers, timeout)
+    for process in processes:
+        process.join()
+    return results
+
+
+def baseline(timeout: float = BARRIER_TIMEOUT) -> dict:
+    """
+    get the memory of a process which only imports the libraries
+    :param timeout: float: seconds given to the process
+    :return: dict: pss and private dirty memory (MB)
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=baseline_worker, args=(queue,))
+    process.start()
+    result = collect(queue, [process], 1, timeout)[0]
+    process.join()
+    return result
+
+
+def check(results: list, libraries: dict, max_private_mb: float) -> list:
+    """
+    check the workers of the shared format: same data and small private memory
+    :param results: list: memory and data checksum of each worker
+    :param libraries: dict: memory of a process which only imports the libraries
+    :param max_private_mb: float: maximum private memory of a worker (without the libraries)
+    :return: list: failures (empty if the workers pass)
+    """
+    failures = []
+    if len({result['checksum'] for result in results}) != 1:
+        failures.append('workers do not see the same data')
+    private = max(result['private'] for result in results) - libraries['private']
+    if private > max_private_mb:
+        failures.append(f'private memory of a worker {private:.1f} MB > {max_private_mb} MB')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4, help='number of worker processes')
+    parser.add_argument('--formats', nargs='+', default=['shared', 'columnar', 'csv'], help='dataset formats')
+    parser.add_argument('--max-private-mb', type=float, default=64, help='maximum private memory of a worker')
+    args = parser.parse_args()
+
+    libraries = baseline()
+
+    failures = []
+    print(f"{'format':>8} {'workers':>7} {'total pss MB':>13} {'private MB/worker':>18}")
+    for data_format in args.formats:
+        try:
+            results = run(data_format, args.workers)
+        except RuntimeError as error:
+            print(f'{data_format:>8} {args.workers:>7} {"failed":>13}')
+            failures.append(f'{data_format} format: {error}')
+            continue
+        private = max(result['private'] for result in results) - libraries['private']
+        print(f"{data_format:>8} {args.workers:>7} {sum(result['pss'] for result in results):>13.0f} {private:>18.1f}")
+        if data_format == 'shared':
+            failures.extend(check(results, libraries, args.max_private_mb))
+    for failure in failures:
+        print('FAILED:', failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+startup time and memory for each dataset format (csv and columnar)
+- in a new python process: import of functions.py, then warm-up (datasets loaded, derived structures built, then
+  synthetic queries), peak rss and current rss
+- with a uvicorn server started in a new process: time to listening (first answer of /health/live) and time to ready
+  (first success of /health/ready)
+usage (from the main folder): python -m benchmarks.startup [--formats csv columnar] [--runs 3] [--no-server]
+"""
+import urllib.request
+import urllib.error
+import subprocess
+import argparse
+import socket
+import json
+import time
+import sys
+import os
+
+# measured in the child process: import time, warm-up times, peak rss and current rss
+CHILD = """
+import resource, time, json
+start = time.perf_counter()
+import functions
+imported = time.perf_counter() - start
+functions.warm_up()
+with open('/proc/self/status') as file:
+    rss = [int(line.split()[1]) for line in file if line.startswith('VmRSS')][0]
+print(json.dumps({'seconds': imported, 'loaded_seconds': functions.startup['loaded_seconds'],
+                  'ready_seconds': functions.startup['ready_seconds'],
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'rss_mb': rss / 1024}))
+"""
+
+
+def measure(data_format: str) -> dict:
+    """
+    import functions.py and warm it up in a new process with the required dataset format
+    :param data_format: str: 'csv' or 'columnar'
+    :return: dict: import time, load and ready times since the import (seconds), peak rss and current rss (MB)
+    """
+    env = dict(os.environ, DATASET_FORMAT=data_format)
+    output = subprocess.run([sys.executable, '-c', CHILD], env=env, check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def status(url: str) -> int:
+    """
+    get the status code of a GET request
+    :param url: str: url
+    :return: int: status code (None if the server does not answer)
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def measure_server(data_format: str, timeout: float = 600) -> dict:
+    """
+    start the api with uvicorn and poll the health endpoints
+    :param data_format: str: 'csv' or 'columnar'
+    :param timeout: float: seconds before giving up
+    :return: dict: seconds from the start of the process to listening and to ready
+    """
+    with socket.socket() as free:
+        free.bind(('127.0.0.1', 0))
+        port = free.getsockname()[1]
+    env = dict(os.environ, DATASET_FORMAT=data_format)
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'api:app', '--port', str(port)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {'listening_seconds': None, 'ready_seconds': None}
+    try:
+        while time.perf_counter() - start < timeout and server.poll() is None:
+            if result['listening_seconds'] is None:
+                if status(f'http://127.0.0.1:{port}/health/live') == 200:
+                    result['listening_seconds'] = time.perf_counter() - start
+            elif status(f'http://127.0.0.1:{port}/health/ready') == 200:
+                result['ready_seconds'] = time.perf_counter() - start
+                break
+            time.sleep(0.01)
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--formats', nargs='+', default=['csv', 'columnar'], help='dataset formats to compare')
+    parser.add_argument('--runs', type=int, default=3, help='number of runs per format (best run is reported)')
+    parser.add_argument('--no-server', action='store_true', help='do not measure the uvicorn server')
+    args = parser.parse_args()
+
+    print(f"{'format':>8} {'import s':>9} {'loaded s':>9} {'ready s':>8} {'peak rss MB':>12} {'rss MB':>8}")
+    for data_format in args.formats:
+        result = min((measure(data_format) for _ in range(args.runs)), key=lambda run: run['ready_seconds'])
+        print(f"{data_format:>8} {result['seconds']:>9.2f} {result['loaded_seconds']:>9.2f} "
+              f"{result['ready_seconds']:>8.2f} {result['max_rss_mb']:>12.0f} {result['rss_mb']:>8.0f}")
+    if args.no_server:
+        return
+    print(f"\n{'format':>8} {'listening s':>12} {'ready s':>8}  (uvicorn, from the start of the process)")
+    for data_format in args.formats:
+        result = min((measure_server(data_format) for _ in range(args.runs)),
+                     key=lambda run: run['ready_seconds'] or float('inf'))
+        listening, ready = (f'{result[key]:.2f}' if result[key] is not None else 'failed'
+                            for key in ('listening_seconds', 'ready_seconds'))
+        print(f'{data_format:>8} {listening:>12} {ready:>8}')
+
+
+if __name__ == '__main__':
+    main()
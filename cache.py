@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from functools import wraps
+import threading
+import inspect
+import time
+
+
+class LRUCache:
+    """
+    bounded cache with least recently used eviction and time to live
+    keys include the version of the datasets (and of the ratings of the user for the entries of a user), so entries
+    computed on older data are never returned
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 600, version=lambda user_id: None):
+        """
+        :param maxsize: int: maximum number of entries (0 disables the cache)
+        :param ttl: float: time to live of an entry in seconds
+        :param version: callable: returns the current version of the datasets for a user id (None: entries shared
+        by every user)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, default=None, user_id: int = None):
+        """
+        get the value of a key
+        :param key: tuple: key (the version of the datasets is added to it)
+        :param default: value returned if the key is not in the cache or expired
+        :param user_id: int: user of the entry (None: entry shared by every user)
+        :return: cached value
+        """
+        key = (self.version(user_id), key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: tuple, value, user_id: int = None):
+        """
+        set the value of a key, the least recently used entries are evicted if the cache is full
+        :param key: tuple: key (the version of the datasets is added to it)
+        :param value: value to cache
+        :param user_id: int: user of the entry (None: entry shared by every user)
+        """
+        if self.maxsize <= 0:
+            return
+        key = (self.version(user_id), key)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        get the counters of the cache
+        :return: dict: size, hits, misses, evictions and hit rate
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'hit_rate': self.hits / requests if requests else 0.0}
+
+    def memoize(self, function=None, user: str = None):
+        """
+        decorator caching the results of a function by arguments (@cache.memoize or @cache.memoize(user='user_id'))
+        :param function: function with hashable arguments
+        :param user: str: argument of the user id of the results (None: results shared by every user)
+        :return: cached function
+        """
+        if function is None:
+            return lambda function: self.memoize(function, user)
+        missing = object()
+        if user is not None:
+            parameter = inspect.signature(function).parameters[user]
+            position = list(inspect.signature(function).parameters).index(user)
+
+        @wraps(function)
+        def cached_function(*args, **kwargs):
+            key = (function.__name__, args, tuple(sorted(kwargs.items())))
+            user_id = None
+            if user is not None:
+                user_id = args[position] if position < len(args) else kwargs.get(user, parameter.default)
+            value = self.get(key, missing, user_id)
+            if value is missing:
+                value = function(*args, **kwargs)
+                self.set(key, value, user_id)
+            return value
+
+        return cached_function
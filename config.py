@@ -0,0 +1,83 @@
+import os
+
+# settings of the recommendation system, can be overridden with environment variables
+
+# engine used to search nearest users: 'exact' (brute force cosine), 'sharded' (brute force cosine, shards of users
+# searched in parallel) or 'lsh' (approximate)
+NEIGHBOR_ENGINE = os.environ.get('NEIGHBOR_ENGINE', 'exact')
+# sharded engine: number of shards of users searched in parallel (0: one per core)
+NEIGHBOR_SHARDS = int(os.environ.get('NEIGHBOR_SHARDS', 0))
+# lsh engine: number of hash tables (more tables: better recall, slower queries)
+LSH_N_TABLES = int(os.environ.get('LSH_N_TABLES', 8))
+# lsh engine: number of bits per hash (more bits: smaller buckets, faster queries, lower recall)
+LSH_N_BITS = int(os.environ.get('LSH_N_BITS', 12))
+# the default lsh settings favor latency over recall: on the synthetic datasets of generate.py (53 424 users) they give
+# a recall@5 of 0.21 against the exact engine in 2 ms per query (exact: 13 ms), 16 tables of 4 bits give a recall of
+# 0.90 in 34 ms (python -m benchmarks.lsh_recall)
+
+# engine of the collaborative section: 'user' (books of the nearest users), 'item' (books similar to the books
+# rated by the user, similar books computed with python item_neighbors.py or at startup) or 'latent' (best scores
+# of the latent factors, factors computed with python latent_factors.py or at startup)
+COLLABORATIVE_ENGINE = os.environ.get('COLLABORATIVE_ENGINE', 'user')
+# item engine: number of similar books kept per book
+ITEM_NEIGHBORS_K = int(os.environ.get('ITEM_NEIGHBORS_K', 50))
+# latent engine: number of factors of users and books
+LATENT_N_COMPONENTS = int(os.environ.get('LATENT_N_COMPONENTS', 64))
+
+# categories of the books (the first 5 are displayed by default)
+categories = ['action & adventure', 'fantasy', 'romance', 'mystery & thriller', 'classic',
+              'memoir & autobiography', 'historical fiction', 'graphic novel & comic',
+              'science fiction', 'history', 'horror', "children's", 'science', 'humor',
+              'self development', 'dystopia', 'paranormal romance', 'anthology', 'poetry',
+              'cookbooks', 'essay', 'drama', 'other']
+
+# folder of the datasets
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+# format of the datasets: 'csv', 'columnar' (converted with python dataset.py), 'auto' (columnar if converted)
+# or 'shared' (columnar files in shared memory, mapped read-only by every uvicorn worker)
+DATASET_FORMAT = os.environ.get('DATASET_FORMAT', 'auto')
+# folder of the shared datasets ('shared' format), must be on a memory file system
+SHARED_DATA_DIR = os.environ.get('SHARED_DATA_DIR', '/dev/shm/books_recommendation')
+
+# cache of intermediate results (nearest users, top author, top books by category): maximum number of entries
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', 4096))
+# cache of rendered pages: maximum number of entries
+PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 1024))
+# time to live of cached entries in seconds
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 600))
+
+# recommendations of every user computed with python precompute.py (served by the api when up to date)
+PRECOMPUTED_PATH = os.environ.get('PRECOMPUTED_PATH', os.path.join(DATA_DIR, 'recommendations.npz'))
+# similar books of each book computed with python item_neighbors.py (item engine)
+ITEM_NEIGHBORS_PATH = os.environ.get('ITEM_NEIGHBORS_PATH', os.path.join(DATA_DIR, 'item_neighbors.npz'))
+# factors of users and books computed with python latent_factors.py (latent engine)
+LATENT_FACTORS_PATH = os.environ.get('LATENT_FACTORS_PATH', os.path.join(DATA_DIR, 'latent_factors.npz'))
+
+# ingested ratings: number of ratings waiting in the delta buffers that starts a compaction
+COMPACTION_THRESHOLD = int(os.environ.get('COMPACTION_THRESHOLD', 10000))
+# ingested ratings: seconds between the first ingested rating and the compaction (0: compaction on threshold only)
+COMPACTION_INTERVAL = float(os.environ.get('COMPACTION_INTERVAL', 60))
+# ingested ratings: log file shared by the workers and replayed when the datasets are loaded (empty: kept in memory,
+# lost on restart and seen by the worker which ingested them only)
+RATINGS_LOG_PATH = os.environ.get('RATINGS_LOG_PATH', os.path.join(DATA_DIR, 'ingested_ratings.csv'))
+# marker file replaced by a reload and watched by every worker, which reloads the datasets when it changes (empty: a
+# reload reaches the worker receiving it only)
+RELOAD_MARKER_PATH = os.environ.get('RELOAD_MARKER_PATH', os.path.join(DATA_DIR, 'reload_marker'))
+
+# metrics of the stages of the html page exposed on /metrics ('0' disables them)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# requests with a X-Profile header get the duration of each stage in a Server-Timing header ('1' enables it)
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+
+# latency budget of a recommendation page in seconds: the sections computed after it are served from precomputed
+# results (precomputed recommendations or popularity) and the page is marked as degraded (0: no budget)
+REQUEST_BUDGET = float(os.environ.get('REQUEST_BUDGET', 0.5))
+# recommendation pages computed at once by a worker (0: no limit)
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', 8))
+# requests waiting for a free slot, the next requests are shed (503)
+MAX_QUEUED_REQUESTS = int(os.environ.get('MAX_QUEUED_REQUESTS', 32))
+# seconds a request waits for a free slot before it is shed (503)
+ADMISSION_TIMEOUT = float(os.environ.get('ADMISSION_TIMEOUT', 2))
+
+# number of users queried by the warm-up before the api is ready (synthetic queries on every code path of the pages)
+WARM_UP_QUERIES = int(os.environ.get('WARM_UP_QUERIES', 3))
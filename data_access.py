@@ -0,0 +1,305 @@
+from scipy.sparse import csr_matrix
+import pandas as pd
+import numpy as np
+
+
+class UserRatingsIndex:
+    """
+    ratings grouped by user (csr-like layout): the ratings of a user are a contiguous slice of the index
+    a lookup costs the size of the user history instead of a scan of the whole ratings dataset
+    """
+
+    def __init__(self, users: np.ndarray, offsets: np.ndarray, rows: np.ndarray, book_ids: np.ndarray,
+                 ratings: np.ndarray):
+        """
+        :param users: np.ndarray: sorted ids of the users having ratings
+        :param offsets: np.ndarray: ratings of the i-th user are between offsets[i] and offsets[i + 1]
+        :param rows: np.ndarray: position of each rating in the ratings dataset
+        :param book_ids: np.ndarray: book id of each rating (grouped by user)
+        :param ratings: np.ndarray: rating of each rating (grouped by user)
+        """
+        self.users = users
+        self.offsets = offsets
+        self.rows = rows
+        self.book_ids = book_ids
+        self.ratings = ratings
+        # user id -> slot of the user in offsets (-1 if the user has no rating)
+        self.slots = np.full(users.max() + 1 if len(users) else 0, -1, dtype=np.int32)
+        self.slots[users] = np.arange(len(users))
+        self.user_ids = set(users.tolist())
+
+    @classmethod
+    def from_ratings(cls, user_ids: np.ndarray, book_ids: np.ndarray, ratings: np.ndarray) -> 'UserRatingsIndex':
+        """
+        group the ratings dataset by user
+        :param user_ids: np.ndarray: user id of each rating
+        :param book_ids: np.ndarray: book id of each rating
+        :param ratings: np.ndarray: rating of each rating
+        :return: UserRatingsIndex: ratings grouped by user
+        """
+        # stable sort: inside a user slice, ratings keep the order of the ratings dataset
+        order = np.argsort(user_ids, kind='stable')
+        users, starts = np.unique(user_ids[order], return_index=True)
+        return cls(users, np.append(starts, len(order)), order, book_ids[order], ratings[order])
+
+    def avg_rating(self) -> float:
+        """
+        get the average rating of all ratings
+        :return: float: average rating
+        """
+        return self.ratings.sum(axis=0) / len(self.ratings)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.user_ids
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def slice(self, user_id: int) -> slice:
+        """
+        get the slice of the ratings of a user
+        :param user_id: int: id of user
+        :return: slice: slice of the ratings of the user (empty if the user has no rating)
+        """
+        if user_id not in self.user_ids:
+            return slice(0, 0)
+        slot = self.slots[user_id]
+        return slice(self.offsets[slot], self.offsets[slot + 1])
+
+    def books(self, user_id: int) -> np.ndarray:
+        """
+        get the books rated by a user
+        :param user_id: int: id of user
+        :return: np.ndarray: book ids rated by the user
+        """
+        return self.book_ids[self.slice(user_id)]
+
+    def user_ratings(self, user_id: int) -> pd.DataFrame:
+        """
+        get the ratings of a user
+        :param user_id: int: id of user
+        :return: pd.DataFrame: ratings of the user (user_id, book_id, rating)
+        """
+        user_slice = self.slice(user_id)
+        return pd.DataFrame({'user_id': np.full(user_slice.stop - user_slice.start, user_id),
+                             'book_id': self.book_ids[user_slice],
+                             'rating': self.ratings[user_slice]})
+
+    def select(self, user_ids: list) -> tuple:
+        """
+        get the ratings of several users, in the order of the ratings dataset
+        :param user_ids: list: ids of users
+        :return: tuple: (book ids, ratings)
+        """
+        positions = [np.arange(user_slice.start, user_slice.stop)
+                     for user_slice in (self.slice(user_id) for user_id in set(user_ids))]
+        positions = np.concatenate(positions) if positions else np.array([], dtype=np.int64)
+        positions = positions[np.argsort(self.rows[positions], kind='stable')]
+        return self.book_ids[positions], self.ratings[positions]
+
+
+class StringArena:
+    """
+    strings stored in one utf-8 buffer with the offsets of each string (no python object per string)
+    a string is decoded when it is read, the buffer can be a memory mapped file (see dataset.load_arena)
+    """
+
+    def __init__(self, offsets: np.ndarray, data):
+        """
+        :param offsets: np.ndarray: the i-th string is between offsets[i] and offsets[i + 1] in data
+        :param data: bytes or memoryview: utf-8 bytes of all strings
+        """
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, values: np.ndarray) -> 'StringArena':
+        """
+        store strings in an arena
+        :param values: np.ndarray: strings (missing values are stored as empty strings)
+        :return: StringArena: strings
+        """
+        encoded = [value.encode('utf-8') if isinstance(value, str) else b'' for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        return cls(offsets.astype(np.int32) if offsets[-1] < np.iinfo(np.int32).max else offsets, b''.join(encoded))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, positions):
+        """
+        :param positions: position of a string or array of positions
+        :return: str or np.ndarray: the string or the strings at the positions
+        """
+        if np.ndim(positions) == 0:
+            return str(self.data[self.offsets[positions]:self.offsets[positions + 1]], 'utf-8')
+        values = np.empty(len(positions), dtype=object)
+        values[:] = [self[position] for position in np.asarray(positions).tolist()]
+        return values
+
+    @property
+    def nbytes(self) -> int:
+        return self.offsets.nbytes + len(self.data)
+
+
+class BookLookup:
+    """
+    book id -> position of the book in the books dataset, to get titles, image urls and authors without scanning
+    titles and image urls are stored in string arenas
+    """
+
+    def __init__(self, books: pd.DataFrame, titles: StringArena = None, image_urls: StringArena = None):
+        """
+        :param books: pd.DataFrame: books dataset (book_id, authors, and title and image_url if not stored)
+        :param titles: StringArena: titles of the books if stored (built from books if None)
+        :param image_urls: StringArena: image urls of the books if stored (built from books if None)
+        """
+        book_ids = books['book_id'].values
+        self.position = np.full(book_ids.max() + 1, -1, dtype=np.int32)
+        # assigned in reverse order so that the first row of a book wins
+        self.position[book_ids[::-1]] = np.arange(len(book_ids))[::-1]
+        self.titles = titles if titles is not None else StringArena.from_strings(books['title'].values)
+        self.image_urls = image_urls if image_urls is not None else StringArena.from_strings(books['image_url'].values)
+        self.authors = books['authors'].values
+
+    def __contains__(self, book_id: int) -> bool:
+        return 0 <= book_id < len(self.position) and self.position[book_id] >= 0
+
+    def positions(self, book_ids: list) -> np.ndarray:
+        """
+        get the positions of books in the books dataset
+        :param book_ids: list: book ids
+        :return: np.ndarray: positions of the books
+        """
+        for book_id in book_ids:
+            if book_id not in self:
+                raise KeyError(f'book {book_id} not in database')
+        return self.position[np.asarray(book_ids, dtype=np.int64)]
+
+    def titles_of(self, book_ids: list) -> list:
+        """
+        get the titles of books
+        :param book_ids: list: book ids
+        :return: list: titles of the books
+        """
+        return list(self.titles[self.positions(book_ids)])
+
+    def image_urls_of(self, book_ids: list) -> list:
+        """
+        get the image urls of books
+        :param book_ids: list: book ids
+        :return: list: image urls of the books
+        """
+        return list(self.image_urls[self.positions(book_ids)])
+
+
+class AuthorAffinity:
+    """
+    sparse user x author matrices of the number of ratings and of the sum of the ratings of each user for each author
+    the favorite author of a user is read from one row instead of grouping the ratings of the user by author
+    """
+
+    def __init__(self, user_ratings: UserRatingsIndex, book_lookup: BookLookup, counts: csr_matrix = None,
+                 sums: csr_matrix = None):
+        """
+        :param user_ratings: UserRatingsIndex: ratings grouped by user
+        :param book_lookup: BookLookup: position of each book in the books dataset
+        :param counts: csr_matrix: number of ratings of each user for each author if stored (built if None)
+        :param sums: csr_matrix: sum of the ratings of each user for each author if stored (built if None)
+        """
+        # author codes in alphabetical order (same order as a groupby on authors)
+        self.book_authors, self.authors = pd.factorize(np.asarray(book_lookup.authors), sort=True)
+        self.book_lookup = book_lookup
+        if counts is not None and sums is not None:
+            # matrices stored with the columnar datasets (memory mapped, nothing is built)
+            if counts.shape[1] != len(self.authors):
+                raise ValueError(f'stored author affinity has {counts.shape[1]} authors, expected {len(self.authors)}')
+            self.counts, self.sums = counts, sums
+            return
+        user_ids = np.repeat(user_ratings.users, np.diff(user_ratings.offsets))
+        codes = self.author_codes(user_ratings.book_ids)
+        # ratings of books missing from the books dataset are dropped
+        known = codes >= 0
+        shape = (int(user_ratings.users.max()) + 1 if len(user_ratings.users) else 0, len(self.authors))
+        coordinates = (user_ids[known], codes[known])
+        self.counts = csr_matrix((np.ones(int(known.sum()), dtype=np.int32), coordinates), shape=shape)
+        self.sums = csr_matrix((user_ratings.ratings[known].astype(np.int32), coordinates), shape=shape)
+        # counts and sums of a user for an author are small: 16 bits when they fit
+        if not self.sums.nnz or self.sums.data.max() <= np.iinfo(np.int16).max:
+            self.counts.data = self.counts.data.astype(np.int16)
+            self.sums.data = self.sums.data.astype(np.int16)
+
+    def author_codes(self, book_ids: np.ndarray) -> np.ndarray:
+        """
+        get the author code of books
+        :param book_ids: np.ndarray: book ids
+        :return: np.ndarray: author code of each book (-1 if the book is not in the books dataset)
+        """
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        position = self.book_lookup.position
+        inside = (book_ids >= 0) & (book_ids < len(position))
+        positions = np.where(inside, position[np.where(inside, book_ids, 0)], -1)
+        return np.where(positions >= 0, self.book_authors[positions], -1)
+
+    @staticmethod
+    def best(codes: np.ndarray, counts: np.ndarray, sums: np.ndarray) -> int:
+        """
+        get the favorite author among the authors rated by a user
+        note_x_occurence (average rating x share of the ratings) is proportional to the sum of the ratings,
+        ties are broken by number of ratings then by name
+        :param codes: np.ndarray: author codes
+        :param counts: np.ndarray: number of ratings of each author
+        :param sums: np.ndarray: sum of the ratings of each author
+        :return: int: author code
+        """
+        if not len(codes):
+            raise IndexError('no rated book in the books dataset')
+        return codes[np.lexsort((codes, -counts, -sums))[0]]
+
+    def top_author(self, user_id: int) -> str:
+        """
+        get the favorite author of a user of the index
+        :param user_id: int: id of user
+        :return: str: favorite author
+        """
+        if user_id >= self.sums.shape[0]:
+            raise IndexError('no rated book in the books dataset')
+        start, end = self.sums.indptr[user_id], self.sums.indptr[user_id + 1]
+        return self.authors[self.best(self.sums.indices[start:end], self.counts.data[start:end],
+                                      self.sums.data[start:end])]
+
+    def top_author_of(self, book_ids: np.ndarray, ratings: np.ndarray) -> str:
+        """
+        get the favorite author of any ratings (users not in the index or with new ratings)
+        :param book_ids: np.ndarray: rated book ids
+        :param ratings: np.ndarray: ratings
+        :return: str: favorite author
+        """
+        codes = self.author_codes(book_ids)
+        known = codes >= 0
+        codes, ratings = codes[known], np.asarray(ratings)[known]
+        rated = np.unique(codes)
+        counts = np.bincount(codes, minlength=len(self.authors))[rated]
+        sums = np.bincount(codes, weights=ratings, minlength=len(self.authors))[rated]
+        return self.authors[self.best(rated, counts, sums)]
+
+    def top_authors(self, user_ids: list) -> list:
+        """
+        get the favorite author of several users of the index at once
+        :param user_ids: list: ids of users
+        :return: list: favorite author of each user (None if the user has no rated book in the books dataset)
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        inside = user_ids < self.sums.shape[0]
+        rows_sums = self.sums[user_ids[inside]]
+        rows_counts = self.counts[user_ids[inside]]
+        rows = np.repeat(np.arange(rows_sums.shape[0]), np.diff(rows_sums.indptr))
+        # best author first inside each row
+        order = np.lexsort((rows_sums.indices, -rows_counts.data, -rows_sums.data, rows))
+        firsts = order[rows_sums.indptr[:-1][np.diff(rows_sums.indptr) > 0]]
+        best = np.full(rows_sums.shape[0], -1, dtype=np.int64)
+        best[rows[firsts]] = rows_sums.indices[firsts]
+        codes = np.full(len(user_ids), -1, dtype=np.int64)
+        codes[inside] = best
+        return [self.authors[code] if code >= 0 else None for code in codes.tolist()]
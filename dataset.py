@@ -0,0 +1,335 @@
+"""
+load the datasets of the recommendation system
+
+three formats are supported:
+- csv: files downloaded by data/data.sh (ratings.csv, books_with_cat.csv, csr_matrix.npz)
+- columnar: typed numpy column files memory mapped on load, created from the csv files by the converter
+  usage (from the main folder): python dataset.py [--data data] [--output data/columnar]
+- shared: columnar files copied once in shared memory (tmpfs) and memory mapped read-only by every worker process
+"""
+from data_access import UserRatingsIndex, StringArena, BookLookup, AuthorAffinity
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import shutil
+import fcntl
+import json
+import os
+
+# version of the columnar layout, increased when the layout changes
+COLUMNAR_VERSION = 3
+# files downloaded by data/data.sh
+SOURCE_FILES = ['csr_matrix.npz', 'ratings.csv', 'books_with_cat.csv']
+# columns of books used by the recommendation system
+BOOK_COLUMNS = ['book_id', 'authors', 'title', 'average_rating', 'work_ratings_count', 'image_url', 'category']
+# string columns of books stored with a dictionary (few distinct values)
+DICTIONARY_COLUMNS = ['authors', 'category']
+# string columns of books stored in a string arena (one distinct value per book)
+ARENA_COLUMNS = ['title', 'image_url']
+# types of the columns of the ratings dataset (user ids and book ids fit in 32 bits, ratings are 1 to 5)
+RATINGS_DTYPES = {'user_id': np.int32, 'book_id': np.int32, 'rating': np.int8}
+
+
+def narrowest_int(values: np.ndarray) -> np.dtype:
+    """
+    get the smallest signed integer type able to store values
+    :param values: np.ndarray: integer values
+    :return: np.dtype: integer type
+    """
+    low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def source_signature(data_dir: str) -> dict:
+    """
+    get the size and modification time of the files downloaded by data/data.sh (to detect new datasets)
+    :param data_dir: str: folder of the csv files
+    :return: dict: file name -> [size, modification time] (None if the file does not exist)
+    """
+    signature = {}
+    for name in SOURCE_FILES:
+        path = os.path.join(data_dir, name)
+        signature[name] = [os.path.getsize(path), os.path.getmtime(path)] if os.path.exists(path) else None
+    return signature
+
+
+def dataset_version(data_dir: str) -> str:
+    """
+    get the version of the datasets (changes when the files downloaded by data/data.sh change)
+    :param data_dir: str: folder of the datasets
+    :return: str: version
+    """
+    return hashlib.sha1(json.dumps(source_signature(data_dir), sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def load_csv(data_dir: str = 'data') -> tuple:
+    """
+    load the csv datasets
+    :param data_dir: str: folder of the csv files
+    :return: tuple: (book_matrix, user_ratings, books, normalized_matrix, stored), normalized_matrix is None and stored
+    is empty (nothing is stored)
+    """
+    # load matrix user_matrix (ratings are small integers: float32 is exact)
+    loader = np.load(os.path.join(data_dir, 'csr_matrix.npz'))
+    book_matrix = csr_matrix((loader['data'].astype(np.float32), loader['indices'], loader['indptr']),
+                             shape=loader['shape'])
+    # ratings
+    ratings = pd.read_csv(os.path.join(data_dir, 'ratings.csv'), dtype=RATINGS_DTYPES)
+    user_ratings = compact_ratings(UserRatingsIndex.from_ratings(ratings['user_id'].values,
+                                                                 ratings['book_id'].values, ratings['rating'].values))
+    # books_with_cat
+    books = pd.read_csv(os.path.join(data_dir, 'books_with_cat.csv'), usecols=BOOK_COLUMNS,
+                        dtype={column: 'category' for column in DICTIONARY_COLUMNS})
+    return book_matrix, user_ratings, compact_books(books[BOOK_COLUMNS]), None, {}
+
+
+def compact_ratings(user_ratings: UserRatingsIndex) -> UserRatingsIndex:
+    """
+    store the ratings grouped by user with the smallest integer types
+    :param user_ratings: UserRatingsIndex: ratings grouped by user
+    :return: UserRatingsIndex: same ratings with narrow integer arrays
+    """
+    return UserRatingsIndex(*(values.astype(narrowest_int(values)) for values in (
+        user_ratings.users, user_ratings.offsets, user_ratings.rows, user_ratings.book_ids, user_ratings.ratings)))
+
+
+def compact_books(books: pd.DataFrame) -> pd.DataFrame:
+    """
+    store the numeric columns of books with the smallest integer types and the dictionary columns as categoricals
+    :param books: pd.DataFrame: books dataset
+    :return: pd.DataFrame: same books with compact columns
+    """
+    books = books.copy()
+    for column in ['book_id', 'work_ratings_count']:
+        books[column] = books[column].values.astype(narrowest_int(books[column].values))
+    for column in DICTIONARY_COLUMNS:
+        books[column] = books[column].astype('category')
+    return books
+
+
+def save_strings(path: str, values: np.ndarray):
+    """
+    save strings in a string arena: utf-8 bytes of all strings and offsets of each string
+    :param path: str: path of the column (without extension)
+    :param values: np.ndarray: strings (missing values are saved as empty strings)
+    """
+    arena = StringArena.from_strings(values)
+    np.save(path + '_offsets.npy', arena.offsets)
+    np.save(path + '_bytes.npy', np.frombuffer(arena.data, dtype=np.uint8))
+
+
+def load_arena(path: str) -> StringArena:
+    """
+    load a string arena, the offsets and the utf-8 bytes are memory mapped (strings are decoded when read)
+    :param path: str: path of the column (without extension)
+    :return: StringArena: strings
+    """
+    return StringArena(np.load(path + '_offsets.npy', mmap_mode='r'),
+                       memoryview(np.load(path + '_bytes.npy', mmap_mode='r')))
+
+
+def load_strings(path: str) -> np.ndarray:
+    """
+    load and decode all strings saved in a string arena (few strings, like the values of a dictionary column)
+    :param path: str: path of the column (without extension)
+    :return: np.ndarray: strings
+    """
+    arena = load_arena(path)
+    return arena[np.arange(len(arena))]
+
+
+def convert(data_dir: str = 'data', output_dir: str = 'data/columnar'):
+    """
+    convert the csv datasets to the columnar format
+    :param data_dir: str: folder of the csv files
+    :param output_dir: str: folder of the columnar files
+    """
+    book_matrix, user_ratings, books, _, _ = load_csv(data_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    def save(name: str, values: np.ndarray, dtype: np.dtype = None):
+        np.save(os.path.join(output_dir, name + '.npy'), np.ascontiguousarray(values, dtype=dtype))
+
+    # ratings matrix: float32 ratings, int32 indexes when they fit
+    index_dtype = np.int32 if max(book_matrix.nnz, *book_matrix.shape) < np.iinfo(np.int32).max else np.int64
+    save('matrix_data', book_matrix.data, np.float32)
+    save('matrix_indices', book_matrix.indices, index_dtype)
+    save('matrix_indptr', book_matrix.indptr, index_dtype)
+    save('matrix_shape', np.array(book_matrix.shape, dtype=np.int64))
+    # l2 normalized rows used by the nearest users index (same indices and indptr as the matrix)
+    save('normalized_data', normalize(csr_matrix(book_matrix, dtype=np.float64)).data, np.float64)
+
+    # ratings grouped by user (layout of UserRatingsIndex)
+    save('ratings_users', user_ratings.users, narrowest_int(user_ratings.users))
+    save('ratings_offsets', user_ratings.offsets, index_dtype)
+    save('ratings_rows', user_ratings.rows, index_dtype)
+    save('ratings_book_id', user_ratings.book_ids, narrowest_int(user_ratings.book_ids))
+    save('ratings_rating', user_ratings.ratings, narrowest_int(user_ratings.ratings))
+
+    # books: typed numeric columns, dictionary encoded authors and categories, string arena for titles and urls
+    books = books[BOOK_COLUMNS]
+    save('books_book_id', books['book_id'].values, narrowest_int(books['book_id'].values))
+    save('books_average_rating', books['average_rating'].values, np.float64)
+    save('books_work_ratings_count', books['work_ratings_count'].values,
+         narrowest_int(books['work_ratings_count'].values))
+    for column in DICTIONARY_COLUMNS:
+        codes, values = pd.factorize(books[column])
+        save(f'books_{column}_codes', codes, narrowest_int(codes))
+        save_strings(os.path.join(output_dir, f'books_{column}_values'), values)
+    for column in ARENA_COLUMNS:
+        save_strings(os.path.join(output_dir, f'books_{column}'), books[column].values)
+
+    # number and sum of the ratings of each user for each author (same indices and indptr for both matrices), built
+    # once here instead of in the private memory of every worker
+    author_affinity = AuthorAffinity(user_ratings, BookLookup(books))
+    affinity_dtype = np.int32 if author_affinity.sums.nnz < np.iinfo(np.int32).max else np.int64
+    save('affinity_indices', author_affinity.sums.indices, affinity_dtype)
+    save('affinity_indptr', author_affinity.sums.indptr, affinity_dtype)
+    save('affinity_counts', author_affinity.counts.data)
+    save('affinity_sums', author_affinity.sums.data)
+    save('affinity_shape', np.array(author_affinity.sums.shape, dtype=np.int64))
+
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as file:
+        json.dump({'version': COLUMNAR_VERSION, 'n_ratings': len(user_ratings.ratings), 'n_users': len(user_ratings),
+                   'n_books': len(books), 'matrix_shape': list(book_matrix.shape),
+                   'source': source_signature(data_dir)}, file, indent=4)
+
+
+def load_columnar(columnar_dir: str = 'data/columnar', signature: dict = None) -> tuple:
+    """
+    load the columnar datasets (numpy arrays are memory mapped, nothing is parsed)
+    :param columnar_dir: str: folder of the columnar files
+    :param signature: dict: signature of the csv files the columnar files must be converted from (None: not checked)
+    :return: tuple: (book_matrix, user_ratings, books, normalized_matrix, stored), stored holds the derived structures
+    stored with the datasets ('titles' and 'image_urls' string arenas, books has no title and image_url columns,
+    'author_counts' and 'author_sums' matrices of the author affinity)
+    """
+    manifest = read_manifest(columnar_dir)
+    if manifest is None:
+        raise ValueError(f'no columnar dataset in {columnar_dir}, run the converter (python dataset.py)')
+    if manifest['version'] != COLUMNAR_VERSION:
+        raise ValueError(f"columnar dataset version {manifest['version']} is not supported "
+                         f"(expected {COLUMNAR_VERSION}), run the converter again")
+    if signature is not None and not is_up_to_date(manifest, signature):
+        raise ValueError(f'columnar dataset in {columnar_dir} converted from older csv files, run the converter again')
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(columnar_dir, name + '.npy'), mmap_mode='r')
+
+    book_matrix = csr_matrix((load('matrix_data'), load('matrix_indices'), load('matrix_indptr')),
+                             shape=tuple(load('matrix_shape')))
+    normalized_matrix = csr_matrix((load('normalized_data'), load('matrix_indices'), load('matrix_indptr')),
+                                   shape=tuple(load('matrix_shape')))
+    user_ratings = UserRatingsIndex(load('ratings_users'), load('ratings_offsets'), load('ratings_rows'),
+                                    load('ratings_book_id'), load('ratings_rating'))
+
+    books = pd.DataFrame({'book_id': load('books_book_id'),
+                          'average_rating': load('books_average_rating'),
+                          'work_ratings_count': load('books_work_ratings_count')})
+    # dictionary columns stay encoded (categoricals), only the distinct values are decoded
+    for column in DICTIONARY_COLUMNS:
+        values = load_strings(os.path.join(columnar_dir, f'books_{column}_values'))
+        books[column] = pd.Categorical.from_codes(load(f'books_{column}_codes'), values)
+    affinity_shape = tuple(load('affinity_shape'))
+    stored = {
+        # titles and image urls stay in the memory mapped string arenas (no python string per book)
+        'titles': load_arena(os.path.join(columnar_dir, 'books_title')),
+        'image_urls': load_arena(os.path.join(columnar_dir, 'books_image_url')),
+        'author_counts': csr_matrix((load('affinity_counts'), load('affinity_indices'), load('affinity_indptr')),
+                                    shape=affinity_shape),
+        'author_sums': csr_matrix((load('affinity_sums'), load('affinity_indices'), load('affinity_indptr')),
+                                  shape=affinity_shape)}
+    columns = [column for column in BOOK_COLUMNS if column not in ARENA_COLUMNS]
+    return book_matrix, user_ratings, books[columns], normalized_matrix, stored
+
+
+def read_manifest(columnar_dir: str) -> dict:
+    """
+    read the manifest of a columnar dataset
+    :param columnar_dir: str: folder of the columnar files
+    :return: dict: manifest (None if the folder has no dataset)
+    """
+    path = os.path.join(columnar_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def is_up_to_date(manifest: dict, signature: dict) -> bool:
+    """
+    check if columnar files are converted from the current csv files
+    :param manifest: dict: manifest of the columnar files (can be None)
+    :param signature: dict: signature of the csv files (see source_signature)
+    :return: bool: True if the layout is supported and the csv files did not change since the conversion (or are
+    not in the data folder)
+    """
+    if manifest is None or manifest['version'] != COLUMNAR_VERSION:
+        return False
+    return manifest['source'] == signature or all(value is None for value in signature.values())
+
+
+def load_shared(data_dir: str = 'data', shared_dir: str = '/dev/shm/books_recommendation') -> tuple:
+    """
+    load the datasets from shared memory
+    the first process copies (or converts) the datasets in shared_dir while the others wait for it,
+    then every process memory maps the same files read-only
+    :param data_dir: str: folder of the datasets
+    :param shared_dir: str: folder of the shared columnar files (on a tmpfs like /dev/shm)
+    :return: tuple: (book_matrix, user_ratings, books, normalized_matrix, stored)
+    """
+    signature = source_signature(data_dir)
+    with open(shared_dir + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        shared = read_manifest(shared_dir)
+        if shared is None or shared['version'] != COLUMNAR_VERSION or shared['source'] != signature:
+            building_dir = f'{shared_dir}.{os.getpid()}'
+            columnar_dir = os.path.join(data_dir, 'columnar')
+            if is_up_to_date(read_manifest(columnar_dir), signature):
+                shutil.copytree(columnar_dir, building_dir)
+            else:
+                convert(data_dir, building_dir)
+            # processes still using the old files keep them until they release them
+            shutil.rmtree(shared_dir, ignore_errors=True)
+            os.rename(building_dir, shared_dir)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    return load_columnar(shared_dir, signature)
+
+
+def load_datasets(data_dir: str = 'data', data_format: str = 'auto',
+                  shared_dir: str = '/dev/shm/books_recommendation') -> tuple:
+    """
+    load the datasets in the required format
+    :param data_dir: str: folder of the datasets
+    :param data_format: str: 'csv', 'columnar', 'shared' or 'auto' (columnar if it has been converted from the current
+    csv files, else csv)
+    :param shared_dir: str: folder of the shared columnar files ('shared' format only)
+    :return: tuple: (book_matrix, user_ratings, books, normalized_matrix, stored), normalized_matrix can be None and
+    stored empty (csv format, see load_columnar)
+    """
+    columnar_dir = os.path.join(data_dir, 'columnar')
+    signature = source_signature(data_dir)
+    if data_format == 'auto':
+        # columnar files of older csv files are ignored until the converter runs again
+        data_format = 'columnar' if is_up_to_date(read_manifest(columnar_dir), signature) else 'csv'
+    if data_format == 'columnar':
+        return load_columnar(columnar_dir, signature)
+    if data_format == 'shared':
+        return load_shared(data_dir, shared_dir)
+    if data_format == 'csv':
+        return load_csv(data_dir)
+    raise ValueError(f"unknown dataset format '{data_format}' (expected 'csv', 'columnar', 'shared' or 'auto')")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert the csv datasets to the columnar format')
+    parser.add_argument('--data', default='data', help='folder of the csv files')
+    parser.add_argument('--output', default='data/columnar', help='folder of the columnar files')
+    args = parser.parse_args()
+    convert(args.data, args.output)
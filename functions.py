@@ -1,19 +1,256 @@
-from sklearn.neighbors import NearestNeighbors
-from scipy.sparse import csr_matrix
-import pandas as pd
+from cache import LRUCache
+from metrics import stage, data_size, count_page
+from admission import Deadline
+from rankings import weighted_rating, get_top_n_indexes
+from jinja2 import Environment, FileSystemLoader
+from config import CACHE_SIZE, PAGE_CACHE_SIZE, CACHE_TTL
+from config import COLLABORATIVE_ENGINE, WARM_UP_QUERIES, RATINGS_LOG_PATH, RELOAD_MARKER_PATH, categories
+from contextlib import contextmanager
+from contextvars import ContextVar
 import numpy as np
+import threading
+import weakref
+import time
+import os
+
+# the import is fast: the snapshot of the datasets and derived structures and the heavy modules (pandas, scipy,
+# scikit-learn) are loaded by warm_up (in the background when the api starts), the functions below can be called once
+# it is done
+snapshot = None
+# snapshot used by the request being computed (requests started before a reload end on the old snapshot)
+pinned = ContextVar('pinned', default=None)
+# replaced snapshots, freed when the last request using them ends
+retired = weakref.WeakSet()
+
+
+def current():
+    """
+    get the snapshot of the request being computed (the last snapshot for a new request)
+    :return: Snapshot: datasets and derived structures
+    """
+    return pinned.get() or snapshot
+
+
+@contextmanager
+def pin(data):
+    """
+    read the same snapshot until the end of the block, even if the datasets are reloaded meanwhile
+    :param data: Snapshot: datasets and derived structures
+    """
+    token = pinned.set(data)
+    try:
+        yield data
+    finally:
+        pinned.reset(token)
+
+
+# caches of intermediate results (nearest users, top author, top books by category) and of rendered pages, the
+# version of the datasets and of the snapshot is part of every cache key, and the version of the ratings of the user
+# for the results of a user
+results_cache = LRUCache(CACHE_SIZE, CACHE_TTL, version=lambda user_id: current().cache_version(user_id))
+page_cache = LRUCache(PAGE_CACHE_SIZE, CACHE_TTL, version=lambda user_id: current().cache_version(user_id))
+
+# progress of the startup: status ('starting', 'loading', 'warming', 'ready' or 'failed') and durations in seconds
+# since the import of this module
+IMPORTED = time.perf_counter()
+startup = {'status': 'starting', 'loaded_seconds': None, 'ready_seconds': None, 'error': None}
+# set when the warm-up is done (requests can be served)
+ready = threading.Event()
+warm_up_lock = threading.Lock()
+
+# progress of the reloads: status ('idle', 'building' or 'failed'), version of the current snapshot, number of
+# reloads and duration of the last one in seconds
+reloads = {'status': 'idle', 'snapshot': None, 'data_version': None, 'reloads': 0, 'seconds': None, 'error': None}
+reload_lock = threading.Lock()
+# held by the ingestions and by the swap of the snapshots (no rating is ingested into a replaced snapshot)
+swap_lock = threading.Lock()
+# version of the reload marker when the datasets were last loaded by the worker (a new version starts a reload)
+loaded_marker = None
+
+
+def marker_version():
+    """
+    get the version of the reload marker shared by the workers (a stat of the file, cheap enough for every request)
+    :return: tuple: inode and modification time of the marker (None if there is no marker)
+    """
+    if not RELOAD_MARKER_PATH:
+        return None
+    try:
+        stat = os.stat(RELOAD_MARKER_PATH)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def replace_marker():
+    """
+    replace the reload marker at once (new file renamed over the old one): every worker sees a new version
+    """
+    if not RELOAD_MARKER_PATH:
+        return
+    path = f'{RELOAD_MARKER_PATH}.{os.getpid()}'
+    with open(path, 'w') as file:
+        file.write(f'{time.time_ns()}\n')
+    os.replace(path, RELOAD_MARKER_PATH)
+
+
+def load():
+    """
+    load the datasets and build the derived structures (first snapshot)
+    """
+    global snapshot, loaded_marker
+    from snapshot import Snapshot
+    from ingest import RatingsLog
+
+    # reloads announced before the load are already taken into account
+    loaded_marker = marker_version()
+    # the ratings log is replayed by every snapshot (ratings ingested before a restart or by other workers)
+    snapshot = Snapshot.build(1, RatingsLog(RATINGS_LOG_PATH or None))
+    reloads.update(snapshot=snapshot.version, data_version=snapshot.data_version)
+
+
+def run_queries(n_queries: int):
+    """
+    run synthetic queries on every code path of the pages (on the snapshot of the caller)
+    :param n_queries: int: number of users queried
+    """
+    user_ids = sorted(current().user_ratings.user_ids)[:n_queries]
+    for user_id in user_ids:
+        ''.join(iter_html(user_id, None, True))
+        ''.join(iter_html(user_id, 'fantasy', False))
+    ''.join(iter_html(None, None, False))
+    get_recommendations(user_ids, use_precomputed=False)
+
 
-# load matrix user_matrix
-loader = np.load('data/csr_matrix.npz')
-book_matrix = csr_matrix((loader['data'], loader['indices'], loader['indptr']), shape=loader['shape'])
+def warm_up(n_queries: int = WARM_UP_QUERIES):
+    """
+    load the datasets, build the derived structures and run synthetic queries on every code path of the pages,
+    then mark the system as ready
+    called once: the next calls return when the first one is done
+    :param n_queries: int: number of users queried
+    """
+    with warm_up_lock:
+        if ready.is_set():
+            return
+        try:
+            startup['status'] = 'loading'
+            load()
+            startup['loaded_seconds'] = time.perf_counter() - IMPORTED
+            startup['status'] = 'warming'
+            run_queries(n_queries)
+        except Exception as error:
+            startup['status'] = 'failed'
+            startup['error'] = repr(error)
+            raise
+        startup['ready_seconds'] = time.perf_counter() - IMPORTED
+        startup['status'] = 'ready'
+        ready.set()
+
+
+def reload(n_queries: int = WARM_UP_QUERIES) -> bool:
+    """
+    load the datasets again in a new snapshot, warm it up and swap it with the current snapshot at once
+    requests started before the swap end on the old snapshot, which is freed when no request uses it anymore
+    :param n_queries: int: number of users queried on the new snapshot before the swap
+    :return: bool: False if a reload is already running
+    """
+    global snapshot, loaded_marker
+    from snapshot import Snapshot
+
+    if not reload_lock.acquire(blocking=False):
+        return False
+    try:
+        start = time.perf_counter()
+        reloads['status'] = 'building'
+        # a reload announced during the build starts the next one, a failed reload is not retried until the next
+        # announce
+        loaded_marker = marker_version()
+        old = snapshot
+        # the current snapshot serves the requests while the next one is built (ratings log replayed)
+        new = Snapshot.build(old.version + 1, old.ratings_store.log)
+        with pin(new):
+            run_queries(n_queries)
+        with swap_lock:
+            # ratings logged during the build, then the swap (new requests get the new snapshot)
+            new.ratings_store.sync()
+            snapshot = new
+        old.close()
+        retired.add(old)
+        reloads.update(status='idle', snapshot=new.version, data_version=new.data_version,
+                       reloads=reloads['reloads'] + 1, seconds=time.perf_counter() - start, error=None)
+    except Exception as error:
+        reloads.update(status='failed', error=repr(error))
+        raise
+    finally:
+        reload_lock.release()
+    return True
+
+
+def start_reload(announce: bool = True) -> bool:
+    """
+    start a reload in the background
+    :param announce: bool: if True the reload marker is replaced, the other workers reload the datasets too
+    :return: bool: False if a reload is already running
+    """
+    if reload_lock.locked():
+        return False
+    if announce:
+        replace_marker()
+    reloads['status'] = 'building'
+    threading.Thread(target=reload, daemon=True).start()
+    return True
 
-# load datasets
-# ratings
-ratings = pd.read_csv('data/ratings.csv')
-# books_with_cat
-books = pd.read_csv('data/books_with_cat.csv')
 
+def follow_reloads():
+    """
+    start a reload of the worker if a reload was announced by another worker since the last load
+    """
+    if marker_version() != loaded_marker:
+        start_reload(announce=False)
+
+
+def reload_stats() -> dict:
+    """
+    get the progress of the reloads
+    :return: dict: status, current snapshot, number and duration of the reloads, replaced snapshots still in use
+    """
+    return {**reloads, 'retired_in_use': len(retired)}
+
+
+def cache_stats() -> dict:
+    """
+    get the counters of the caches
+    :return: dict: counters of the results cache and of the pages cache
+    """
+    data = current()
+    return {'data_version': data.data_version, 'snapshot': data.version, 'ratings_version': data.ratings_store.version,
+            'results': results_cache.stats(), 'pages': page_cache.stats()}
 
+
+def sync_ratings():
+    """
+    apply the ratings logged by the other workers since the last request (nothing to do if the log did not change)
+    """
+    current().ratings_store.sync()
+
+
+def ingest_ratings(ratings: list) -> dict:
+    """
+    add ratings (of known or new users), taken into account by the next recommendations
+    :param ratings: list: (user id, book id, rating) tuples
+    :return: dict: number of ingested ratings, ratings waiting for a compaction and version of the ratings
+    """
+    with swap_lock:
+        data = snapshot
+        for user_id, book_id, rating in ratings:
+            if book_id not in data.book_lookup:
+                raise ValueError(f'book {book_id} not in database')
+            if not 1 <= rating <= 5:
+                raise ValueError(f'rating {rating} not between 1 and 5')
+        return data.ratings_store.ingest(ratings)
+
+
+@results_cache.memoize(user='user_index')
 def get_n_nearest_users(user_index: int, n_users: int) -> list:
     """
     get top n nearest users
@@ -22,19 +259,28 @@ def get_n_nearest_users(user_index: int, n_users: int) -> list:
     :n_users: int: number of nearest user to return
     :return: list: list of nearest users
     """
-    # instantiate NearestNeighbors algorithm
-    recommender = NearestNeighbors(metric='cosine', algorithm='brute', n_neighbors=n_users).fit(book_matrix)
     # find 'n_users' nearest users from 'user_index' user
-    _, nearest_user = recommender.kneighbors([book_matrix.toarray()[user_index - 1]])
+    nearest_user = current().neighbor_index.kneighbors(user_index - 1, n_users)
 
     similar_user = []
-    for arr in nearest_user:
-        for user in arr:
-            similar_user.append(user + 1)
+    for user in nearest_user:
+        similar_user.append(user + 1)
 
     return similar_user
 
 
+def get_n_nearest_users_batch(user_indexes: list, n_users: int) -> list:
+    """
+    get top n nearest users of several users (users are compared with the whole matrix by blocks)
+    :user_indexes: list: indexes of reference users to get nearest user from
+    :n_users: int: number of nearest user to return
+    :return: list: list of nearest users for each reference user
+    """
+    row_indexes = [user_index - 1 for user_index in user_indexes]
+    nearest_users = current().neighbor_index.kneighbors_batch(row_indexes, n_users)
+    return [[user + 1 for user in nearest_user] for nearest_user in nearest_users]
+
+
 def get_top_n_books_nearest_users(nearest_users_ids: list, n_books: int) -> list:
     """
     get top n nearest books for user
@@ -42,43 +288,87 @@ def get_top_n_books_nearest_users(nearest_users_ids: list, n_books: int) -> list
     :n_books: int: number of books to return
     :return: list: list of top n_books ids
     """
+    data = current()
     # select reference user from nearest_users_ids (nearest_users_id[0] is the reference user aka the closest to itself)
-    base_user = ratings[ratings['user_id'] == nearest_users_ids[0]]
-    # select nearest users
-    nearest_users = ratings[ratings['user_id'].isin(nearest_users_ids[1:])]
-    unread_books = []
-    # get list of books which have not been read by base_user
-    for book in nearest_users['book_id'].unique():
-        if not (book in base_user['book_id'].unique()):
-            unread_books.append(book)
-    top_books = []
-
-    for book in unread_books:
-        # creation of variables needed to calculate weighted_rating
-        # minimum count numbers for each book
-        minimum_book_count = 3
-        # number of time the book has been rated by nearest users
-        book_count = len(nearest_users[nearest_users['book_id'] == book])
-        # average rating of the book by nearest users
-        avg_book_rating = nearest_users['rating'][nearest_users['book_id'] == book].sum(axis=0) / book_count
-        # total number of ratings of nearest users
-        nb_rating = len(nearest_users)
-        # average rating of all nearest users
-        avg_rating = nearest_users['rating'].sum(axis=0) / nb_rating
-        # using weighted_rating formula from IMDB
-        # https://www.datacamp.com/community/tutorials/recommender-systems-python
-        weighted_rating = (book_count * avg_book_rating / (
-                book_count + minimum_book_count)) + minimum_book_count * avg_rating / (
-                                  book_count + minimum_book_count)
-        top_books.append(weighted_rating)
-    top_books_dict = {
-        'book_id': unread_books,
-        'rating': top_books
-    }
-    df = pd.DataFrame.from_dict(top_books_dict).sort_values(by=['rating'], ascending=False)
-    return df['book_id'][:n_books].values
+    base_user_books = data.user_ratings.books(nearest_users_ids[0])
+    # select ratings of nearest users
+    nearest_books, nearest_ratings = data.user_ratings.select(nearest_users_ids[1:])
+
+    # group ratings by book in one pass (books in order of first appearance, like unique())
+    book_ids, first_seen, book_index = np.unique(nearest_books, return_index=True, return_inverse=True)
+    appearance = np.argsort(first_seen)
+    book_ids = book_ids[appearance]
+    # number of time each book has been rated by nearest users
+    book_count = np.bincount(book_index, minlength=len(first_seen))[appearance]
+    # average rating of each book by nearest users
+    avg_book_rating = np.bincount(book_index, weights=nearest_ratings, minlength=len(first_seen))[appearance] / book_count
+
+    # keep only the books which have not been read by base_user
+    unread = ~np.isin(book_ids, base_user_books)
+    data_size('read_books', len(base_user_books))
+    data_size('neighbor_ratings', len(nearest_books))
+    data_size('candidate_books', int(unread.sum()))
+    # average rating of all nearest users
+    avg_rating = nearest_ratings.sum(axis=0) / len(nearest_ratings)
+    top_books = weighted_rating(book_count[unread], avg_book_rating[unread], avg_rating)
+    return book_ids[unread][get_top_n_indexes(top_books, n_books)]
 
 
+@results_cache.memoize(user='user_id')
+def get_top_n_books_similar_books(user_id: int, n_books: int) -> list:
+    """
+    get top n books similar to the books rated by a user (item engine)
+    :param user_id: int: id of user
+    :param n_books: int: number of books to return
+    :return: list: list of top n_books ids
+    """
+    data = current()
+    user_rating = data.user_ratings.user_ratings(user_id)
+    # sum of the similarities with the rated books weighted by the ratings, read books excluded
+    return data.item_neighbors.recommend(user_rating['book_id'].values, user_rating['rating'].values, n_books)
+
+
+def get_user_factors(user_id: int) -> np.ndarray:
+    """
+    get the latent factors of a user (latent engine)
+    :param user_id: int: id of user
+    :return: np.ndarray: factors of the user
+    """
+    data = current()
+    # users with ingested ratings (or new users) are projected from their ratings
+    if user_id in data.ratings_store.updated_users or user_id > len(data.latent_factors.user_factors):
+        user_rating = data.user_ratings.user_ratings(user_id)
+        return data.latent_factors.project(user_rating['book_id'].values, user_rating['rating'].values)
+    return data.latent_factors.user_factors[user_id - 1]
+
+
+@results_cache.memoize(user='user_id')
+def get_top_n_books_latent_factors(user_id: int, n_books: int) -> list:
+    """
+    get top n books by latent factors scores for a user (latent engine)
+    :param user_id: int: id of user
+    :param n_books: int: number of books to return
+    :return: list: list of top n_books ids
+    """
+    data = current()
+    return data.latent_factors.recommend(get_user_factors(user_id), data.user_ratings.books(user_id), n_books)
+
+
+def get_top_n_books_latent_factors_batch(user_ids: list, n_books: int) -> list:
+    """
+    get top n books by latent factors scores for several users (users are scored by blocks)
+    :param user_ids: list: ids of users
+    :param n_books: int: number of books to return for each user
+    :return: list: list of top n_books ids for each user
+    """
+    data = current()
+    user_factors = np.array([get_user_factors(user_id) for user_id in user_ids], dtype=np.float32)
+    user_factors = user_factors.reshape(len(user_ids), data.latent_factors.item_factors.shape[1])
+    return data.latent_factors.recommend_batch(user_factors,
+                                               [data.user_ratings.books(user_id) for user_id in user_ids], n_books)
+
+
+@results_cache.memoize(user='user_id')
 def get_top_n_books_by_category(category: str, n_books: int, user_id: int = None) -> list:
     """
     get top n nearest books in a specific category
@@ -86,46 +376,14 @@ def get_top_n_books_by_category(category: str, n_books: int, user_id: int = None
     :n_books: int: number of books to return
     :return: list: list of top n_books ids
     """
+    data = current()
     # get list of books already read by user (if new user user_id = None and read_books stay empty)
     read_books = []
     if user_id is not None:
-        read_books = ratings[ratings['user_id'] == user_id]['book_id'].unique()
+        read_books = data.user_ratings.books(user_id)
 
-    # select books in the required category
-    cat_books = books[(books['category'] == category) & (books['average_rating'] > 4.5)]
-    if not len(cat_books) > 5:
-        cat_books = books[(books['category'] == category) & (books['average_rating'] > 3.5)]
-    # select only the books which aren't in the read_books list
-    cat_books = cat_books[~cat_books['book_id'].isin(read_books)]
-
-    top_books = []
-
-    # minimum count numbers for each book
-    minimum_book_count = 3
-    # total number of ratings of nearest users
-    nb_rating = len(ratings)
-    # average rating of all nearest users
-    avg_rating = ratings['rating'].sum(axis=0) / nb_rating
-
-    for book_id in cat_books['book_id'].unique():
-        # creation of variables needed to calculate weighted_rating
-        # number of time the book has been rated
-        book_count = cat_books[cat_books['book_id'] == book_id]['work_ratings_count'].values[0]
-        # average rating of the book by nearest users
-        avg_book_rating = cat_books[cat_books['book_id'] == book_id]['average_rating'].values[0]
-
-        # using weighted_rating formula from IMDB
-        # https://www.datacamp.com/community/tutorials/recommender-systems-python
-        weighted_rating = (book_count * avg_book_rating / (
-                book_count + minimum_book_count)) + minimum_book_count * avg_rating / (
-                                  book_count + minimum_book_count)
-        top_books.append(weighted_rating)
-    top_books_dict = {
-        'book_id': cat_books['book_id'].unique(),
-        'rating': top_books
-    }
-    df = pd.DataFrame.from_dict(top_books_dict).sort_values(by=['rating'], ascending=False)
-    return df['book_id'][:n_books].values
+    # walk the books of the category ranked by weighted rating, skipping the read books
+    return data.popularity_index.top_n_books_by_category(category, n_books, set(read_books))
 
 
 def get_top_n_books(n_books: int, user_id: int = None) -> list:
@@ -134,46 +392,17 @@ def get_top_n_books(n_books: int, user_id: int = None) -> list:
     :n_books: int: number of books to return
     :return: list: list of top n_books ids
     """
+    data = current()
     # get list of books already read by user (if new user user_id = None and read_books stay empty)
     read_books = []
     if user_id is not None:
-        read_books = ratings[ratings['user_id'] == user_id]['book_id'].unique()
+        read_books = data.user_ratings.books(user_id)
 
-    # select books
-    best_books = books[books['average_rating'] > 4.5]
-    # select only the books which arn't in the read_books list
-    best_books = best_books[~best_books['book_id'].isin(read_books)]
-
-    top_books = []
-
-    # minimum count numbers for each book
-    minimum_book_count = 3
-    # total number of ratings of nearest users
-    nb_rating = len(ratings)
-    # average rating of all nearest users
-    avg_rating = ratings['rating'].sum(axis=0) / nb_rating
-
-    for book_id in best_books['book_id'].unique():
-        # creation of variables needed to calculate weighted_rating
-        # number of time the book has been rated
-        book_count = best_books[best_books['book_id'] == book_id]['work_ratings_count'].values[0]
-        # average rating of the book by nearest users
-        avg_book_rating = best_books[best_books['book_id'] == book_id]['average_rating'].values[0]
-
-        # using weighted_rating formula from IMDB
-        # https://www.datacamp.com/community/tutorials/recommender-systems-python
-        weighted_rating = (book_count * avg_book_rating / (
-                book_count + minimum_book_count)) + minimum_book_count * avg_rating / (
-                                  book_count + minimum_book_count)
-        top_books.append(weighted_rating)
-    top_books_dict = {
-        'book_id': best_books['book_id'].unique(),
-        'rating': top_books
-    }
-    df = pd.DataFrame.from_dict(top_books_dict).sort_values(by=['rating'], ascending=False)
-    return df['book_id'][:n_books].values
+    # walk the books ranked by weighted rating, skipping the read books
+    return data.popularity_index.top_n_books(n_books, set(read_books))
 
 
+@results_cache.memoize(user='user_id')
 def get_top_author(user_id: int, n: int = 1) -> str:
     """
     get top author for a user
@@ -181,31 +410,25 @@ def get_top_author(user_id: int, n: int = 1) -> str:
     :n: int: number of author to return
     :return: str: top author
     """
-    user_rating = ratings[ratings["user_id"] == user_id]
-
-    # merge dataframe
-    df = user_rating.merge(books, on="book_id", suffixes=('_left', '_right'))
-
-    df_by_author = df.groupby("authors").mean()
-    df_by_author = df_by_author.rename(columns={"rating": "rating_moyen_par_user"})
-
-    df = df[["book_id", "authors"]].groupby("authors").count().sort_values(by=['book_id'], ascending=False)
-    df["pourcentage-occurence"] = df.apply(lambda row: (row["book_id"] / (len(user_rating)) * 100), axis=1)
+    data = current()
+    # users with ingested ratings are aggregated from their ratings (the affinity matrices are built on the datasets)
+    if user_id in data.ratings_store.updated_users:
+        user_rating = data.user_ratings.user_ratings(user_id)
+        return data.author_affinity.top_author_of(user_rating['book_id'].values, user_rating['rating'].values)
+    # author with the best note_x_occurence (average rating x share of the ratings), read from the affinity row
+    return data.author_affinity.top_author(user_id)
 
-    # merge dataframe with dataframe modified
-    df = df.merge(df_by_author, on="authors", suffixes=('_left', '_right'))
-    df["note_x_occurence"] = df["rating_moyen_par_user"] * df["pourcentage-occurence"]
-    df.sort_values(by=['note_x_occurence'], ascending=False)
 
-    # deplace feature "note_x_occurence" at the beginning
-    note_x_occurence = df['note_x_occurence']
-    df.drop(labels=['note_x_occurence'], axis=1, inplace=True)
-    df.insert(0, 'note_x_occurence', note_x_occurence)
-
-    # keep N best author for the user
-    result = df.note_x_occurence[:n].index
-
-    return result[0]
+def get_top_authors(user_ids: list) -> list:
+    """
+    get top author of several users at once
+    :param user_ids: list: ids of users
+    :return: list: top author of each user
+    """
+    data = current()
+    authors = data.author_affinity.top_authors(user_ids)
+    return [get_top_author.__wrapped__(user_id) if author is None or user_id in data.ratings_store.updated_users
+            else author for user_id, author in zip(user_ids, authors)]
 
 
 def get_top_n_books_by_author(author: str, user_id: int, n_books: int) -> list:
@@ -216,94 +439,101 @@ def get_top_n_books_by_author(author: str, user_id: int, n_books: int) -> list:
     :n_books: int: number of books to return
     :return: list: list of top n_books ids
     """
+    data = current()
     # get list of books already read by user (if new user user_id = None and read_books stay empty)
     read_books = []
     if user_id is not None:
-        read_books = ratings[ratings['user_id'] == user_id]['book_id'].unique()
+        read_books = data.user_ratings.books(user_id)
 
-    # select books by the required author
-    df_books_auteur = books[books["authors"] == author]
-    # select only the books which arn't in the read_books list
-    df_books_auteur = df_books_auteur[~df_books_auteur['book_id'].isin(read_books)]
+    # walk the books of the author ranked by weighted rating, skipping the read books
+    return data.popularity_index.top_n_books_by_author(author, n_books, set(read_books))
 
-    top_books = []
 
-    # minimum count numbers for each book
-    minimum_book_count = 3
-    # total number of ratings of nearest users
-    nb_rating = len(ratings)
-    # average rating of all nearest users
-    avg_rating = ratings['rating'].sum(axis=0) / nb_rating
-
-    for book_id in df_books_auteur['book_id'].unique():
-        # creation of variables needed to calculate weighted_rating
-        # number of time the book has been rated
-        book_count = df_books_auteur[df_books_auteur['book_id'] == book_id]['work_ratings_count'].values[0]
-        # average rating of the book by nearest users
-        avg_book_rating = df_books_auteur[df_books_auteur['book_id'] == book_id]['average_rating'].values[0]
-
-        # using weighted_rating formula from IMDB
-        # https://www.datacamp.com/community/tutorials/recommender-systems-python
-        weighted_rating = (book_count * avg_book_rating / (
-                book_count + minimum_book_count)) + minimum_book_count * avg_rating / (
-                                  book_count + minimum_book_count)
-        top_books.append(weighted_rating)
-    top_books_dict = {
-        'book_id': df_books_auteur['book_id'].unique(),
-        'rating': top_books
-    }
-    df = pd.DataFrame.from_dict(top_books_dict).sort_values(by=['rating'], ascending=False)
-    return df['book_id'][:n_books].values
+def get_book_name(books_id: list) -> list:
+    return current().book_lookup.titles_of(books_id)
 
 
-def get_book_name(books_id: list) -> list:
-    books_name = []
-    for book_id in books_id:
-        book_name = books['title'][books['book_id'] == book_id].values
-        books_name.append(book_name[0])
-    return books_name
-
-
-categories = ['action & adventure', 'fantasy', 'romance', 'mystery & thriller', 'classic',
-              'memoir & autobiography', 'historical fiction', 'graphic novel & comic',
-              'science fiction', 'history', 'horror', "children's", 'science', 'humor',
-              'self development', 'dystopia', 'paranormal romance', 'anthology', 'poetry',
-              'cookbooks', 'essay', 'drama', 'other']
-
-HTML = """
-        <html>
-            <head>
-                <title>Some HTML in here</title>
-                <link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/bootstrap/3.4.1/css/bootstrap.min.css">
-            </head>
-            <body>
-                <a href="http://127.0.0.1:8000/recommandation" class="btn btn-info" role="button">Home page</a>
-        """
-
-END = """
-        </body>
-    </html>
-"""
-
-NEAREST_USER_HTML = """
-                    <div class="text-center">
-                    <hr/>
-                        <p class="h3">
-                            Top books based on your nearest users
-                        </p>
-                    <hr/>
-                    </div>
-                        """
-
-GENERAL_HTML = """
-                    <div class="text-center">
-                    <hr/>
-                        <p class="h3">
-                            General Top books
-                        </p>
-                    <hr/>
-                    </div>
-                        """
+def get_precomputed(user_id: int, n_books: int) -> dict:
+    """
+    get the precomputed recommendations of a user if they are up to date
+    :param user_id: int: id of user
+    :param n_books: int: number of books per section
+    :return: dict: recommendations of the user (None if not precomputed or if the user has ingested ratings)
+    """
+    data = current()
+    if data.precomputed is None or n_books > data.precomputed.n_books or user_id not in data.precomputed \
+            or user_id in data.ratings_store.updated_users:
+        return None
+    return data.precomputed.get(user_id, n_books)
+
+
+def get_recommendations(user_ids: list, n_books: int = 5, category: str = None, all_cat: bool = False,
+                        use_precomputed: bool = True) -> dict:
+    """
+    get the recommended book ids of several users, for each section of the html page
+    nearest users of all users are computed together
+    :param user_ids: list: ids of users
+    :param n_books: int: number of books per section
+    :param category: str: book category (can be None)
+    :param all_cat: bool: if True get one book for all category else top 5 categories (if category is None)
+    :param use_precomputed: bool: serve the precomputed recommendations when possible
+    :return: dict: recommendations of each user and list of unknown user ids
+    """
+    # every section is computed on the same snapshot (even if the datasets are reloaded meanwhile)
+    with pin(current()) as data:
+        unknown_user_ids = [user_id for user_id in user_ids if user_id not in data.user_ratings]
+        user_ids = [user_id for user_id in user_ids if user_id in data.user_ratings]
+        recommendations = {}
+
+        # default sections are served from the precomputed recommendations (except for users with ingested ratings)
+        if use_precomputed and category is None and not all_cat:
+            for user_id in user_ids:
+                recommendation = get_precomputed(user_id, n_books)
+                if recommendation is not None:
+                    recommendations[user_id] = recommendation
+
+        # the other users are computed (without filling the caches)
+        to_compute = [user_id for user_id in user_ids if user_id not in recommendations]
+        list_of_cat = [category] if category else categories if all_cat else categories[:5]
+        n_books_by_cat = n_books if category else 1
+        if COLLABORATIVE_ENGINE == 'item':
+            collaborative = [get_top_n_books_similar_books.__wrapped__(user_id, n_books) for user_id in to_compute]
+        elif COLLABORATIVE_ENGINE == 'latent':
+            collaborative = get_top_n_books_latent_factors_batch(to_compute, n_books)
+        else:
+            collaborative = [get_top_n_books_nearest_users(nearest_users, n_books)
+                             for nearest_users in get_n_nearest_users_batch(to_compute, 5)]
+        authors = get_top_authors(to_compute)
+        for user_id, collaborative_books, author in zip(to_compute, collaborative, authors):
+            recommendations[user_id] = {
+                'user_id': user_id,
+                'nearest_users': collaborative_books.tolist(),
+                'author': author,
+                'favorite_author': get_top_n_books_by_author(author, user_id, n_books).tolist(),
+                'categories': {cat: get_top_n_books_by_category.__wrapped__(cat, n_books_by_cat, user_id).tolist()
+                               for cat in list_of_cat}
+            }
+
+        return {'recommendations': [recommendations[user_id] for user_id in user_ids],
+                'unknown_user_ids': unknown_user_ids}
+
+
+# compiled templates of the sections of the html page
+sections = Environment(loader=FileSystemLoader('templates/sections'), keep_trailing_newline=True)
+PICTURES_TEMPLATE = sections.get_template('pictures.html')
+NAMES_TEMPLATE = sections.get_template('names.html')
+AUTHOR_TEMPLATE = sections.get_template('author_title.html')
+CATEGORY_TEMPLATE = sections.get_template('category_title.html')
+
+HTML = sections.get_template('page_header.html').render()
+
+END = sections.get_template('page_end.html').render()
+
+NEAREST_USER_HTML = sections.get_template('nearest_users_title.html').render()
+
+GENERAL_HTML = sections.get_template('general_title.html').render()
+
+DEGRADED_TEMPLATE = sections.get_template('degraded.html')
 
 
 def get_pictures(book_list: list) -> str:
@@ -312,21 +542,7 @@ def get_pictures(book_list: list) -> str:
     :param book_list: list: list of book ids
     :return: str: html book pictures
     """
-    html = """
-            <div class="form-group row">
-                <div class="col-sm-1"></div>
-    """
-    for id in range(len(book_list)):
-        html += f"""
-                        <div class="col-sm-2">
-                                <img src="{books[books['book_id'] == book_list[id]]['image_url'].values[0]}" class="center-block">
-                        </div>
-                        """
-    html += """
-                <div class="col-sm-1"></div>
-            </div>
-    """
-    return html
+    return PICTURES_TEMPLATE.render(image_urls=current().book_lookup.image_urls_of(book_list))
 
 
 def get_html_names(book_list: list) -> str:
@@ -335,23 +551,7 @@ def get_html_names(book_list: list) -> str:
     :param book_list: list: list of books title
     :return: str: html book names
     """
-    html = """
-            <div class="form-group row">
-                <div class="col-sm-1"></div>
-    """
-    for id in range(len(book_list)):
-        html += f"""
-                    <div class="text-center">
-                        <div class="col-sm-2">
-                            {book_list[id]}
-                        </div>
-                    </div>
-                """
-    html += """
-                <div class="col-sm-1"></div>
-            </div>
-    """
-    return html
+    return NAMES_TEMPLATE.render(names=book_list)
 
 
 def get_html_author(author: str) -> str:
@@ -360,15 +560,7 @@ def get_html_author(author: str) -> str:
     :param author: str: author name
     :return: str: html title for author
     """
-    return f"""
-                <div class="text-center">
-                <hr/>
-                    <p class="h3">
-                        Top books based on your favorite author {author}
-                    </p>
-                <hr/>
-                </div>
-                """
+    return AUTHOR_TEMPLATE.render(author=author)
 
 
 def get_html_category(category: list, cat_row: int = 0) -> str:
@@ -378,145 +570,186 @@ def get_html_category(category: list, cat_row: int = 0) -> str:
     :param cat_row: int: index of category row (used for displaying all categories)
     :return: str: html title for category
     """
-    if len(category) == 1:
-        return f"""
-                <div class="text-center">
-                <hr/>
-                    <p class="h3">
-                        Top books based on the {category[0]} category
-                    </p>
-                <hr/>
-                </div>
-                """
-    else:
-        html = ''
-        if cat_row == 0:
-            html += f"""
-                <div class="text-center">
-                <hr/>
-                    <p class="h3">
-                        Top books by category
-                    </p>
-                <hr/>
-                </div>
-                """
-        html += """
-                <div class="form-group row">
-                    <div class="col-sm-1"></div>
-                """
-        for cat in category:
-            html += f"""
-                    <div class="text-center">
-                        <div class="col-sm-2">
-                            <p class="h4">
-                                {cat}
-                            </p>
-                        </div>
-                    </div>"""
-        html += """
-                    <div class="col-sm-1"></div>
-                </div>
-                """
-        return html
-
-
-def get_html(user_id: int, category: str, all_cat: bool) -> str:
+    return CATEGORY_TEMPLATE.render(categories=category, cat_row=cat_row)
+
+
+def get_html(user_id: int, category: str, all_cat: bool, deadline: Deadline = None) -> str:
     """
     create an HTML page
     :param user_id: int: id of user (can be None)
     :param category: str: book category (can be None)
     :param all_cat: bool: if True get one book for all category else top 5 categories
+    :param deadline: Deadline: latency budget of the request (None: no budget)
     :return: str: html page
     """
-    html = HTML
-    # check if user_id is in database
-    if user_id not in ratings['user_id'].unique() and user_id is not None:
-        return str(user_id)
-
-    if user_id:
-        # get nearest_users
-        nearest_users = get_n_nearest_users(user_id, 5)
-        # get suggested books from nearest users
-        nearest_users_suggested_books = get_top_n_books_nearest_users(nearest_users, 5)
-        # get books names from list ok book_id
-        books_name_nu = get_book_name(nearest_users_suggested_books)
-        # convert to html
-        html += NEAREST_USER_HTML + get_pictures(nearest_users_suggested_books) + get_html_names(books_name_nu)
-        # get top author
-        author = get_top_author(user_id)
-        # get books from top author
-        books_id_from_top_author = get_top_n_books_by_author(author, user_id, 5)
-        # get books name from author
-        books_from_top_author = get_book_name(books_id_from_top_author)
-        # convert to html
-        html += get_html_author(author) + get_pictures(books_id_from_top_author) + get_html_names(books_from_top_author)
+    return ''.join(stream_html(user_id, category, all_cat, deadline))
 
-        if category:
-            # get suggested books from category
-            list_of_books = get_top_n_books_by_category(category, 5, user_id)
-            # get books names from list of book_id
-            books_name_cat = get_book_name(list_of_books)
-            # convert to html
-            html += get_html_category([category]) + get_pictures(list_of_books) + get_html_names(books_name_cat)
-            return html + END
-        else:
-            if all_cat:
-                list_of_cat = categories
+
+def stream_html(user_id: int, category: str, all_cat: bool, deadline: Deadline = None):
+    """
+    create an HTML page section by section (cached pages are sent at once, degraded pages are not cached)
+    :param user_id: int: id of user (can be None)
+    :param category: str: book category (can be None)
+    :param all_cat: bool: if True get one book for all category else top 5 categories
+    :param deadline: Deadline: latency budget of the request (None: no budget)
+    :return: generator: parts of the html page
+    """
+    # the page is computed on the snapshot of the start of the request
+    data = current()
+    deadline = deadline or Deadline()
+    key = ('html', user_id, category, all_cat)
+    with pin(data), stage('page_cache'):
+        html = page_cache.get(key, user_id=user_id)
+    if html is not None:
+        count_page('cache')
+        yield html
+        return
+    count_page('computed')
+    chunks = []
+    parts = iter_html(user_id, category, all_cat, deadline)
+    while True:
+        # the snapshot is pinned around each part only: a streamed response computes each part in a new context
+        with pin(data):
+            chunk = next(parts, None)
+        if chunk is None:
+            break
+        chunks.append(chunk)
+        yield chunk
+    if deadline.degraded:
+        count_page('degraded')
+    else:
+        with pin(data):
+            page_cache.set(key, ''.join(chunks), user_id)
+
+
+def iter_html(user_id: int, category: str, all_cat: bool, deadline: Deadline = None):
+    """
+    create an HTML page section by section, the header is sent before any computation
+    the sections started after the deadline are served from precomputed results
+    :param user_id: int: id of user (can be None)
+    :param category: str: book category (can be None)
+    :param all_cat: bool: if True get one book for all category else top 5 categories
+    :param deadline: Deadline: latency budget of the request (None: no budget)
+    :return: generator: parts of the html page
+    """
+    deadline = deadline or Deadline()
+    # check if user_id is in database
+    if user_id is not None and user_id not in current().user_ratings:
+        yield str(user_id)
+        return
+    yield HTML
+
+    # every stage is measured (metrics and profiling), sections are yielded outside of the stages
+    if user_id and deadline.expired():
+        deadline.degrade('collaborative')
+        with stage('fallback'):
+            # budget exhausted: precomputed books of the user, else most popular books not read by the user
+            recommendation = get_precomputed(user_id, 5)
+            if recommendation is not None:
+                title, nearest_users_suggested_books = NEAREST_USER_HTML, recommendation['nearest_users']
             else:
-                # get top 5 categories
-                list_of_cat = categories[:5]
-            # initialize list
-            list_of_books = []
-            # get list of book ids (1 per category)
-            for cat in list_of_cat:
-                list_of_books.append(get_top_n_books_by_category(cat, 1, user_id)[0])
-            # get book names from book list
-            books_name_cat = (get_book_name(list_of_books))
+                title, nearest_users_suggested_books = GENERAL_HTML, get_top_n_books(5, user_id)
+            section = title + get_pictures(nearest_users_suggested_books) + get_html_names(
+                get_book_name(nearest_users_suggested_books))
+        yield section
+    elif user_id:
+        if COLLABORATIVE_ENGINE == 'item':
+            with stage('similar_books'):
+                # get suggested books from the books similar to the books rated by the user
+                nearest_users_suggested_books = get_top_n_books_similar_books(user_id, 5)
+        elif COLLABORATIVE_ENGINE == 'latent':
+            with stage('latent_factors'):
+                # get suggested books from the scores of the latent factors of the user
+                nearest_users_suggested_books = get_top_n_books_latent_factors(user_id, 5)
+        else:
+            with stage('nearest_users'):
+                # get nearest_users
+                nearest_users = get_n_nearest_users(user_id, 5)
+            with stage('nearest_users_books'):
+                # get suggested books from nearest users
+                nearest_users_suggested_books = get_top_n_books_nearest_users(nearest_users, 5)
+        with stage('render'):
+            # get books names from list ok book_id
+            books_name_nu = get_book_name(nearest_users_suggested_books)
             # convert to html
-            remain = 0
-            if len(list_of_cat) % 5 != 0:
-                remain = 1
-            for i in range(0, len(list_of_cat) // 5 + remain):
-                start = i * 5
-                end = start + 5
-                html += get_html_category(list_of_cat[start:end], i) + get_pictures(
-                    list_of_books[start:end]) + get_html_names(books_name_cat[start:end])
-            return html + END
+            section = NEAREST_USER_HTML + get_pictures(nearest_users_suggested_books) + get_html_names(books_name_nu)
+        yield section
+    if user_id and deadline.expired():
+        deadline.degrade('author')
+        with stage('fallback'):
+            # budget exhausted: precomputed favorite author of the user, else no author section
+            recommendation = get_precomputed(user_id, 5)
+            section = ''
+            if recommendation is not None:
+                books_id_from_top_author = recommendation['favorite_author']
+                section = get_html_author(recommendation['author']) + get_pictures(
+                    books_id_from_top_author) + get_html_names(get_book_name(books_id_from_top_author))
+        yield section
+    elif user_id:
+        with stage('top_author'):
+            # get top author
+            author = get_top_author(user_id)
+        with stage('author_books'):
+            # get books from top author
+            books_id_from_top_author = get_top_n_books_by_author(author, user_id, 5)
+            # get books name from author
+            books_from_top_author = get_book_name(books_id_from_top_author)
+        with stage('render'):
+            # convert to html
+            section = get_html_author(author) + get_pictures(books_id_from_top_author) + get_html_names(
+                books_from_top_author)
+        yield section
     else:
-        # get the id of top books for whole users
-        list_of_books = get_top_n_books(5)
-        # get books names based on book ids
-        books_name_all = get_book_name(list_of_books)
-        # convert to html
-        html += GENERAL_HTML + get_pictures(list_of_books) + get_html_names(books_name_all)
-        if category:
+        with stage('top_books'):
+            # get the id of top books for whole users
+            list_of_books = get_top_n_books(5)
+            # get books names based on book ids
+            books_name_all = get_book_name(list_of_books)
+        with stage('render'):
+            # convert to html
+            section = GENERAL_HTML + get_pictures(list_of_books) + get_html_names(books_name_all)
+        yield section
+
+    # budget exhausted: books of the categories are not personalized (rankings shared by every user)
+    category_user_id = user_id
+    if user_id and deadline.expired():
+        deadline.degrade('categories')
+        category_user_id = None
+    if category:
+        with stage('category_books'):
             # get suggested books from category
-            list_of_books = get_top_n_books_by_category(category, 5)
+            list_of_books = get_top_n_books_by_category(category, 5, category_user_id)
             # get books names from list of book_id
             books_name_cat = get_book_name(list_of_books)
+        with stage('render'):
             # convert to html
-            html += get_html_category([category]) + get_pictures(list_of_books) + get_html_names(books_name_cat)
-            return html + END
+            section = get_html_category([category]) + get_pictures(list_of_books) + get_html_names(books_name_cat)
+        yield section
+    else:
+        if all_cat:
+            list_of_cat = categories
         else:
-            print(all_cat)
-            if all_cat:
-                list_of_cat = categories
-            else:
-                # get top 5 categories
-                list_of_cat = categories[:5]
+            # get top 5 categories
+            list_of_cat = categories[:5]
+        with stage('category_books'):
             # initialize list
             list_of_books = []
             # get list of book ids (1 per category)
             for cat in list_of_cat:
-                list_of_books.append(get_top_n_books_by_category(cat, 1)[0])
-            # get list of book names
+                list_of_books.append(get_top_n_books_by_category(cat, 1, category_user_id)[0])
+            # get book names from book list
             books_name_cat = get_book_name(list_of_books)
-            # convert to html
-            remain = 0
-            if len(list_of_cat) % 5 != 0:
-                remain = 1
-            for i in range(0, len(list_of_cat)//5 + remain):
-                start = i * 5
-                end = start + 5
-                html += get_html_category(list_of_cat[start:end], i) + get_pictures(list_of_books[start:end]) + get_html_names(books_name_cat[start:end])
-            return html + END
+        # convert to html
+        remain = 0
+        if len(list_of_cat) % 5 != 0:
+            remain = 1
+        for i in range(0, len(list_of_cat) // 5 + remain):
+            start = i * 5
+            end = start + 5
+            with stage('render'):
+                section = get_html_category(list_of_cat[start:end], i) + get_pictures(
+                    list_of_books[start:end]) + get_html_names(books_name_cat[start:end])
+            yield section
+    if deadline.degraded:
+        yield DEGRADED_TEMPLATE.render(sections=deadline.degraded)
+    yield END
@@ -0,0 +1,139 @@
+"""
+generate synthetic datasets with the schema of the files downloaded by data/data.sh (no network needed)
+- ratings.csv: user_id, book_id, rating (sorted by user), a user rates a book at most once
+- books_with_cat.csv: book_id, authors, title, average_rating, work_ratings_count, image_url, category
+- csr_matrix.npz: matrix of ratings (row: user_id - 1, column: book_id - 1)
+popularity of books, activity of users, books per author and books per category follow skewed distributions
+default sizes are the sizes of the goodreads datasets
+usage (from the main folder): python generate.py [--output data/synthetic] [--users 53424] [--books 10000]
+                                                 [--ratings 5976479] [--seed 0]
+"""
+from scipy.sparse import csr_matrix, save_npz
+from config import categories
+from dataset import BOOK_COLUMNS
+import pandas as pd
+import numpy as np
+import argparse
+import time
+import os
+
+
+def zipf_weights(n_values: int, skew: float) -> np.ndarray:
+    """
+    get the probabilities of a zipf-like distribution (the first value is the most frequent)
+    :param n_values: int: number of values
+    :param skew: float: exponent of the distribution (0: uniform)
+    :return: np.ndarray: probability of each value
+    """
+    weights = 1 / np.arange(1, n_values + 1) ** skew
+    return weights / weights.sum()
+
+
+def generate_ratings(random: np.random.RandomState, n_users: int, n_books: int, n_ratings: int,
+                     popularity_skew: float, activity_sigma: float) -> pd.DataFrame:
+    """
+    draw the ratings: books by popularity (book 1 is the most popular), number of ratings per user log-normal
+    :param random: np.random.RandomState: random generator
+    :param n_users: int: number of users
+    :param n_books: int: number of books
+    :param n_ratings: int: approximate number of ratings (less if users draw the same books too often)
+    :param popularity_skew: float: skew of the popularity of books
+    :param activity_sigma: float: sigma of the log-normal number of ratings per user
+    :return: pd.DataFrame: ratings (user_id, book_id, rating) sorted by user
+    """
+    activity = random.lognormal(0, activity_sigma, n_users)
+    counts = np.clip(np.round(activity / activity.sum() * n_ratings), 1, n_books).astype(np.int64)
+    # twice as many draws as ratings, popular books are drawn several times by the same user
+    user_ids = np.repeat(np.arange(1, n_users + 1), 2 * counts)
+    book_ids = random.choice(n_books, size=len(user_ids), p=zipf_weights(n_books, popularity_skew)) + 1
+    # a user rates a book once: keep the first draw of each book, then the first counts draws of each user
+    _, first = np.unique(user_ids * (n_books + 1) + book_ids, return_index=True)
+    first = random.permutation(first)
+    first = first[np.argsort(user_ids[first], kind='stable')]
+    users, starts = np.unique(user_ids[first], return_index=True)
+    lengths = np.diff(np.append(starts, len(first)))
+    rank = np.arange(len(first)) - np.repeat(starts, lengths)
+    first = first[rank < np.repeat(counts[users - 1], lengths)]
+    user_ids, book_ids = user_ids[first], book_ids[first]
+    # rating: quality of the book + bias of the user + noise
+    quality = np.clip(random.normal(3.9, 0.35, n_books + 1), 1, 5)
+    bias = random.normal(0, 0.4, n_users + 1)
+    ratings = np.clip(np.round(quality[book_ids] + bias[user_ids] + random.normal(0, 0.9, len(user_ids))), 1, 5)
+    return pd.DataFrame({'user_id': user_ids, 'book_id': book_ids, 'rating': ratings.astype(np.int64)})
+
+
+def generate_books(random: np.random.RandomState, ratings: pd.DataFrame, n_books: int, n_authors: int,
+                   author_skew: float, category_skew: float) -> pd.DataFrame:
+    """
+    draw the books: authors and categories by skewed distributions, statistics from the ratings
+    :param random: np.random.RandomState: random generator
+    :param ratings: pd.DataFrame: ratings (user_id, book_id, rating)
+    :param n_books: int: number of books
+    :param n_authors: int: number of authors
+    :param author_skew: float: skew of the number of books per author
+    :param category_skew: float: skew of the number of books per category (in the order of categories)
+    :return: pd.DataFrame: books with the columns of books_with_cat.csv
+    """
+    book_ids = np.arange(1, n_books + 1)
+    counts = np.bincount(ratings['book_id'].values, minlength=n_books + 1)[1:]
+    sums = np.bincount(ratings['book_id'].values, weights=ratings['rating'].values, minlength=n_books + 1)[1:]
+    average_rating = np.where(counts > 0, sums / np.maximum(counts, 1), random.uniform(3, 4.5, n_books))
+    authors = random.choice(n_authors, size=n_books, p=zipf_weights(n_authors, author_skew))
+    book_categories = random.choice(len(categories), size=n_books, p=zipf_weights(len(categories), category_skew))
+    return pd.DataFrame({'book_id': book_ids,
+                         'authors': [f'Author {author}' for author in authors],
+                         'title': [f'Book {book_id}' for book_id in book_ids],
+                         'average_rating': np.round(average_rating, 2),
+                         # goodreads counts every rating of the book, far more than the ratings of the dataset
+                         'work_ratings_count': np.maximum(counts, 1) * random.randint(20, 200, n_books),
+                         'image_url': [f'https://images.gr-assets.com/books/{book_id}m/{book_id}.jpg'
+                                       for book_id in book_ids],
+                         'category': np.array(categories)[book_categories]})[BOOK_COLUMNS]
+
+
+def generate(output: str = 'data/synthetic', n_users: int = 53424, n_books: int = 10000, n_ratings: int = 5976479,
+             n_authors: int = 4664, popularity_skew: float = 1.0, activity_sigma: float = 0.6,
+             author_skew: float = 1.1, category_skew: float = 1.0, seed: int = 0):
+    """
+    generate the synthetic datasets and write them in the output folder
+    :param output: str: folder of the datasets
+    :param n_users: int: number of users
+    :param n_books: int: number of books
+    :param n_ratings: int: approximate number of ratings
+    :param n_authors: int: number of authors
+    :param popularity_skew: float: skew of the popularity of books
+    :param activity_sigma: float: sigma of the log-normal number of ratings per user
+    :param author_skew: float: skew of the number of books per author
+    :param category_skew: float: skew of the number of books per category
+    :param seed: int: seed of the random generator
+    """
+    random = np.random.RandomState(seed)
+    os.makedirs(output, exist_ok=True)
+    ratings = generate_ratings(random, n_users, n_books, n_ratings, popularity_skew, activity_sigma)
+    books = generate_books(random, ratings, n_books, n_authors, author_skew, category_skew)
+    matrix = csr_matrix((ratings['rating'].values.astype(np.float64),
+                         (ratings['user_id'].values - 1, ratings['book_id'].values - 1)), shape=(n_users, n_books))
+    ratings.to_csv(os.path.join(output, 'ratings.csv'), index=False)
+    books.to_csv(os.path.join(output, 'books_with_cat.csv'), index=False)
+    save_npz(os.path.join(output, 'csr_matrix.npz'), matrix)
+    return ratings, books
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='generate synthetic datasets (ratings, books, matrix of ratings)')
+    parser.add_argument('--output', default='data/synthetic', help='folder of the datasets')
+    parser.add_argument('--users', type=int, default=53424, help='number of users')
+    parser.add_argument('--books', type=int, default=10000, help='number of books')
+    parser.add_argument('--ratings', type=int, default=5976479, help='approximate number of ratings')
+    parser.add_argument('--authors', type=int, default=4664, help='number of authors')
+    parser.add_argument('--popularity-skew', type=float, default=1.0, help='skew of the popularity of books')
+    parser.add_argument('--activity-sigma', type=float, default=0.6, help='sigma of the ratings per user')
+    parser.add_argument('--author-skew', type=float, default=1.1, help='skew of the books per author')
+    parser.add_argument('--category-skew', type=float, default=1.0, help='skew of the books per category')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    ratings, books = generate(args.output, args.users, args.books, args.ratings, args.authors, args.popularity_skew,
+                              args.activity_sigma, args.author_skew, args.category_skew, args.seed)
+    print(f'{len(ratings)} ratings of {ratings["user_id"].nunique()} users on {len(books)} books written in '
+          f'{args.output} ({time.perf_counter() - start:.1f}s)')
@@ -0,0 +1,546 @@
+"""
+incremental ingestion of ratings (new ratings of known users and new users) without restarting the api
+ingested ratings are kept in delta buffers merged with the datasets at read time, then compacted periodically
+into new datasets (ratings grouped by user, matrix of ratings and nearest users index)
+ingested ratings are appended to a ratings log: replayed when the datasets are loaded and read by every worker
+"""
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+from data_access import UserRatingsIndex, BookLookup
+from dataset import compact_ratings
+from contextlib import contextmanager
+import pandas as pd
+import numpy as np
+import threading
+import fcntl
+import os
+
+
+class RatingsState:
+    """
+    immutable state of the ratings: datasets of the last compaction and ratings ingested since then
+    readers get the current state once and never see a partially applied write
+    """
+
+    def __init__(self, user_ratings: UserRatingsIndex, matrix: csr_matrix, neighbor_index, version: int = 0,
+                 delta: dict = None, n_delta_ratings: int = 0, n_new_rows: int = 0):
+        """
+        :param user_ratings: UserRatingsIndex: ratings of the datasets grouped by user
+        :param matrix: csr_matrix: matrix of ratings of users (one row per user)
+        :param neighbor_index: CosineNeighborIndex: nearest users index of the matrix
+        :param version: int: number of ingestions since the start
+        :param delta: dict: user id -> (rows, book ids, ratings) of the whole history of users having new ratings
+        :param n_delta_ratings: int: number of ratings ingested since the last compaction
+        :param n_new_rows: int: number of ratings appended after the ratings of the datasets
+        """
+        self.user_ratings = user_ratings
+        self.matrix = matrix
+        self.neighbor_index = neighbor_index
+        self.version = version
+        self.delta = delta or {}
+        self.n_delta_ratings = n_delta_ratings
+        self.n_new_rows = n_new_rows
+        self.n_new_users = sum(user_id not in user_ratings for user_id in self.delta)
+        # rows of the users having new ratings and their l2 normalized ratings, replacing the rows of the matrix
+        self.delta_rows = np.array(sorted(self.delta), dtype=np.int64) - 1
+        self.delta_normalized = self.delta_matrix(self.delta_rows + 1) if self.delta else None
+
+    @property
+    def n_rows(self) -> int:
+        """
+        number of rows of the matrix once the ingested ratings are compacted (one row per user id)
+        """
+        return max(self.matrix.shape[0], int(self.delta_rows.max()) + 1 if len(self.delta_rows) else 0)
+
+    @property
+    def next_user_id(self) -> int:
+        """
+        id of the next new user: user ids are matrix rows, so new users get consecutive ids
+        """
+        return self.n_rows + 1
+
+    def delta_matrix(self, user_ids: np.ndarray) -> csr_matrix:
+        """
+        build the l2 normalized matrix of the whole history of users having new ratings
+        :param user_ids: np.ndarray: ids of the users (one row per user)
+        :return: csr_matrix: normalized ratings of the users (float64)
+        """
+        histories = [self.delta[user_id] for user_id in user_ids.tolist()]
+        lengths = [len(book_ids) for _, book_ids, _ in histories]
+        indptr = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        indices = np.concatenate([book_ids - 1 for _, book_ids, _ in histories])
+        data = np.concatenate([ratings for _, _, ratings in histories]).astype(np.float64)
+        return normalize(csr_matrix((data, indices, indptr), shape=(len(histories), self.matrix.shape[1])))
+
+    def history(self, user_id: int) -> tuple:
+        """
+        get the ratings of a user merged with the ratings ingested since the last compaction
+        :param user_id: int: id of user
+        :return: tuple: (rows, book ids, ratings) in the order of the ratings
+        """
+        if user_id in self.delta:
+            return self.delta[user_id]
+        user_slice = self.user_ratings.slice(user_id)
+        return (self.user_ratings.rows[user_slice], self.user_ratings.book_ids[user_slice],
+                self.user_ratings.ratings[user_slice])
+
+    def apply(self, ratings: list, version: int = None) -> 'RatingsState':
+        """
+        apply new ratings: a new rating of a book already rated by the user replaces the rating
+        :param ratings: list: (user id, book id, rating) tuples
+        :param version: int: version of the new state (next version if None)
+        :return: RatingsState: new state (self is left unchanged)
+        """
+        n_new_rows = self.n_new_rows
+        n_rows = len(self.user_ratings.rows)
+        # user id -> {book id: [row, rating]} in the order of the ratings, for the users of the new ratings
+        merged_users = {}
+        for user_id, book_id, rating in ratings:
+            merged = merged_users.get(user_id)
+            if merged is None:
+                merged = merged_users[user_id] = {}
+                for row, previous_book_id, previous in zip(*(values.tolist() for values in self.history(user_id))):
+                    merged.setdefault(previous_book_id, [row, previous])
+            if book_id in merged:
+                merged[book_id][1] = rating
+            else:
+                # new ratings are appended after the ratings of the datasets
+                merged[book_id] = [n_rows + n_new_rows, rating]
+                n_new_rows += 1
+        delta = dict(self.delta)
+        for user_id, merged in merged_users.items():
+            delta[user_id] = (np.array([row for row, _ in merged.values()], dtype=np.int64),
+                              np.array(list(merged), dtype=np.int64),
+                              np.array([rating for _, rating in merged.values()], dtype=np.int64))
+        return RatingsState(self.user_ratings, self.matrix, self.neighbor_index,
+                            self.version + 1 if version is None else version, delta,
+                            self.n_delta_ratings + len(ratings), n_new_rows)
+
+    def compacted(self, build_index) -> tuple:
+        """
+        merge the ratings ingested since the last compaction into new datasets
+        :param build_index: callable: builds the nearest users index of a matrix
+        :return: tuple: (user ratings, matrix, nearest users index)
+        """
+        base = self.user_ratings
+        n_rows = len(base.rows)
+        # ratings of the datasets back in the order of the ratings dataset
+        user_ids = np.empty(n_rows + self.n_new_rows, dtype=np.int64)
+        book_ids = np.empty(n_rows + self.n_new_rows, dtype=base.book_ids.dtype)
+        ratings = np.empty(n_rows + self.n_new_rows, dtype=base.ratings.dtype)
+        user_ids[base.rows] = np.repeat(base.users, np.diff(base.offsets))
+        book_ids[base.rows] = base.book_ids
+        ratings[base.rows] = base.ratings
+        for user_id, (rows, user_book_ids, user_ratings) in self.delta.items():
+            user_ids[rows] = user_id
+            book_ids[rows] = user_book_ids
+            ratings[rows] = user_ratings
+        # same narrow integer types as the ratings loaded from the datasets
+        user_ratings = compact_ratings(UserRatingsIndex.from_ratings(user_ids, book_ids, ratings))
+
+        # rows of the users having new ratings are replaced by their whole history
+        coo = self.matrix.tocoo()
+        keep = ~np.isin(coo.row, self.delta_rows)
+        histories = [self.delta[user_id] for user_id in (self.delta_rows + 1).tolist()]
+        rows = np.concatenate([coo.row[keep]] + [np.full(len(history[1]), row)
+                                                 for row, history in zip(self.delta_rows.tolist(), histories)])
+        columns = np.concatenate([coo.col[keep]] + [history[1] - 1 for history in histories])
+        data = np.concatenate([coo.data[keep]] + [history[2].astype(coo.data.dtype) for history in histories])
+        matrix = csr_matrix((data, (rows, columns)), shape=(self.n_rows, self.matrix.shape[1]))
+        return user_ratings, matrix, build_index(matrix)
+
+
+class RatingsView:
+    """
+    ratings grouped by user including the ingested ratings, same interface as UserRatingsIndex
+    """
+
+    def __init__(self, store: 'RatingsStore'):
+        self.store = store
+
+    def __contains__(self, user_id: int) -> bool:
+        state = self.store.state
+        return user_id in state.user_ratings or user_id in state.delta
+
+    def __len__(self) -> int:
+        state = self.store.state
+        return len(state.user_ratings) + state.n_new_users
+
+    @property
+    def user_ids(self) -> set:
+        state = self.store.state
+        return state.user_ratings.user_ids | set(state.delta)
+
+    @property
+    def users(self) -> np.ndarray:
+        return np.array(sorted(self.user_ids), dtype=np.int64)
+
+    def avg_rating(self) -> float:
+        """
+        get the average rating of all ratings of the last compaction
+        :return: float: average rating
+        """
+        return self.store.state.user_ratings.avg_rating()
+
+    def books(self, user_id: int) -> np.ndarray:
+        """
+        get the books rated by a user
+        :param user_id: int: id of user
+        :return: np.ndarray: book ids rated by the user
+        """
+        return self.store.state.history(user_id)[1]
+
+    def user_ratings(self, user_id: int) -> pd.DataFrame:
+        """
+        get the ratings of a user
+        :param user_id: int: id of user
+        :return: pd.DataFrame: ratings of the user (user_id, book_id, rating)
+        """
+        _, book_ids, ratings = self.store.state.history(user_id)
+        return pd.DataFrame({'user_id': np.full(len(book_ids), user_id), 'book_id': book_ids, 'rating': ratings})
+
+    def select(self, user_ids: list) -> tuple:
+        """
+        get the ratings of several users, in the order of the ratings dataset (ingested ratings last)
+        :param user_ids: list: ids of users
+        :return: tuple: (book ids, ratings)
+        """
+        state = self.store.state
+        if not any(user_id in state.delta for user_id in user_ids):
+            return state.user_ratings.select(user_ids)
+        histories = [state.history(user_id) for user_id in set(user_ids)]
+        rows, book_ids, ratings = (np.concatenate([history[i] for history in histories]) for i in range(3))
+        order = np.argsort(rows, kind='stable')
+        return book_ids[order], ratings[order]
+
+
+class NeighborsView:
+    """
+    nearest users index including the ingested ratings, same interface as CosineNeighborIndex
+    """
+
+    def __init__(self, store: 'RatingsStore'):
+        self.store = store
+
+    @property
+    def normalized(self) -> csr_matrix:
+        return self.store.state.neighbor_index.normalized
+
+    def query_vector(self, state: RatingsState, row_index: int) -> np.ndarray:
+        """
+        build the normalized query vector of a row, from the ingested ratings if the user has some
+        :param state: RatingsState: state of the ratings
+        :param row_index: int: index of the row (user id - 1)
+        :return: np.ndarray: l2 normalized dense row
+        """
+        if row_index + 1 not in state.delta:
+            return state.neighbor_index.query_vector(row_index)
+        _, book_ids, ratings = state.delta[row_index + 1]
+        vector = np.zeros((1, state.matrix.shape[1]))
+        vector[0, book_ids - 1] = ratings
+        return normalize(vector)[0]
+
+    def kneighbors(self, row_index: int, n_neighbors: int) -> np.ndarray:
+        """
+        get the indexes of the n nearest rows of a row (the row itself included)
+        :param row_index: int: index of the reference row (0 based)
+        :param n_neighbors: int: number of rows to return
+        :return: np.ndarray: indexes of the nearest rows sorted by distance
+        """
+        state = self.store.state
+        if not state.delta:
+            return state.neighbor_index.kneighbors(row_index, n_neighbors)
+        return state.neighbor_index.kneighbors_vector(self.query_vector(state, row_index), n_neighbors,
+                                                      state.delta_rows, state.delta_normalized)
+
+    def kneighbors_batch(self, row_indexes: list, n_neighbors: int, block_size: int = 64) -> list:
+        """
+        get the indexes of the n nearest rows of several rows
+        :param row_indexes: list: indexes of the reference rows (0 based)
+        :param n_neighbors: int: number of rows to return for each reference row
+        :param block_size: int: number of reference rows compared with the matrix at once (without delta)
+        :return: list: indexes of the nearest rows sorted by distance, for each reference row
+        """
+        state = self.store.state
+        if not state.delta:
+            return state.neighbor_index.kneighbors_batch(row_indexes, n_neighbors, block_size)
+        return [state.neighbor_index.kneighbors_vector(self.query_vector(state, row_index), n_neighbors,
+                                                       state.delta_rows, state.delta_normalized)
+                for row_index in row_indexes]
+
+
+class RatingsLog:
+    """
+    append-only log of the ingested ratings (csv lines user_id,book_id,rating, the csv datasets are not modified)
+    the file is shared by the worker processes: ratings are appended under an exclusive file lock and every worker
+    reads the ratings appended by the others, the whole log is replayed when the datasets are loaded
+    without path, the log is kept in memory (one process, lost on restart)
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: str: path of the log file (None: memory only)
+        """
+        self.path = path
+        # ratings of the memory only log
+        self.ratings = []
+        self.lock = threading.Lock()
+
+    def size(self) -> int:
+        """
+        get the end of the log (cheap: checked before every request)
+        :return: int: size of the file in bytes (number of ratings of the memory only log)
+        """
+        if self.path is None:
+            return len(self.ratings)
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def locked(self):
+        """
+        hold the log exclusively until the end of the block (every process reads the ratings in the same order)
+        """
+        if self.path is None:
+            with self.lock:
+                yield
+            return
+        with open(self.path, 'ab') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def read(self, start: int) -> tuple:
+        """
+        read the ratings appended since a position of the log
+        :param start: int: position returned by the previous read (0 for the whole log)
+        :return: tuple: (list of (user id, book id, rating) tuples, position of the end of the ratings read)
+        """
+        if self.path is None:
+            return self.ratings[start:], len(self.ratings)
+        if not os.path.exists(self.path):
+            return [], start
+        with open(self.path, 'rb') as file:
+            file.seek(start)
+            data = file.read()
+        # an incomplete last line is not read yet, lines cut by an interrupted write are skipped
+        end = data.rfind(b'\n') + 1
+        ratings = []
+        for line in data[:end].splitlines():
+            values = line.split(b',')
+            if len(values) == 3 and all(value.strip().isdigit() for value in values):
+                ratings.append(tuple(int(value) for value in values))
+        return ratings, start + end
+
+    def append(self, ratings: list):
+        """
+        append ratings at the end of the log, on disk when the call returns (called in locked)
+        :param ratings: list: (user id, book id, rating) tuples
+        """
+        if self.path is None:
+            self.ratings.extend(ratings)
+            return
+        lines = ''.join(f'{user_id},{book_id},{rating}\n' for user_id, book_id, rating in ratings)
+        with open(self.path, 'a+b') as file:
+            # a line cut by an interrupted write is ended first
+            end = file.seek(0, os.SEEK_END)
+            if end:
+                file.seek(end - 1)
+                if file.read(1) != b'\n':
+                    lines = '\n' + lines
+            file.write(lines.encode())
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class RatingsStore:
+    """
+    ratings of the datasets plus ingested ratings
+    writes build a new state and swap it, reads use the state current at the start of the call
+    """
+
+    def __init__(self, user_ratings: UserRatingsIndex, matrix: csr_matrix, neighbor_index, build_index,
+                 compaction_threshold: int = 10000, compaction_interval: float = 60, log: RatingsLog = None,
+                 book_lookup: BookLookup = None):
+        """
+        :param user_ratings: UserRatingsIndex: ratings of the datasets grouped by user
+        :param matrix: csr_matrix: matrix of ratings of users (one row per user)
+        :param neighbor_index: CosineNeighborIndex: nearest users index of the matrix
+        :param build_index: callable: builds the nearest users index of a matrix (used by compactions)
+        :param compaction_threshold: int: number of ingested ratings starting a compaction
+        :param compaction_interval: float: seconds between two periodic compactions (0 disables them)
+        :param log: RatingsLog: log of the ingested ratings, replayed now (None: ratings are not logged)
+        :param book_lookup: BookLookup: books of the datasets, ratings of other books are rejected (None: any book of
+        the matrix)
+        """
+        self.state = RatingsState(user_ratings, matrix, neighbor_index)
+        self.build_index = build_index
+        self.compaction_threshold = compaction_threshold
+        self.compaction_interval = compaction_interval
+        self.book_lookup = book_lookup
+        self.write_lock = threading.Lock()
+        self.compaction_lock = threading.Lock()
+        # ratings ingested since the last compaction, replayed on the compacted state
+        self.pending = []
+        # user id -> version of the ratings at the last ingestion of the user, for the users having new ratings since
+        # the start (their precomputed recommendations and their cached results are out of date)
+        self.updated_users = {}
+        self.compactions = 0
+        # set (under write_lock) when a compaction is scheduled until it starts: one compaction waits at most
+        self.compaction_scheduled = False
+        self.timer = None
+        self.closed = False
+        self.log = log
+        # position of the log read by this store
+        self.log_position = 0
+        self.sync()
+
+    @property
+    def version(self) -> int:
+        return self.state.version
+
+    def valid(self, ratings: list, strict: bool = True) -> list:
+        """
+        check the users and books of ratings (called with write_lock held)
+        a user id is a row of the matrix: known user ids or the next free ids (in order) are accepted, so that an
+        arbitrary id can not grow the matrix and the indexes
+        :param ratings: list: (user id, book id, rating) tuples
+        :param strict: bool: raise a ValueError on the first invalid rating (else invalid ratings are skipped)
+        :return: list: valid ratings
+        """
+        n_books = self.state.matrix.shape[1]
+        next_user_id = self.state.next_user_id
+        valid = []
+        for user_id, book_id, rating in ratings:
+            if not 1 <= user_id <= next_user_id or not 1 <= book_id <= n_books or (
+                    self.book_lookup is not None and book_id not in self.book_lookup):
+                if strict:
+                    raise ValueError(f'invalid rating: user {user_id}, book {book_id} (new users get the next free '
+                                     f'user id {next_user_id})')
+                continue
+            if user_id == next_user_id:
+                next_user_id += 1
+            valid.append((user_id, book_id, rating))
+        return valid
+
+    def apply(self, ratings: list):
+        """
+        apply valid ratings to the state (called with write_lock held)
+        :param ratings: list: (user id, book id, rating) tuples
+        """
+        if not ratings:
+            return
+        self.state = self.state.apply(ratings)
+        self.pending.extend(ratings)
+        self.updated_users.update((user_id, self.state.version) for user_id, _, _ in ratings)
+        if not self.closed:
+            self.schedule_compaction(self.state.n_delta_ratings >= self.compaction_threshold)
+
+    def read_log(self):
+        """
+        apply the ratings appended to the log since the last read (called with write_lock and the log held)
+        ratings no longer valid (datasets changed since they were logged) are skipped
+        """
+        ratings, self.log_position = self.log.read(self.log_position)
+        self.apply(self.valid(ratings, strict=False))
+
+    def sync(self):
+        """
+        apply the ratings appended to the log by other processes (nothing is locked if the log did not change)
+        """
+        if self.log is None or self.log.size() == self.log_position:
+            return
+        with self.write_lock, self.log.locked():
+            self.read_log()
+
+    def ingest(self, ratings: list, strict: bool = True) -> dict:
+        """
+        add ratings, queryable as soon as the call returns (and written to the log)
+        :param ratings: list: (user id, book id, rating) tuples
+        :param strict: bool: raise a ValueError if a rating is invalid (else invalid ratings are skipped)
+        :return: dict: number of ingested ratings, ratings waiting for a compaction and version of the ratings
+        """
+        with self.write_lock:
+            if self.log is None:
+                ratings = self.valid(ratings, strict)
+            else:
+                with self.log.locked():
+                    # ratings of the other processes first: new user ids are given in the same order everywhere
+                    self.read_log()
+                    ratings = self.valid(ratings, strict)
+                    if ratings:
+                        self.log.append(ratings)
+                        self.log_position = self.log.size()
+            self.apply(ratings)
+            state = self.state
+        return {'ingested': len(ratings), 'pending': state.n_delta_ratings, 'version': state.version}
+
+    def schedule_compaction(self, now: bool):
+        """
+        compact the ingested ratings after compaction_interval seconds, or now (called with write_lock held)
+        a compaction already scheduled is not scheduled again, a timer is replaced by an immediate compaction
+        :param now: bool: compact now (threshold reached)
+        """
+        if now and self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+            self.compaction_scheduled = False
+        if self.compaction_scheduled:
+            return
+        if now:
+            threading.Thread(target=self.compact, daemon=True).start()
+        elif self.compaction_interval > 0:
+            self.timer = threading.Timer(self.compaction_interval, self.compact)
+            self.timer.daemon = True
+            self.timer.start()
+        else:
+            return
+        self.compaction_scheduled = True
+
+    def compact(self):
+        """
+        merge the ingested ratings into new datasets, built without blocking reads and writes
+        ratings ingested during the build are replayed on the new state
+        """
+        with self.compaction_lock:
+            with self.write_lock:
+                # the ratings ingested from now on schedule the next compaction
+                self.compaction_scheduled = False
+                self.timer = None
+                state = self.state
+                n_compacted = len(self.pending)
+            if not n_compacted:
+                return
+            user_ratings, matrix, neighbor_index = state.compacted(self.build_index)
+            with self.write_lock:
+                remaining = self.pending[n_compacted:]
+                # same ratings as the current state: the version is kept
+                compacted = RatingsState(user_ratings, matrix, neighbor_index, self.state.version)
+                self.state = compacted.apply(remaining, self.state.version) if remaining else compacted
+                self.pending = remaining
+                self.compactions += 1
+
+    def close(self):
+        """
+        cancel the periodic compaction (the store is replaced, reads are still served)
+        """
+        with self.write_lock:
+            self.closed = True
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def stats(self) -> dict:
+        """
+        get the counters of the ingestion
+        :return: dict: users, id of the next new user, ratings waiting for a compaction, version and number of
+        compactions
+        """
+        state = self.state
+        return {'users': len(state.user_ratings) + state.n_new_users, 'next_user_id': state.next_user_id,
+                'pending': state.n_delta_ratings, 'delta_users': len(state.delta), 'version': state.version,
+                'compactions': self.compactions}
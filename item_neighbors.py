@@ -0,0 +1,136 @@
+"""
+item-item engine: the k most similar books of each book (cosine similarity of the columns of the ratings matrix)
+computed offline by blocks of books in parallel, the recommendations of a user aggregate the similar books of the
+books rated by the user (no search among users at query time)
+usage (from the main folder): python item_neighbors.py [--output data/item_neighbors.npz] [--k 50] [--n-jobs -1]
+"""
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+from joblib import Parallel, delayed
+import numpy as np
+import argparse
+import time
+import os
+
+
+def top_k_block(items: csr_matrix, start: int, end: int, k: int) -> tuple:
+    """
+    get the k most similar books of a block of books
+    :param items: csr_matrix: l2 normalized ratings of each book (one row per book)
+    :param start: int: first book of the block (0 based)
+    :param end: int: end of the block (excluded)
+    :param k: int: number of similar books
+    :return: tuple: (indexes of the similar books padded with -1, similarities) sorted by decreasing similarity
+    """
+    similarities = (items[start:end] @ items.T).toarray()
+    # a book is not similar to itself
+    similarities[np.arange(end - start), np.arange(start, end)] = -1
+    neighbors = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(similarities, neighbors, axis=1)
+    # decreasing similarity, equal similarities ordered by book
+    order = np.lexsort((neighbors, -values))
+    neighbors = np.take_along_axis(neighbors, order, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    # books never rated by the same users are not similar
+    neighbors[values <= 0] = -1
+    values[values <= 0] = 0
+    return neighbors.astype(np.int32), values.astype(np.float16)
+
+
+class ItemNeighbors:
+    """
+    k most similar books of each book stored in fixed size arrays (int32 book indexes padded with -1, float16
+    similarities)
+    """
+
+    def __init__(self, neighbors: np.ndarray, similarities: np.ndarray, data_version: str = None):
+        """
+        :param neighbors: np.ndarray: indexes (book id - 1) of the similar books of each book
+        :param similarities: np.ndarray: similarity of each similar book
+        :param data_version: str: version of the datasets
+        """
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self.data_version = data_version
+
+    @classmethod
+    def build(cls, matrix: csr_matrix, k: int = 50, block_size: int = 512, n_jobs: int = -1,
+              data_version: str = None) -> 'ItemNeighbors':
+        """
+        compute the k most similar books of each book by blocks of books, blocks are computed in parallel
+        :param matrix: csr_matrix: matrix of ratings of users (one row per user, one column per book)
+        :param k: int: number of similar books per book
+        :param block_size: int: number of books compared with every book at once
+        :param n_jobs: int: number of processes (-1: one per core)
+        :param data_version: str: version of the datasets
+        :return: ItemNeighbors: similar books of each book
+        """
+        items = normalize(csr_matrix(matrix.T, dtype=np.float32))
+        n_books = items.shape[0]
+        k = min(k, n_books - 1)
+        blocks = Parallel(n_jobs=n_jobs)(delayed(top_k_block)(items, start, min(start + block_size, n_books), k)
+                                         for start in range(0, n_books, block_size))
+        return cls(np.concatenate([neighbors for neighbors, _ in blocks]),
+                   np.concatenate([similarities for _, similarities in blocks]), data_version)
+
+    def save(self, path: str):
+        """
+        save the similar books
+        :param path: str: path of the npz file
+        """
+        np.savez(path, data_version=self.data_version, neighbors=self.neighbors, similarities=self.similarities)
+
+    def recommend(self, book_ids: np.ndarray, ratings: np.ndarray, n_books: int) -> np.ndarray:
+        """
+        get the best books among the similar books of rated books, weighted by similarity x rating
+        :param book_ids: np.ndarray: rated book ids
+        :param ratings: np.ndarray: ratings of the books
+        :param n_books: int: number of books to return
+        :return: np.ndarray: book ids (read books excluded) sorted by decreasing score
+        """
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        inside = (book_ids >= 1) & (book_ids <= len(self.neighbors))
+        rated = book_ids[inside] - 1
+        neighbors = self.neighbors[rated]
+        weights = self.similarities[rated].astype(np.float64) * np.asarray(ratings, dtype=np.float64)[inside, None]
+        similar = neighbors >= 0
+        scores = np.bincount(neighbors[similar], weights=weights[similar], minlength=len(self.neighbors))
+        # read books are not recommended
+        scores[rated] = 0
+        candidates = np.flatnonzero(scores > 0)
+        # decreasing score, equal scores ordered by book
+        return candidates[np.lexsort((candidates, -scores[candidates]))[:n_books]] + 1
+
+
+def load_item_neighbors(path: str, data_version: str) -> ItemNeighbors:
+    """
+    load the similar books if they exist and match the version of the datasets
+    :param path: str: path of the npz file
+    :param data_version: str: version of the datasets
+    :return: ItemNeighbors: similar books (None if missing or out of date)
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as loader:
+        if str(loader['data_version']) != data_version:
+            return None
+        return ItemNeighbors(loader['neighbors'], loader['similarities'], data_version)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compute the most similar books of each book')
+    parser.add_argument('--output', default=None, help='path of the similar books (default: ITEM_NEIGHBORS_PATH)')
+    parser.add_argument('--k', type=int, default=50, help='number of similar books per book')
+    parser.add_argument('--block-size', type=int, default=512, help='number of books compared at once')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='number of processes (-1: one per core)')
+    args = parser.parse_args()
+
+    from config import DATA_DIR, DATASET_FORMAT, SHARED_DATA_DIR, ITEM_NEIGHBORS_PATH
+    from dataset import load_datasets, dataset_version
+
+    book_matrix = load_datasets(DATA_DIR, DATASET_FORMAT, SHARED_DATA_DIR)[0]
+    start = time.perf_counter()
+    item_neighbors = ItemNeighbors.build(book_matrix, args.k, args.block_size, args.n_jobs, dataset_version(DATA_DIR))
+    item_neighbors.save(args.output or ITEM_NEIGHBORS_PATH)
+    print(f'{len(item_neighbors.neighbors)} books, {args.k} similar books each, '
+          f'{time.perf_counter() - start:.1f}s')
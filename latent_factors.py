@@ -0,0 +1,141 @@
+"""
+latent factor engine: truncated svd of the ratings matrix, float32 factors of users and books
+the score of a book for a user is the dot product of their factors: one matrix-vector product per user (one
+matrix product per block of users), the best unread books are selected with argpartition
+usage (from the main folder): python latent_factors.py [--output data/latent_factors.npz] [--components 64]
+"""
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import TruncatedSVD
+import numpy as np
+import argparse
+import time
+import os
+
+
+def top_n_unread(scores: np.ndarray, read_books: np.ndarray, n_books: int) -> np.ndarray:
+    """
+    get the books with the best scores, read books excluded
+    :param scores: np.ndarray: score of each book (index: book id - 1), modified in place
+    :param read_books: np.ndarray: read book ids
+    :param n_books: int: number of books to return
+    :return: np.ndarray: book ids sorted by decreasing score (equal scores ordered by book)
+    """
+    read_books = np.asarray(read_books, dtype=np.int64)
+    scores[read_books[(read_books >= 1) & (read_books <= len(scores))] - 1] = -np.inf
+    n_books = min(n_books, len(scores))
+    best = np.argpartition(-scores, n_books - 1)[:n_books]
+    best = best[np.lexsort((best, -scores[best]))]
+    return best[np.isfinite(scores[best])] + 1
+
+
+class LatentFactors:
+    """
+    factors of users and books (float32), user factors are the projection of the ratings of the user on the book
+    factors, so users with new ratings are projected at query time
+    """
+
+    def __init__(self, user_factors: np.ndarray, item_factors: np.ndarray, data_version: str = None):
+        """
+        :param user_factors: np.ndarray: factors of each user (row: user id - 1)
+        :param item_factors: np.ndarray: factors of each book (row: book id - 1)
+        :param data_version: str: version of the datasets
+        """
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.data_version = data_version
+
+    @classmethod
+    def build(cls, matrix: csr_matrix, n_components: int = 64, n_iter: int = 5, seed: int = 0,
+              data_version: str = None) -> 'LatentFactors':
+        """
+        factorize the ratings matrix with a randomized truncated svd
+        :param matrix: csr_matrix: matrix of ratings of users (one row per user, one column per book)
+        :param n_components: int: number of factors
+        :param n_iter: int: number of iterations of the randomized svd
+        :param seed: int: seed of the randomized svd
+        :param data_version: str: version of the datasets
+        :return: LatentFactors: factors of users and books
+        """
+        svd = TruncatedSVD(n_components=n_components, n_iter=n_iter, random_state=seed)
+        user_factors = svd.fit_transform(csr_matrix(matrix, dtype=np.float32))
+        return cls(user_factors.astype(np.float32), svd.components_.T.astype(np.float32).copy(), data_version)
+
+    def save(self, path: str):
+        """
+        save the factors
+        :param path: str: path of the npz file
+        """
+        np.savez(path, data_version=self.data_version, user_factors=self.user_factors,
+                 item_factors=self.item_factors)
+
+    def project(self, book_ids: np.ndarray, ratings: np.ndarray) -> np.ndarray:
+        """
+        get the factors of any ratings (new users or users with new ratings)
+        :param book_ids: np.ndarray: rated book ids
+        :param ratings: np.ndarray: ratings of the books
+        :return: np.ndarray: factors of the ratings
+        """
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        inside = (book_ids >= 1) & (book_ids <= len(self.item_factors))
+        return np.asarray(ratings, dtype=np.float32)[inside] @ self.item_factors[book_ids[inside] - 1]
+
+    def recommend(self, user_factors: np.ndarray, read_books: np.ndarray, n_books: int) -> np.ndarray:
+        """
+        get the books with the best scores for a user
+        :param user_factors: np.ndarray: factors of the user
+        :param read_books: np.ndarray: read book ids (not recommended)
+        :param n_books: int: number of books to return
+        :return: np.ndarray: book ids sorted by decreasing score
+        """
+        return top_n_unread(self.item_factors @ user_factors, read_books, n_books)
+
+    def recommend_batch(self, user_factors: np.ndarray, read_books: list, n_books: int,
+                        block_size: int = 256) -> list:
+        """
+        get the books with the best scores for several users, by blocks of users (one matrix product per block)
+        :param user_factors: np.ndarray: factors of the users (one row per user)
+        :param read_books: list: read book ids of each user
+        :param n_books: int: number of books to return for each user
+        :param block_size: int: number of users scored at once
+        :return: list: book ids sorted by decreasing score, for each user
+        """
+        recommendations = []
+        for start in range(0, len(user_factors), block_size):
+            scores = user_factors[start:start + block_size] @ self.item_factors.T
+            recommendations.extend(top_n_unread(user_scores, user_read_books, n_books) for user_scores, user_read_books
+                                   in zip(scores, read_books[start:start + block_size]))
+        return recommendations
+
+
+def load_latent_factors(path: str, data_version: str) -> LatentFactors:
+    """
+    load the factors if they exist and match the version of the datasets
+    :param path: str: path of the npz file
+    :param data_version: str: version of the datasets
+    :return: LatentFactors: factors of users and books (None if missing or out of date)
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as loader:
+        if str(loader['data_version']) != data_version:
+            return None
+        return LatentFactors(loader['user_factors'], loader['item_factors'], data_version)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='factorize the ratings matrix')
+    parser.add_argument('--output', default=None, help='path of the factors (default: LATENT_FACTORS_PATH)')
+    parser.add_argument('--components', type=int, default=64, help='number of factors')
+    parser.add_argument('--n-iter', type=int, default=5, help='number of iterations of the randomized svd')
+    args = parser.parse_args()
+
+    from config import DATA_DIR, DATASET_FORMAT, SHARED_DATA_DIR, LATENT_FACTORS_PATH
+    from dataset import load_datasets, dataset_version
+
+    book_matrix = load_datasets(DATA_DIR, DATASET_FORMAT, SHARED_DATA_DIR)[0]
+    start = time.perf_counter()
+    latent_factors = LatentFactors.build(book_matrix, args.components, args.n_iter,
+                                         data_version=dataset_version(DATA_DIR))
+    latent_factors.save(args.output or LATENT_FACTORS_PATH)
+    print(f'{len(latent_factors.user_factors)} users, {len(latent_factors.item_factors)} books, '
+          f'{args.components} factors, {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,154 @@
+"""
+metrics of the recommendation system in the prometheus format (exposed by the api on /metrics)
+- latency histogram and number of calls of each stage of the html page
+- sizes of the data processed by the last request (read books, ratings of the nearest users, candidate books)
+- admission of the requests (admitted, queued, shed) and sections degraded by the latency budget
+a request can also be profiled: the duration of its stages is returned in a Server-Timing header
+"""
+from prometheus_client import Histogram, Gauge, Counter, generate_latest, CONTENT_TYPE_LATEST
+from contextvars import ContextVar
+from config import METRICS_ENABLED
+import time
+
+# latency of each stage of the html page (the count of the histogram is the number of calls)
+STAGE_SECONDS = Histogram('recommendation_stage_seconds', 'latency of a stage of the recommendation page', ['stage'],
+                          buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                   1.0, 2.5))
+# pages computed or served from the pages cache
+PAGES = Counter('recommendation_pages_total', 'recommendation pages', ['source'])
+# sizes of the data processed by the last request
+DATA_SIZE = Gauge('recommendation_data_size', 'size of the data processed by the last request', ['quantity'])
+# sections computed with precomputed results because the latency budget of the request was exhausted
+DEGRADED_SECTIONS = Counter('recommendation_degraded_sections_total', 'sections served from precomputed results',
+                            ['section'])
+# requests admitted at once, admitted after waiting in the queue or shed
+ADMISSIONS = Counter('recommendation_admissions_total', 'admission of the recommendation requests', ['outcome'])
+# requests computed at the moment
+IN_FLIGHT = Gauge('recommendation_requests_in_flight', 'recommendation requests computed at the moment')
+
+# stage -> seconds of the current request (None if the request is not profiled)
+profile = ContextVar('profile', default=None)
+# stage -> histogram of the stage (labels are resolved once)
+stage_histograms = {}
+
+
+class Stage:
+    """
+    context manager measuring a stage: observed in the histogram and added to the profile of the request
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        if METRICS_ENABLED:
+            histogram = stage_histograms.get(self.name)
+            if histogram is None:
+                histogram = stage_histograms[self.name] = STAGE_SECONDS.labels(self.name)
+            histogram.observe(seconds)
+        stages = profile.get()
+        if stages is not None:
+            stages[self.name] = stages.get(self.name, 0) + seconds
+
+
+class NoStage:
+    """
+    context manager doing nothing (metrics disabled and request not profiled)
+    """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_STAGE = NoStage()
+
+
+def stage(name: str):
+    """
+    measure a stage of the html page
+    :param name: str: name of the stage
+    :return: context manager
+    """
+    if METRICS_ENABLED or profile.get() is not None:
+        return Stage(name)
+    return NO_STAGE
+
+
+def data_size(quantity: str, value: int):
+    """
+    set the size of data processed by the current request
+    :param quantity: str: name of the quantity
+    :param value: int: size
+    """
+    if METRICS_ENABLED:
+        DATA_SIZE.labels(quantity).set(value)
+
+
+def count_page(source: str):
+    """
+    count a page
+    :param source: str: 'computed', 'cache' or 'degraded' (computed pages with sections from precomputed results)
+    """
+    if METRICS_ENABLED:
+        PAGES.labels(source).inc()
+
+
+def count_degraded(section: str):
+    """
+    count a section served from precomputed results
+    :param section: str: name of the section
+    """
+    if METRICS_ENABLED:
+        DEGRADED_SECTIONS.labels(section).inc()
+
+
+def count_admission(outcome: str):
+    """
+    count the admission of a request
+    :param outcome: str: 'admitted', 'queued' or 'shed'
+    """
+    if METRICS_ENABLED:
+        ADMISSIONS.labels(outcome).inc()
+
+
+def in_flight(value: int):
+    """
+    set the number of requests computed at the moment
+    :param value: int: number of requests
+    """
+    if METRICS_ENABLED:
+        IN_FLIGHT.set(value)
+
+
+def start_profile() -> dict:
+    """
+    profile the stages of the current request
+    :return: dict: stage -> seconds, filled while the request is computed
+    """
+    stages = {}
+    profile.set(stages)
+    return stages
+
+
+def server_timing(stages: dict) -> str:
+    """
+    format the stages of a request as a Server-Timing header
+    :param stages: dict: stage -> seconds
+    :return: str: value of the header (durations in milliseconds)
+    """
+    return ', '.join(f'{name};dur={seconds * 1000:.3f}' for name, seconds in stages.items())
+
+
+def export() -> tuple:
+    """
+    export the metrics
+    :return: tuple: (metrics in the prometheus text format, content type)
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
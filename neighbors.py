@@ -0,0 +1,378 @@
+from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+
+
+class CosineNeighborIndex:
+    """
+    exact cosine nearest neighbors index over the rows of a csr_matrix
+    rows are l2 normalized once when the index is built, so a query is a single sparse matrix-vector product
+    results (including tie order) are the same as NearestNeighbors(metric='cosine', algorithm='brute')
+    """
+
+    def __init__(self, matrix: csr_matrix, normalized: csr_matrix = None):
+        """
+        :param matrix: csr_matrix: matrix of ratings of users (one row per user)
+        :param normalized: csr_matrix: rows of matrix already l2 normalized (float64), computed if None
+        """
+        self.matrix = matrix
+        # l2 normalized copy of the matrix, cosine similarity becomes a dot product
+        if normalized is None:
+            normalized = normalize(csr_matrix(matrix, dtype=np.float64))
+        self.normalized = normalized
+
+    def query_vector(self, row_index: int) -> np.ndarray:
+        """
+        get the normalized dense vector of one row of the matrix
+        :param row_index: int: index of the row (0 based)
+        :return: np.ndarray: normalized vector of the row
+        """
+        # only the queried row is densified, not the whole matrix
+        return normalize(self.matrix[row_index].toarray().astype(np.float64))[0]
+
+    def distances(self, vector: np.ndarray) -> np.ndarray:
+        """
+        get cosine distances between a normalized vector and every row of the matrix
+        :param vector: np.ndarray: normalized query vector
+        :return: np.ndarray: cosine distance to each row
+        """
+        distances = self.normalized @ vector
+        distances *= -1
+        distances += 1
+        np.clip(distances, 0, 2, out=distances)
+        return distances
+
+    def kneighbors(self, row_index: int, n_neighbors: int) -> np.ndarray:
+        """
+        get the indexes of the n nearest rows of a row (the row itself included)
+        :param row_index: int: index of the reference row (0 based)
+        :param n_neighbors: int: number of rows to return
+        :return: np.ndarray: indexes of the nearest rows sorted by distance
+        """
+        return self.kneighbors_vector(self.query_vector(row_index), n_neighbors)
+
+    def kneighbors_vector(self, vector: np.ndarray, n_neighbors: int, extra_rows: np.ndarray = None,
+                          extra_normalized: csr_matrix = None) -> np.ndarray:
+        """
+        get the indexes of the n nearest rows of a query vector
+        extra rows replace the rows of the matrix with the same index, or are added after the last row
+        :param vector: np.ndarray: normalized query vector
+        :param n_neighbors: int: number of rows to return
+        :param extra_rows: np.ndarray: indexes of the extra rows (0 based)
+        :param extra_normalized: csr_matrix: l2 normalized values of the extra rows
+        :return: np.ndarray: indexes of the nearest rows sorted by distance
+        """
+        distances = self.distances(vector)
+        if extra_rows is not None and len(extra_rows):
+            # rows between the last row of the matrix and the extra rows have no rating (distance 1)
+            n_rows = max(len(distances), int(extra_rows.max()) + 1)
+            distances = np.concatenate([distances, np.ones(n_rows - len(distances))])
+            distances[extra_rows] = np.clip(1 - extra_normalized @ vector, 0, 2)
+        # same selection as scikit-learn brute force search: partition then sort the k first
+        nearest = np.argpartition(distances, n_neighbors - 1)[:n_neighbors]
+        return nearest[np.argsort(distances[nearest])]
+
+    def kneighbors_batch(self, row_indexes: list, n_neighbors: int, block_size: int = 64) -> list:
+        """
+        get the indexes of the n nearest rows of several rows, by blocks of rows (one matrix product per block)
+        results are the same as kneighbors for each row
+        :param row_indexes: list: indexes of the reference rows (0 based)
+        :param n_neighbors: int: number of rows to return for each reference row
+        :param block_size: int: number of reference rows compared with the matrix at once
+        :return: list: indexes of the nearest rows sorted by distance, for each reference row
+        """
+        neighbors = []
+        for start in range(0, len(row_indexes), block_size):
+            block = np.asarray(row_indexes[start:start + block_size])
+            vectors = normalize(self.matrix[block].toarray().astype(np.float64))
+            # cosine distances between every row of the matrix and the reference rows of the block
+            distances = self.normalized @ vectors.T
+            distances *= -1
+            distances += 1
+            np.clip(distances, 0, 2, out=distances)
+            for column in range(len(block)):
+                row_distances = distances[:, column]
+                nearest = np.argpartition(row_distances, n_neighbors - 1)[:n_neighbors]
+                neighbors.append(nearest[np.argsort(row_distances[nearest])])
+        return neighbors
+
+
+class LSHNeighborIndex(CosineNeighborIndex):
+    """
+    approximate cosine nearest neighbors index using random projection (sign of random hyperplanes) hashing
+    users falling in the same bucket as the query in at least one table are re-ranked with the exact cosine distance
+    more tables or fewer bits per table give a better recall but a slower query
+    """
+
+    def __init__(self, matrix: csr_matrix, n_tables: int = 8, n_bits: int = 12, seed: int = 0,
+                 block_size: int = 65536, normalized: csr_matrix = None):
+        """
+        :param matrix: csr_matrix: matrix of ratings of users (one row per user)
+        :param n_tables: int: number of hash tables
+        :param n_bits: int: number of hyperplanes (bits of the hash) per table
+        :param seed: int: seed of the random hyperplanes
+        :param block_size: int: number of rows hashed at once while building the tables
+        :param normalized: csr_matrix: rows of matrix already l2 normalized (float64), computed if None
+        """
+        super().__init__(matrix, normalized)
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        rng = np.random.RandomState(seed)
+        self.planes = rng.standard_normal((matrix.shape[1], n_tables * n_bits)).astype(np.float32)
+        # hash rows by blocks to keep the dense projections small
+        codes = np.empty((matrix.shape[0], n_tables), dtype=np.int64)
+        for start in range(0, matrix.shape[0], block_size):
+            end = start + block_size
+            codes[start:end] = self._hash(np.asarray(self.normalized[start:end] @ self.planes))
+        # for each table, rows sorted by bucket so a bucket is a contiguous slice
+        self.order = np.argsort(codes, axis=0, kind='stable')
+        self.sorted_codes = np.take_along_axis(codes, self.order, axis=0)
+
+    def _hash(self, projections: np.ndarray) -> np.ndarray:
+        """
+        convert projections on the hyperplanes to one bucket code per table
+        :param projections: np.ndarray: projections of the rows (n_rows x n_tables * n_bits)
+        :return: np.ndarray: bucket codes (n_rows x n_tables)
+        """
+        bits = (projections > 0).reshape(len(projections), self.n_tables, self.n_bits)
+        return bits @ (1 << np.arange(self.n_bits, dtype=np.int64))
+
+    def candidates(self, vector: np.ndarray) -> np.ndarray:
+        """
+        get the rows sharing a bucket with the query vector in at least one table
+        :param vector: np.ndarray: normalized query vector
+        :return: np.ndarray: sorted indexes of candidate rows
+        """
+        codes = self._hash((vector @ self.planes)[np.newaxis])[0]
+        buckets = []
+        for table, code in enumerate(codes):
+            start, end = np.searchsorted(self.sorted_codes[:, table], [code, code + 1])
+            buckets.append(self.order[start:end, table])
+        return np.unique(np.concatenate(buckets))
+
+    def kneighbors(self, row_index: int, n_neighbors: int) -> np.ndarray:
+        """
+        get the indexes of the n (approximately) nearest rows of a row (the row itself included)
+        :param row_index: int: index of the reference row (0 based)
+        :param n_neighbors: int: number of rows to return
+        :return: np.ndarray: indexes of the nearest rows sorted by distance
+        """
+        return self.kneighbors_vector(self.query_vector(row_index), n_neighbors)
+
+    def kneighbors_vector(self, vector: np.ndarray, n_neighbors: int, extra_rows: np.ndarray = None,
+                          extra_normalized: csr_matrix = None) -> np.ndarray:
+        """
+        get the indexes of the n (approximately) nearest rows of a query vector
+        extra rows are not hashed: they are always candidates
+        :param vector: np.ndarray: normalized query vector
+        :param n_neighbors: int: number of rows to return
+        :param extra_rows: np.ndarray: indexes of the extra rows (0 based), replacing the rows with the same index
+        :param extra_normalized: csr_matrix: l2 normalized values of the extra rows
+        :return: np.ndarray: indexes of the nearest rows sorted by distance
+        """
+        candidates = self.candidates(vector)
+        if extra_rows is not None and len(extra_rows):
+            candidates = candidates[~np.isin(candidates, extra_rows)]
+        if len(candidates) + (len(extra_rows) if extra_rows is not None else 0) < n_neighbors:
+            # not enough users in the buckets, fall back to the exact search
+            return super().kneighbors_vector(vector, n_neighbors, extra_rows, extra_normalized)
+        distances = 1 - self.normalized[candidates] @ vector
+        if extra_rows is not None and len(extra_rows):
+            candidates = np.concatenate([candidates, extra_rows])
+            distances = np.concatenate([distances, 1 - extra_normalized @ vector])
+            order = np.argsort(candidates, kind='stable')
+            candidates, distances = candidates[order], distances[order]
+        np.clip(distances, 0, 2, out=distances)
+        # stable sort: equal distances are ordered by row index
+        return candidates[np.argsort(distances, kind='stable')[:n_neighbors]]
+
+    def kneighbors_batch(self, row_indexes: list, n_neighbors: int, block_size: int = 64) -> list:
+        """
+        get the indexes of the n (approximately) nearest rows of several rows
+        :param row_indexes: list: indexes of the reference rows (0 based)
+        :param n_neighbors: int: number of rows to return for each reference row
+        :param block_size: int: not used (candidates are different for each row)
+        :return: list: indexes of the nearest rows sorted by distance, for each reference row
+        """
+        return [self.kneighbors(row_index, n_neighbors) for row_index in row_indexes]
+
+
+def top_k_candidates(distances: np.ndarray, n_neighbors: int) -> np.ndarray:
+    """
+    get the rows that can be among the n nearest rows when equal distances are ordered by row
+    :param distances: np.ndarray: distance of each row
+    :param n_neighbors: int: number of nearest rows
+    :return: np.ndarray: indexes of the n nearest rows and of the rows at the same distance as the n-th
+    """
+    if len(distances) <= n_neighbors:
+        return np.flatnonzero(np.isfinite(distances))
+    kth = np.partition(distances, n_neighbors - 1)[n_neighbors - 1]
+    return np.flatnonzero((distances <= kth) & np.isfinite(distances))
+
+
+class ShardedNeighborIndex(CosineNeighborIndex):
+    """
+    exact cosine nearest neighbors index split in shards of contiguous rows searched in parallel by threads
+    (the sparse products and the selections release the gil), each shard returns its local top k and the local
+    results are merged into the global top k
+    equal distances are ordered by row, so results do not depend on the number of shards
+    """
+
+    def __init__(self, matrix: csr_matrix, n_shards: int = None, normalized: csr_matrix = None):
+        """
+        :param matrix: csr_matrix: matrix of ratings of users (one row per user)
+        :param n_shards: int: number of shards searched in parallel (None: one per core)
+        :param normalized: csr_matrix: rows of matrix already l2 normalized (float64), computed if None
+        """
+        super().__init__(matrix, normalized)
+        self.n_shards = max(1, min(n_shards or os.cpu_count(), matrix.shape[0]))
+        bounds = np.linspace(0, matrix.shape[0], self.n_shards + 1).astype(np.int64)
+        # shards share the data and the indices of the normalized matrix (only indptr is copied)
+        self.shards = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            indptr = self.normalized.indptr[start:end + 1]
+            self.shards.append((start, csr_matrix((self.normalized.data[indptr[0]:indptr[-1]],
+                                                   self.normalized.indices[indptr[0]:indptr[-1]], indptr - indptr[0]),
+                                                  shape=(end - start, matrix.shape[1]))))
+        self.executor = ThreadPoolExecutor(self.n_shards, thread_name_prefix='neighbors')
+
+    def search_shard(self, shard: tuple, vectors: np.ndarray, n_neighbors: int, extra_rows: np.ndarray) -> list:
+        """
+        get the local top k of a shard for several query vectors
+        :param shard: tuple: (first row, normalized rows of the shard)
+        :param vectors: np.ndarray: normalized query vectors (one column per query)
+        :param n_neighbors: int: number of rows to return
+        :param extra_rows: np.ndarray: indexes of the rows replaced by extra rows (excluded from the shard)
+        :return: list: (indexes, distances) of the candidate rows of the shard, for each query
+        """
+        start, rows = shard
+        distances = rows @ vectors
+        distances *= -1
+        distances += 1
+        np.clip(distances, 0, 2, out=distances)
+        if extra_rows is not None and len(extra_rows):
+            replaced = extra_rows[(extra_rows >= start) & (extra_rows < start + rows.shape[0])] - start
+            distances[replaced] = np.inf
+        results = []
+        for column in range(distances.shape[1]):
+            candidates = top_k_candidates(distances[:, column], n_neighbors)
+            results.append((candidates + start, distances[candidates, column]))
+        return results
+
+    def search(self, vectors: np.ndarray, n_neighbors: int, extra_rows: np.ndarray = None,
+               extra_normalized: csr_matrix = None) -> list:
+        """
+        search every shard in parallel and merge the local results
+        :param vectors: np.ndarray: normalized query vectors (one column per query)
+        :param n_neighbors: int: number of rows to return for each query
+        :param extra_rows: np.ndarray: indexes of the extra rows (0 based)
+        :param extra_normalized: csr_matrix: l2 normalized values of the extra rows
+        :return: list: indexes of the nearest rows sorted by distance (equal distances by row), for each query
+        """
+        shard_results = list(self.executor.map(
+            lambda shard: self.search_shard(shard, vectors, n_neighbors, extra_rows), self.shards))
+        if extra_rows is not None and len(extra_rows):
+            extra_distances = np.clip(1 - extra_normalized @ vectors, 0, 2)
+            # rows between the last row of the matrix and the extra rows have no rating (distance 1), the first ones
+            # are enough since equal distances are ordered by row
+            empty_rows = np.setdiff1d(np.arange(self.matrix.shape[0], int(extra_rows.max()) + 1), extra_rows)
+            empty_rows = empty_rows[:n_neighbors]
+        neighbors = []
+        for column in range(vectors.shape[1]):
+            candidates = [shard[column][0] for shard in shard_results]
+            distances = [shard[column][1] for shard in shard_results]
+            if extra_rows is not None and len(extra_rows):
+                candidates += [extra_rows, empty_rows]
+                distances += [extra_distances[:, column], np.ones(len(empty_rows))]
+            candidates, distances = np.concatenate(candidates), np.concatenate(distances)
+            neighbors.append(candidates[np.lexsort((candidates, distances))[:n_neighbors]])
+        return neighbors
+
+    def kneighbors_vector(self, vector: np.ndarray, n_neighbors: int, extra_rows: np.ndarray = None,
+                          extra_normalized: csr_matrix = None) -> np.ndarray:
+        """
+        get the indexes of the n nearest rows of a query vector
+        extra rows replace the rows of the matrix with the same index, or are added after the last row
+        :param vector: np.ndarray: normalized query vector
+        :param n_neighbors: int: number of rows to return
+        :param extra_rows: np.ndarray: indexes of the extra rows (0 based)
+        :param extra_normalized: csr_matrix: l2 normalized values of the extra rows
+        :return: np.ndarray: indexes of the nearest rows sorted by distance
+        """
+        return self.search(vector[:, np.newaxis], n_neighbors, extra_rows, extra_normalized)[0]
+
+    def kneighbors_batch(self, row_indexes: list, n_neighbors: int, block_size: int = 64) -> list:
+        """
+        get the indexes of the n nearest rows of several rows, by blocks of rows (one matrix product per block and
+        per shard)
+        :param row_indexes: list: indexes of the reference rows (0 based)
+        :param n_neighbors: int: number of rows to return for each reference row
+        :param block_size: int: number of reference rows compared with the matrix at once
+        :return: list: indexes of the nearest rows sorted by distance, for each reference row
+        """
+        neighbors = []
+        for start in range(0, len(row_indexes), block_size):
+            block = np.asarray(row_indexes[start:start + block_size])
+            vectors = normalize(self.matrix[block].toarray().astype(np.float64))
+            neighbors.extend(self.search(vectors.T, n_neighbors))
+        return neighbors
+
+
+def build_neighbor_index(matrix: csr_matrix, engine: str = 'exact', n_tables: int = 8, n_bits: int = 12,
+                         seed: int = 0, normalized: csr_matrix = None, n_shards: int = None) -> CosineNeighborIndex:
+    """
+    build the nearest users index for the required engine
+    :param matrix: csr_matrix: matrix of ratings of users (one row per user)
+    :param normalized: csr_matrix: rows of matrix already l2 normalized (float64), computed if None
+    :param engine: str: 'exact' (brute force cosine), 'sharded' (brute force cosine on several cores) or 'lsh'
+    (random projection hashing)
+    :param n_tables: int: number of hash tables ('lsh' only)
+    :param n_bits: int: number of bits per hash ('lsh' only)
+    :param seed: int: seed of the random hyperplanes ('lsh' only)
+    :param n_shards: int: number of shards searched in parallel ('sharded' only, None: one per core)
+    :return: CosineNeighborIndex: nearest users index
+    """
+    if engine == 'exact':
+        return CosineNeighborIndex(matrix, normalized)
+    if engine == 'sharded':
+        return ShardedNeighborIndex(matrix, n_shards, normalized)
+    if engine == 'lsh':
+        return LSHNeighborIndex(matrix, n_tables=n_tables, n_bits=n_bits, seed=seed, normalized=normalized)
+    raise ValueError(f"unknown neighbor engine '{engine}' (expected 'exact', 'sharded' or 'lsh')")
+
+
+def neighbor_settings(engine: str = 'exact', n_tables: int = 8, n_bits: int = 12, seed: int = 0,
+                      n_shards: int = None) -> str:
+    """
+    describe the engine and the settings of a nearest users index (results computed with other settings are not used)
+    :param engine: str: 'exact', 'sharded' or 'lsh'
+    :param n_tables: int: number of hash tables ('lsh' only)
+    :param n_bits: int: number of bits per hash ('lsh' only)
+    :param seed: int: seed of the random hyperplanes ('lsh' only)
+    :param n_shards: int: number of shards searched in parallel ('sharded' only, None: one per core)
+    :return: str: engine and settings, like 'lsh tables=8 bits=12 seed=0'
+    """
+    if engine == 'sharded':
+        return f'sharded shards={n_shards or 0}'
+    if engine == 'lsh':
+        return f'lsh tables={n_tables} bits={n_bits} seed={seed}'
+    return engine
+
+
+def recall_at_k(exact: CosineNeighborIndex, approximate: CosineNeighborIndex, row_indexes: list, k: int) -> float:
+    """
+    get the mean recall@k of an approximate index compared to the exact search
+    :param exact: CosineNeighborIndex: exact index
+    :param approximate: CosineNeighborIndex: approximate index
+    :param row_indexes: list: rows used as queries
+    :param k: int: number of neighbors
+    :return: float: mean share of the exact k nearest rows found by the approximate index
+    """
+    recalls = []
+    for row_index in row_indexes:
+        expected = set(exact.kneighbors(row_index, k))
+        found = set(approximate.kneighbors(row_index, k))
+        recalls.append(len(expected & found) / k)
+    return float(np.mean(recalls))
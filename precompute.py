@@ -0,0 +1,139 @@
+"""
+precompute the recommendations of every user (nearest users, favorite author and top 5 categories sections)
+the api serves the precomputed recommendations when the file exists and matches the version of the datasets and the
+engines
+usage (from the main folder): python precompute.py [--output data/recommendations.npz] [--block-size 1024]
+"""
+from neighbors import neighbor_settings
+from config import NEIGHBOR_ENGINE, NEIGHBOR_SHARDS, LSH_N_TABLES, LSH_N_BITS
+import numpy as np
+import argparse
+import time
+import os
+
+# categories of the precomputed categories section (top 5 categories, one book per category)
+N_CATEGORIES = 5
+
+
+class PrecomputedRecommendations:
+    """
+    recommendations of every user stored in fixed size arrays (book ids padded with -1)
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: str: path of the precomputed recommendations
+        """
+        with np.load(path, allow_pickle=False) as loader:
+            self.data_version = str(loader['data_version'])
+            # engine of the collaborative section (files computed before the item engine are 'user')
+            self.engine = str(loader['engine']) if 'engine' in loader.files else 'user'
+            # engine and settings of the nearest users index (files computed before they were stored are out of date)
+            self.neighbors = str(loader['neighbors']) if 'neighbors' in loader.files else None
+            self.n_books = int(loader['n_books'])
+            self.users = loader['users']
+            self.nearest_users = loader['nearest_users']
+            self.favorite_author = loader['favorite_author']
+            self.author_codes = loader['author_codes']
+            self.authors = loader['authors']
+            self.categories = loader['categories'].tolist()
+            self.category_books = loader['category_books']
+        # user id -> row of the user
+        self.rows = {user_id: row for row, user_id in enumerate(self.users.tolist())}
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.rows
+
+    def get(self, user_id: int, n_books: int) -> dict:
+        """
+        get the recommendations of a user
+        :param user_id: int: id of user
+        :param n_books: int: number of books per section (at most the number of precomputed books)
+        :return: dict: book ids of each section, like get_recommendations
+        """
+        row = self.rows[user_id]
+
+        def books(values: np.ndarray) -> list:
+            return [book_id for book_id in values[:n_books].tolist() if book_id >= 0]
+
+        return {'user_id': user_id,
+                'nearest_users': books(self.nearest_users[row]),
+                'author': str(self.authors[self.author_codes[row]]),
+                'favorite_author': books(self.favorite_author[row]),
+                'categories': {category: books(self.category_books[row, column:column + 1])
+                               for column, category in enumerate(self.categories)}}
+
+
+def load_precomputed(path: str, data_version: str, engine: str = 'user',
+                     neighbors: str = 'exact') -> PrecomputedRecommendations:
+    """
+    load the precomputed recommendations if they exist and match the version of the datasets and the engines
+    :param path: str: path of the precomputed recommendations
+    :param data_version: str: version of the datasets
+    :param engine: str: engine of the collaborative section ('user' or 'item')
+    :param neighbors: str: engine and settings of the nearest users index (see neighbor_settings)
+    :return: PrecomputedRecommendations: precomputed recommendations (None if missing or out of date)
+    """
+    if not os.path.exists(path):
+        return None
+    precomputed = PrecomputedRecommendations(path)
+    if precomputed.data_version != data_version or precomputed.engine != engine or precomputed.neighbors != neighbors:
+        return None
+    return precomputed
+
+
+def pad(books: list, n_books: int) -> list:
+    """
+    pad a list of book ids with -1
+    :param books: list: book ids
+    :param n_books: int: size of the padded list
+    :return: list: padded book ids
+    """
+    return list(books)[:n_books] + [-1] * (n_books - len(books))
+
+
+def precompute(output: str, n_books: int = 5, block_size: int = 1024):
+    """
+    compute the recommendations of every user by blocks of users and save them
+    :param output: str: path of the precomputed recommendations
+    :param n_books: int: number of books per section
+    :param block_size: int: number of users computed at once
+    """
+    import functions
+    functions.warm_up()
+    data = functions.current()
+
+    users = np.array(sorted(data.user_ratings.user_ids), dtype=np.int64)
+    categories = functions.categories[:N_CATEGORIES]
+    nearest_users = np.full((len(users), n_books), -1, dtype=np.int32)
+    favorite_author = np.full((len(users), n_books), -1, dtype=np.int32)
+    category_books = np.full((len(users), len(categories)), -1, dtype=np.int32)
+    authors = {}
+    author_codes = np.zeros(len(users), dtype=np.int32)
+
+    start = time.perf_counter()
+    for block_start in range(0, len(users), block_size):
+        block = users[block_start:block_start + block_size].tolist()
+        recommendations = functions.get_recommendations(block, n_books, use_precomputed=False)['recommendations']
+        for row, recommendation in enumerate(recommendations, start=block_start):
+            nearest_users[row] = pad(recommendation['nearest_users'], n_books)
+            favorite_author[row] = pad(recommendation['favorite_author'], n_books)
+            category_books[row] = [pad(recommendation['categories'][category], 1)[0] for category in categories]
+            author_codes[row] = authors.setdefault(recommendation['author'], len(authors))
+        done = block_start + len(block)
+        print(f'{done}/{len(users)} users, {done / (time.perf_counter() - start):.0f} users/s')
+
+    neighbors = neighbor_settings(NEIGHBOR_ENGINE, LSH_N_TABLES, LSH_N_BITS, n_shards=NEIGHBOR_SHARDS or None)
+    np.savez(output, data_version=data.data_version, engine=functions.COLLABORATIVE_ENGINE, neighbors=neighbors,
+             n_books=n_books, users=users, nearest_users=nearest_users, favorite_author=favorite_author,
+             author_codes=author_codes, authors=np.array(list(authors)), categories=np.array(categories),
+             category_books=category_books)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='precompute the recommendations of every user')
+    parser.add_argument('--output', default='data/recommendations.npz', help='path of the precomputed recommendations')
+    parser.add_argument('--n-books', type=int, default=5, help='number of books per section')
+    parser.add_argument('--block-size', type=int, default=1024, help='number of users computed at once')
+    args = parser.parse_args()
+    precompute(args.output, args.n_books, args.block_size)
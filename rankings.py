@@ -0,0 +1,123 @@
+from typing import TYPE_CHECKING
+import numpy as np
+
+# pandas is only needed by the annotations: importing the helpers does not load it
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def weighted_rating(book_count: np.ndarray, avg_book_rating: np.ndarray, avg_rating: float,
+                    minimum_book_count: int = 3) -> np.ndarray:
+    """
+    compute the weighted rating of books (formula from IMDB)
+    https://www.datacamp.com/community/tutorials/recommender-systems-python
+    :param book_count: np.ndarray: number of time each book has been rated
+    :param avg_book_rating: np.ndarray: average rating of each book
+    :param avg_rating: float: average rating of all books
+    :param minimum_book_count: int: minimum count numbers for each book
+    :return: np.ndarray: weighted rating of each book
+    """
+    return (book_count * avg_book_rating / (
+            book_count + minimum_book_count)) + minimum_book_count * avg_rating / (
+                   book_count + minimum_book_count)
+
+
+def get_top_n_indexes(scores: np.ndarray, n: int) -> np.ndarray:
+    """
+    get the indexes of the n highest scores, sorted by descending score
+    equal scores are ordered exactly like pandas sort_values(ascending=False) orders them
+    :param scores: np.ndarray: scores
+    :param n: int: number of indexes to return
+    :return: np.ndarray: indexes of the top n scores
+    """
+    # pandas sorts the reversed array in ascending order then reverses the result
+    reversed_order = np.asarray(scores)[::-1].argsort(kind='quicksort')
+    return (len(scores) - 1 - reversed_order)[::-1][:n]
+
+
+class PopularityIndex:
+    """
+    books ranked by weighted rating, computed once: globally, by category and by author
+    a query only walks the presorted list and skips the books already read by the user
+    """
+
+    def __init__(self, books: 'pd.DataFrame', avg_rating: float):
+        """
+        :param books: pd.DataFrame: books dataset (book_id, authors, category, average_rating, work_ratings_count)
+        :param avg_rating: float: average rating of all ratings
+        """
+        # same thresholds as the selection of the top books
+        best = books['average_rating'].values > 4.5
+        # a category with too few books rated more than 4.5 falls back to the books rated more than 3.5
+        best_by_category = books['category'][best].value_counts()
+
+        # first row of each book (the weighted rating only uses the first row of a book)
+        books = books.drop_duplicates('book_id')
+        self.book_ids = books['book_id'].values
+        self.scores = weighted_rating(books['work_ratings_count'].values, books['average_rating'].values, avg_rating)
+        average_rating = books['average_rating'].values
+
+        # global ranking
+        self.top_books = self.rank(np.flatnonzero(average_rating > 4.5))
+        # ranking by category
+        self.by_category = {}
+        for category, positions in books.groupby('category', sort=False, observed=True).indices.items():
+            minimum_rating = 4.5 if best_by_category.get(category, 0) > 5 else 3.5
+            self.by_category[category] = self.rank(positions[average_rating[positions] > minimum_rating])
+        # ranking by author
+        self.by_author = {author: self.rank(positions)
+                          for author, positions in books.groupby('authors', sort=False, observed=True).indices.items()}
+
+    def rank(self, positions: np.ndarray) -> np.ndarray:
+        """
+        sort books by descending weighted rating
+        :param positions: np.ndarray: positions of the books to rank (in order of the books dataset)
+        :return: np.ndarray: ranked book ids
+        """
+        return self.book_ids[positions[get_top_n_indexes(self.scores[positions], len(positions))]]
+
+    @staticmethod
+    def walk(ranked_books: np.ndarray, n_books: int, read_books: set) -> np.ndarray:
+        """
+        get the n first books of a ranking which have not been read
+        :param ranked_books: np.ndarray: ranked book ids
+        :param n_books: int: number of books to return
+        :param read_books: set: ids of books already read by the user
+        :return: np.ndarray: top n_books ids
+        """
+        top_books = []
+        for book_id in ranked_books:
+            if len(top_books) == n_books:
+                break
+            if book_id not in read_books:
+                top_books.append(book_id)
+        return np.array(top_books, dtype=ranked_books.dtype)
+
+    def top_n_books(self, n_books: int, read_books: set) -> np.ndarray:
+        """
+        get top n books
+        :param n_books: int: number of books to return
+        :param read_books: set: ids of books already read by the user
+        :return: np.ndarray: top n_books ids
+        """
+        return self.walk(self.top_books, n_books, read_books)
+
+    def top_n_books_by_category(self, category: str, n_books: int, read_books: set) -> np.ndarray:
+        """
+        get top n books in a specific category
+        :param category: str: category of the book
+        :param n_books: int: number of books to return
+        :param read_books: set: ids of books already read by the user
+        :return: np.ndarray: top n_books ids
+        """
+        return self.walk(self.by_category.get(category, self.book_ids[:0]), n_books, read_books)
+
+    def top_n_books_by_author(self, author: str, n_books: int, read_books: set) -> np.ndarray:
+        """
+        get top n books of a specific author
+        :param author: str: author of the book
+        :param n_books: int: number of books to return
+        :param read_books: set: ids of books already read by the user
+        :return: np.ndarray: top n_books ids
+        """
+        return self.walk(self.by_author.get(author, self.book_ids[:0]), n_books, read_books)
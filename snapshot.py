@@ -0,0 +1,139 @@
+"""
+snapshot of the datasets and of every structure derived from them (indexes, rankings, precomputed results)
+a snapshot is not modified once built (only the ratings ingested by its ratings store are added): a reload builds
+the next snapshot in the background and swaps it at once, requests started before the swap end on the old snapshot
+which is freed when no request uses it anymore
+"""
+from neighbors import build_neighbor_index, neighbor_settings
+from rankings import PopularityIndex
+from data_access import BookLookup, AuthorAffinity
+from dataset import load_datasets, dataset_version
+from precompute import load_precomputed
+from item_neighbors import ItemNeighbors, load_item_neighbors
+from latent_factors import LatentFactors, load_latent_factors
+from ingest import RatingsStore, RatingsView, NeighborsView, RatingsLog
+from config import NEIGHBOR_ENGINE, NEIGHBOR_SHARDS, LSH_N_TABLES, LSH_N_BITS, DATA_DIR, DATASET_FORMAT
+from config import SHARED_DATA_DIR, PRECOMPUTED_PATH, COMPACTION_THRESHOLD, COMPACTION_INTERVAL
+from config import COLLABORATIVE_ENGINE, ITEM_NEIGHBORS_K, ITEM_NEIGHBORS_PATH
+from config import LATENT_N_COMPONENTS, LATENT_FACTORS_PATH
+import time
+
+
+def build_index(matrix):
+    """
+    build the nearest users index of a ratings matrix with the engine of the settings
+    :param matrix: csr_matrix: matrix of ratings of users
+    :return: CosineNeighborIndex: nearest users index
+    """
+    return build_neighbor_index(matrix, NEIGHBOR_ENGINE, n_tables=LSH_N_TABLES, n_bits=LSH_N_BITS,
+                                n_shards=NEIGHBOR_SHARDS or None)
+
+
+class Snapshot:
+    """
+    datasets and derived structures of one load of the datasets
+    """
+
+    def __init__(self, version: int, book_matrix, books, normalized_matrix, ratings_store: RatingsStore,
+                 book_lookup: BookLookup, author_affinity: AuthorAffinity, popularity_index: PopularityIndex,
+                 data_version: str, precomputed=None, item_neighbors=None, latent_factors=None):
+        """
+        :param version: int: number of the snapshot (1 for the snapshot loaded at startup)
+        :param book_matrix: csr_matrix: matrix of ratings of users of the datasets
+        :param books: pd.DataFrame: books_with_cat without titles and image urls
+        :param normalized_matrix: csr_matrix: normalized ratings matrix if stored (can be None)
+        :param ratings_store: RatingsStore: ratings of the datasets plus ingested ratings
+        :param book_lookup: BookLookup: position, title and image url of each book
+        :param author_affinity: AuthorAffinity: number and sum of the ratings of each user for each author
+        :param popularity_index: PopularityIndex: books ranked by weighted rating
+        :param data_version: str: version of the datasets
+        :param precomputed: PrecomputedRecommendations: recommendations of every user (can be None)
+        :param item_neighbors: ItemNeighbors: similar books of each book (item engine, can be None)
+        :param latent_factors: LatentFactors: factors of users and books (latent engine, can be None)
+        """
+        self.version = version
+        self.book_matrix = book_matrix
+        self.books = books
+        self.normalized_matrix = normalized_matrix
+        self.ratings_store = ratings_store
+        # views of the ratings store (ratings of the datasets merged with the ingested ratings), held by the snapshot
+        # only: without reference cycles, the snapshot is freed as soon as the last request using it ends
+        self.user_ratings = RatingsView(ratings_store)
+        self.neighbor_index = NeighborsView(ratings_store)
+        self.book_lookup = book_lookup
+        self.author_affinity = author_affinity
+        self.popularity_index = popularity_index
+        self.data_version = data_version
+        self.precomputed = precomputed
+        self.item_neighbors = item_neighbors
+        self.latent_factors = latent_factors
+        self.built = time.time()
+
+    def cache_version(self, user_id: int = None) -> tuple:
+        """
+        part of every cache key: results of other snapshots are never read, results of a user are not read once the
+        user has new ratings (ratings of a user reach the cached results of the other users when they expire)
+        :param user_id: int: user of the results (None: results shared by every user)
+        :return: tuple: version of the datasets, of the snapshot and of the ratings of the user
+        """
+        if user_id is None:
+            return self.data_version, self.version
+        return self.data_version, self.version, self.ratings_store.updated_users.get(user_id, 0)
+
+    @classmethod
+    def build(cls, version: int = 1, ratings_log: RatingsLog = None) -> 'Snapshot':
+        """
+        load the datasets and build the derived structures
+        :param version: int: number of the snapshot
+        :param ratings_log: RatingsLog: log of the ingested ratings, replayed on the datasets (None: not logged)
+        :return: Snapshot: new snapshot
+        """
+        # load datasets (ratings matrix, ratings grouped by user, books_with_cat, normalized ratings matrix and derived
+        # structures if stored)
+        book_matrix, user_ratings, books, normalized_matrix, stored = load_datasets(DATA_DIR, DATASET_FORMAT,
+                                                                                    SHARED_DATA_DIR)
+        # build the nearest users index once (normalized rows of book_matrix)
+        neighbor_index = build_neighbor_index(book_matrix, NEIGHBOR_ENGINE, n_tables=LSH_N_TABLES, n_bits=LSH_N_BITS,
+                                              normalized=normalized_matrix, n_shards=NEIGHBOR_SHARDS or None)
+        # position of each book in books, titles and image urls stored in string arenas (memory mapped if stored)
+        book_lookup = BookLookup(books, stored.get('titles'), stored.get('image_urls'))
+        # ratings ingested while the api runs (replayed from the ratings log) are merged with the datasets:
+        # user_ratings and neighbor_index are read through views of the ratings store (book_matrix stays the matrix
+        # of the datasets)
+        ratings_store = RatingsStore(user_ratings, book_matrix, neighbor_index, build_index, COMPACTION_THRESHOLD,
+                                     COMPACTION_INTERVAL, ratings_log, book_lookup)
+        # titles and image urls are only read from the string arenas (one python string per book is freed)
+        books = books.drop(columns=['title', 'image_url'], errors='ignore')
+        # number and sum of the ratings of each user for each author (favorite author of a user), memory mapped if
+        # stored with the columnar datasets
+        author_affinity = AuthorAffinity(user_ratings, book_lookup, stored.get('author_counts'),
+                                         stored.get('author_sums'))
+        # rank books by weighted rating once (globally, by category and by author)
+        popularity_index = PopularityIndex(books, user_ratings.avg_rating())
+
+        # version of the datasets, part of every cache key (with the version of the ratings of the user for the results
+        # of a user)
+        data_version = dataset_version(DATA_DIR)
+        # recommendations of every user computed offline (None if not computed for the current datasets and engines)
+        precomputed = load_precomputed(PRECOMPUTED_PATH, data_version, COLLABORATIVE_ENGINE,
+                                       neighbor_settings(NEIGHBOR_ENGINE, LSH_N_TABLES, LSH_N_BITS,
+                                                         n_shards=NEIGHBOR_SHARDS or None))
+        # similar books of each book (item engine) or factors of users and books (latent engine), computed on load
+        # if not computed offline for the current datasets
+        item_neighbors = latent_factors = None
+        if COLLABORATIVE_ENGINE == 'item':
+            item_neighbors = load_item_neighbors(ITEM_NEIGHBORS_PATH, data_version) or ItemNeighbors.build(
+                book_matrix, ITEM_NEIGHBORS_K, data_version=data_version)
+        elif COLLABORATIVE_ENGINE == 'latent':
+            latent_factors = load_latent_factors(LATENT_FACTORS_PATH, data_version) or LatentFactors.build(
+                book_matrix, LATENT_N_COMPONENTS, data_version=data_version)
+        elif COLLABORATIVE_ENGINE != 'user':
+            raise ValueError(f'unknown collaborative engine {COLLABORATIVE_ENGINE}')
+        return cls(version, book_matrix, books, normalized_matrix, ratings_store, book_lookup, author_affinity,
+                   popularity_index, data_version, precomputed, item_neighbors, latent_factors)
+
+    def close(self):
+        """
+        stop the periodic compaction of the ratings store (the snapshot is replaced)
+        """
+        self.ratings_store.close()
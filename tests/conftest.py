@@ -0,0 +1,49 @@
+"""
+fixtures of the tests: small synthetic datasets generated once per session
+the tests run from the main folder: python -m pytest tests
+"""
+import pytest
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate import generate  # noqa: E402
+from dataset import load_csv  # noqa: E402
+from neighbors import build_neighbor_index  # noqa: E402
+from ingest import RatingsStore, RatingsLog  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory) -> str:
+    """
+    synthetic datasets (csv files) with about 300 000 ratings
+    :return: str: folder of the datasets
+    """
+    output = str(tmp_path_factory.mktemp('data'))
+    generate(output, n_users=5000, n_books=2000, n_ratings=300000, n_authors=900, seed=0)
+    return output
+
+
+@pytest.fixture
+def new_store(data_dir):
+    """
+    build ratings stores of the synthetic datasets without periodic compaction
+    :return: callable: new ratings store for a log of the ingested ratings (None: not logged)
+    """
+    def new_store(log: RatingsLog = None) -> RatingsStore:
+        book_matrix, user_ratings, _, _, _ = load_csv(data_dir)
+        return RatingsStore(user_ratings, book_matrix, build_neighbor_index(book_matrix), build_neighbor_index,
+                            compaction_interval=0, log=log)
+
+    return new_store
+
+
+@pytest.fixture
+def main_folder(monkeypatch):
+    """
+    run the test from the main folder (templates are read from relative paths)
+    """
+    monkeypatch.chdir(ROOT)
+    return ROOT
@@ -0,0 +1,29 @@
+from snapshot import Snapshot
+from cache import LRUCache
+
+
+def test_ratings_of_a_user_invalidate_the_results_of_the_user_only(new_store):
+    data = Snapshot(1, None, None, None, new_store(), None, None, None, 'data')
+    cache = LRUCache(16, 600, version=data.cache_version)
+    calls = []
+
+    @cache.memoize(user='user_id')
+    def recommend(user_id: int = None, n: int = 1):
+        calls.append(user_id)
+        return user_id
+
+    for user_id in (1, 2, None):
+        recommend(user_id)
+    cache.set('page', 'html', user_id=2)
+    data.ratings_store.ingest([(1, 1, 5)])
+    # results of the other users and shared results are still read
+    for user_id in (1, 2, None):
+        recommend(user_id)
+    assert calls == [1, 2, None, 1]
+    assert cache.get('page', user_id=2) == 'html'
+    assert cache.get('page', user_id=1) is None
+    # user id passed by keyword
+    recommend(user_id=2)
+    data.ratings_store.ingest([(2, 1, 5)])
+    recommend(user_id=2)
+    assert calls[4:] == [2, 2]
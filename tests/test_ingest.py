@@ -0,0 +1,81 @@
+from ingest import RatingsStore, RatingsLog
+import threading
+import pytest
+import time
+
+
+@pytest.fixture
+def store(new_store) -> RatingsStore:
+    return new_store()
+
+
+def test_known_users_and_next_user_ids_are_accepted(store):
+    next_user_id = store.state.next_user_id
+    assert next_user_id == store.state.matrix.shape[0] + 1
+    result = store.ingest([(1, 1, 5), (next_user_id, 2, 4), (next_user_id + 1, 3, 3), (next_user_id, 4, 2)])
+    assert result['ingested'] == 4
+    assert store.state.next_user_id == next_user_id + 2
+    store.compact()
+    assert store.state.matrix.shape[0] == next_user_id + 1
+
+
+@pytest.mark.parametrize('user_id', [0, -1, 50000000])
+def test_other_user_ids_are_rejected(store, user_id):
+    with pytest.raises(ValueError, match='next free user id'):
+        store.ingest([(1, 1, 5), (user_id, 1, 5)])
+    # nothing is ingested and the matrix does not grow
+    assert store.version == 0
+    assert store.stats()['next_user_id'] == store.state.matrix.shape[0] + 1
+
+
+def test_skipped_user_ids_are_rejected(store):
+    next_user_id = store.state.next_user_id
+    with pytest.raises(ValueError):
+        store.ingest([(next_user_id + 1, 1, 5)])
+    # replayed ratings skip the invalid ones
+    assert store.ingest([(next_user_id + 1, 1, 5), (next_user_id, 1, 5)], strict=False)['ingested'] == 1
+
+
+def test_one_compaction_is_scheduled(store):
+    calls = []
+    # compactions are counted, not run: the scheduled compaction stays pending
+    store.compact = lambda: calls.append(threading.current_thread())
+    store.compaction_interval = 60
+    store.ingest([(1, 1, 5)])
+    timer = store.timer
+    store.ingest([(1, 2, 5)])
+    assert store.timer is timer
+    # threshold reached: the timer is replaced by one immediate compaction
+    store.compaction_threshold = 1
+    for book_id in range(3, 8):
+        store.ingest([(1, book_id, 5)])
+    assert timer.finished.wait(1) and store.timer is None
+    time.sleep(0.2)
+    assert len(calls) == 1
+    store.close()
+
+
+def test_log_is_shared_and_replayed(new_store, tmp_path):
+    path = str(tmp_path / 'ingested_ratings.csv')
+    # two workers sharing the log
+    first, second = new_store(RatingsLog(path)), new_store(RatingsLog(path))
+    next_user_id = first.state.next_user_id
+    first.ingest([(next_user_id, 1, 5), (1, 2, 4)])
+    # the second worker reads the ratings of the first one before its own: its new user gets the next id
+    second.ingest([(next_user_id + 1, 3, 3)])
+    with pytest.raises(ValueError):
+        second.ingest([(next_user_id + 3, 3, 3)])
+    first.sync()
+    for store in (first, second):
+        assert store.state.next_user_id == next_user_id + 2
+        assert list(store.state.history(next_user_id + 1)[1]) == [3]
+    # restart: the whole log is replayed, an incomplete last line is not read
+    with open(path, 'a') as file:
+        file.write('1,4')
+    restarted = new_store(RatingsLog(path))
+    assert set(restarted.updated_users) == {1, next_user_id, next_user_id + 1}
+    assert list(restarted.state.history(next_user_id)[2]) == [5]
+    assert restarted.stats()['pending'] == 3
+    # the cut line is skipped, the next ratings are read
+    restarted.ingest([(2, 5, 1)])
+    assert new_store(RatingsLog(path)).stats()['pending'] == 4
@@ -0,0 +1,89 @@
+"""
+memory of the structures of the api, bounded per element so that a wider type (int64 offsets, float64 ratings, python
+strings) fails the test
+"""
+from dataset import load_csv, load_columnar, convert
+from data_access import BookLookup, AuthorAffinity
+from ingest import RatingsState
+import pandas as pd
+import numpy as np
+import pytest
+import os
+
+
+def nbytes(value) -> int:
+    # imported when the test runs: benchmarks.memory imports functions, which reads the templates of the main folder
+    from benchmarks import memory
+    return memory.nbytes(value)
+
+
+@pytest.fixture(scope='module', params=['csv', 'columnar'])
+def datasets(request, data_dir, tmp_path_factory) -> tuple:
+    """
+    datasets and derived structures in the csv and columnar formats
+    :return: tuple: (book_matrix, user_ratings, books, book_lookup, author_affinity)
+    """
+    if request.param == 'csv':
+        book_matrix, user_ratings, books, _, stored = load_csv(data_dir)
+    else:
+        columnar_dir = str(tmp_path_factory.mktemp('columnar'))
+        convert(data_dir, columnar_dir)
+        book_matrix, user_ratings, books, _, stored = load_columnar(columnar_dir)
+    book_lookup = BookLookup(books, stored.get('titles'), stored.get('image_urls'))
+    author_affinity = AuthorAffinity(user_ratings, book_lookup, stored.get('author_counts'), stored.get('author_sums'))
+    books = books.drop(columns=['title', 'image_url'], errors='ignore')
+    return book_matrix, user_ratings, books, book_lookup, author_affinity
+
+
+def matrix_bound(book_matrix) -> int:
+    # float32 rating and int32 column of each rating, int32 offset of each row
+    return 8 * book_matrix.nnz + 4 * (book_matrix.shape[0] + 1)
+
+
+def ratings_bound(user_ratings) -> int:
+    # int32 row, int16 book id and int8 rating of each rating, int32 offset, int32 slot and int16 id of each user
+    return 7 * len(user_ratings.ratings) + 10 * (int(user_ratings.users.max()) + 2)
+
+
+def test_book_matrix(datasets):
+    book_matrix = datasets[0]
+    assert book_matrix.data.dtype == np.float32
+    assert nbytes(book_matrix) <= matrix_bound(book_matrix)
+
+
+def test_user_ratings(datasets):
+    user_ratings = datasets[1]
+    assert nbytes(user_ratings) <= ratings_bound(user_ratings)
+
+
+def test_books(datasets):
+    books = datasets[2]
+    # numeric columns, category codes and the distinct authors and categories
+    assert nbytes(books) <= 64 * len(books)
+
+
+def test_book_lookup(datasets, data_dir):
+    book_lookup = datasets[3]
+    books = pd.read_csv(os.path.join(data_dir, 'books_with_cat.csv'))
+    # utf-8 bytes of the strings and one int32 offset per string, no python string
+    for arena, column in ((book_lookup.titles, 'title'), (book_lookup.image_urls, 'image_url')):
+        assert arena.nbytes <= sum(len(value.encode('utf-8')) for value in books[column]) + 4 * (len(books) + 1)
+        assert list(arena[np.arange(len(arena))]) == books[column].tolist()
+    assert book_lookup.position.nbytes <= 4 * (books['book_id'].max() + 1)
+
+
+def test_author_affinity(datasets):
+    author_affinity = datasets[4]
+    # int16 count and sum, int32 author code of each (user, author) pair, int32 offset of each user in both matrices
+    counts, sums = author_affinity.counts, author_affinity.sums
+    assert nbytes([counts, sums]) <= 12 * sums.nnz + 8 * (sums.shape[0] + 1)
+
+
+def test_compacted(datasets):
+    book_matrix, user_ratings = datasets[:2]
+    state = RatingsState(user_ratings, book_matrix, None)
+    user_id = int(user_ratings.users[0])
+    rating = (user_id, int(user_ratings.books(user_id)[0]), 5)
+    compacted_ratings, compacted_matrix, _ = state.apply([rating]).compacted(lambda matrix: None)
+    assert nbytes(compacted_matrix) <= matrix_bound(compacted_matrix)
+    assert nbytes(compacted_ratings) <= ratings_bound(compacted_ratings)
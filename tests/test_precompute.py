@@ -0,0 +1,28 @@
+from precompute import load_precomputed
+from neighbors import neighbor_settings
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def precomputed_path(tmp_path) -> str:
+    """
+    precomputed recommendations of one user computed with the lsh engine
+    """
+    path = str(tmp_path / 'recommendations.npz')
+    np.savez(path, data_version='data', engine='user', neighbors=neighbor_settings('lsh', 8, 12), n_books=1,
+             users=np.array([1]), nearest_users=np.array([[2]]), favorite_author=np.array([[3]]),
+             author_codes=np.array([0]), authors=np.array(['author']), categories=np.array(['fantasy']),
+             category_books=np.array([[4]]))
+    return path
+
+
+def test_same_settings_are_served(precomputed_path):
+    precomputed = load_precomputed(precomputed_path, 'data', 'user', neighbor_settings('lsh', 8, 12))
+    assert precomputed.get(1, 1)['nearest_users'] == [2]
+
+
+@pytest.mark.parametrize('neighbors', [neighbor_settings('exact'), neighbor_settings('sharded', n_shards=4),
+                                       neighbor_settings('lsh', 16, 12), neighbor_settings('lsh', 8, 4)])
+def test_other_neighbor_settings_are_rejected(precomputed_path, neighbors):
+    assert load_precomputed(precomputed_path, 'data', 'user', neighbors) is None
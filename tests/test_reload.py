@@ -0,0 +1,95 @@
+import threading
+import pytest
+import time
+
+
+@pytest.fixture
+def worker(data_dir, main_folder, tmp_path, monkeypatch):
+    """
+    functions of a worker loading the synthetic datasets, restored after the test
+    """
+    import functions
+    import snapshot
+    monkeypatch.setattr(snapshot, 'DATA_DIR', data_dir)
+    monkeypatch.setattr(snapshot, 'DATASET_FORMAT', 'csv')
+    monkeypatch.setattr(snapshot, 'PRECOMPUTED_PATH', str(tmp_path / 'recommendations.npz'))
+    monkeypatch.setattr(functions, 'RATINGS_LOG_PATH', str(tmp_path / 'ingested_ratings.csv'))
+    monkeypatch.setattr(functions, 'RELOAD_MARKER_PATH', str(tmp_path / 'reload_marker'))
+    monkeypatch.setattr(functions, 'snapshot', None)
+    monkeypatch.setattr(functions, 'loaded_marker', None)
+    monkeypatch.setattr(functions, 'reloads', dict(functions.reloads))
+    functions.load()
+    yield functions
+    functions.snapshot.close()
+
+
+def wait_reloads(functions, n_reloads: int):
+    # reloads run in the background
+    deadline = time.time() + 60
+    while functions.reloads['reloads'] < n_reloads or functions.reload_lock.locked():
+        assert functions.reloads['status'] != 'failed' and time.time() < deadline
+        time.sleep(0.05)
+
+
+def test_reload_reaches_every_worker(main_folder, tmp_path, monkeypatch):
+    import functions
+    monkeypatch.setattr(functions, 'RELOAD_MARKER_PATH', str(tmp_path / 'reload_marker'))
+    reloaded = threading.Event()
+
+    def reload():
+        # the version of the marker is read when the reload starts
+        functions.loaded_marker = functions.marker_version()
+        reloaded.set()
+
+    monkeypatch.setattr(functions, 'reload', reload)
+    monkeypatch.setattr(functions, 'loaded_marker', None)
+    monkeypatch.setitem(functions.reloads, 'status', 'idle')
+    functions.follow_reloads()
+    assert not reloaded.wait(0.2)
+    # a reload received by another worker replaces the marker, this worker follows it on its next request
+    functions.replace_marker()
+    functions.follow_reloads()
+    assert reloaded.wait(5)
+    reloaded.clear()
+    functions.follow_reloads()
+    assert not reloaded.wait(0.2)
+    # the worker receiving the reload announces it without reloading twice
+    assert functions.start_reload() and reloaded.wait(5)
+    reloaded.clear()
+    functions.follow_reloads()
+    assert not reloaded.wait(0.2)
+
+
+def test_reload_swaps_the_snapshot_of_every_worker(worker):
+    started, swapped = threading.Event(), threading.Event()
+    versions, pages = [], []
+
+    def request():
+        # request started before the swap, computed after it
+        with worker.pin(worker.current()):
+            started.set()
+            swapped.wait(60)
+            versions.append(worker.current().version)
+            pages.append(''.join(worker.iter_html(1, None, False)))
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    assert started.wait(60)
+    # marker seen by a second worker which loaded the datasets before the reload
+    second_worker_marker = worker.loaded_marker
+    assert worker.start_reload()
+    wait_reloads(worker, 1)
+    assert worker.snapshot.version == 2 and len(worker.retired) == 1
+    swapped.set()
+    thread.join()
+    # the request ended on the old snapshot, which is freed with it
+    assert versions == [1] and pages[0]
+    assert len(worker.retired) == 0
+    # the worker receiving the reload does not reload twice
+    worker.follow_reloads()
+    assert not worker.reload_lock.locked() and worker.reloads['reloads'] == 1
+    # the second worker sees the new marker on its next request and reloads the datasets too
+    worker.loaded_marker = second_worker_marker
+    worker.follow_reloads()
+    wait_reloads(worker, 2)
+    assert worker.snapshot.version == 3 and worker.loaded_marker == worker.marker_version()
@@ -0,0 +1,32 @@
+from benchmarks.shared_workers import run, baseline, check
+import pytest
+import shutil
+import os
+
+
+@pytest.fixture
+def shared_dir(data_dir, main_folder, monkeypatch):
+    """
+    workers load the synthetic datasets, shared files in a folder of the test
+    """
+    shared_dir = f'/dev/shm/books_recommendation_test_{os.getpid()}'
+    monkeypatch.setenv('DATA_DIR', data_dir)
+    monkeypatch.setenv('SHARED_DATA_DIR', shared_dir)
+    monkeypatch.setenv('WARM_UP_QUERIES', '1')
+    # set by run for the workers, restored after the test
+    monkeypatch.setenv('DATASET_FORMAT', 'shared')
+    yield shared_dir
+    shutil.rmtree(shared_dir, ignore_errors=True)
+    if os.path.exists(shared_dir + '.lock'):
+        os.remove(shared_dir + '.lock')
+
+
+def test_shared_workers_same_data_and_small_private_memory(shared_dir):
+    results = run('shared', 2, timeout=300)
+    assert check(results, baseline(), max_private_mb=64) == []
+
+
+def test_failing_worker_is_reported(shared_dir):
+    # no columnar files in the folder of the synthetic datasets: every worker fails to load them
+    with pytest.raises(RuntimeError, match='no columnar dataset'):
+        run('columnar', 2, timeout=300)